@@ -4,8 +4,9 @@ from flask_cors import CORS
 from flask_bcrypt import Bcrypt
 from flask_jwt_extended import JWTManager
 from config import Config
+from app.replicas import RoutingSession
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 bcrypt = Bcrypt()
 jwt = JWTManager()
 
@@ -13,20 +14,91 @@ def create_app(config_class=Config):
     app = Flask(__name__)
     app.config.from_object(config_class)
 
+    # 位于 Nginx 等反向代理之后时从 X-Forwarded-For 获取客户端 IP
+    if app.config['PROXY_FIX_X_FOR']:
+        from werkzeug.middleware.proxy_fix import ProxyFix
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['PROXY_FIX_X_FOR'])
+
+    # JSON 序列化（安装了 orjson 时使用 orjson）
+    from app.serialization import init_json
+    init_json(app)
+
+    # 连接池参数
+    from app.pool import engine_options, init_pool_metrics
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config)
+
     # 初始化扩展
     db.init_app(app)
     bcrypt.init_app(app)
     jwt.init_app(app)
     CORS(app)
 
+    # 密码哈希线程池和登录限流
+    from app.security import init_security
+    init_security(app)
+
+    # JWT 用户身份加载和缓存
+    from app.identity import init_identity
+    init_identity(app)
+
+    # 后台任务（写请求入队，请求结束后由后台线程或独立 worker 执行）
+    from app.jobs import init_jobs
+    init_jobs(app)
+
     # 注册蓝图
     from app.routes import bp as api_bp
     from app.auth import bp as auth_bp
     app.register_blueprint(api_bp, url_prefix='/api')
     app.register_blueprint(auth_bp, url_prefix='/api/auth')
 
-    # 创建数据库表
+    # 响应缓存
+    from app.cache import init_cache
+    init_cache(app)
+
+    # 注册维护命令
+    from app.commands import register_commands
+    register_commands(app)
+
     with app.app_context():
+        # 连接池指标
+        init_pool_metrics(app, db.engine)
+
+        # SQLite 连接上注册解压正文的 SQL 函数（全文索引触发器使用），须在建立连接之前
+        from app.content import register_sqlite_functions, migrate_legacy_content
+        register_sqlite_functions(db.engine)
+
+        # 请求剖析和 SQL 统计
+        from app.profiling import init_profiling
+        init_profiling(app, db.engine)
+
+        # 只读副本
+        from app.replicas import init_replicas
+        init_replicas(app)
+
+        # 响应压缩（after_request 按注册的逆序执行，在剖析之后注册，剖析记录的是压缩后的大小）
+        from app.compression import init_compression
+        init_compression(app)
+
+        # 创建数据库表
         db.create_all()
 
+        # 旧版本 snippets.content 列中的正文迁移到 snippet_contents
+        migrate_legacy_content(app)
+
+        # 旧版本逗号分隔 tags 列回填到 tags / snippet_tags 表
+        from app.tags import migrate_legacy_tags
+        migrate_legacy_tags(app)
+
+        # 创建全文搜索索引
+        from app.search import init_search
+        init_search(app)
+
+        # 模糊搜索（pg_trgm 索引或进程内 trigram 索引）
+        from app.fuzzy import init_fuzzy
+        init_fuzzy(app)
+
+        # 相似片段搜索（片段向量）
+        from app.embeddings import init_embeddings
+        init_embeddings(app)
+
     return app
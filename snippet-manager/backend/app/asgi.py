@@ -0,0 +1,114 @@
+"""
+ASGI 部署模式（uvicorn asgi:app）
+- 连接由事件循环管理：空闲的 keep-alive 连接、慢速上传的请求体都在事件循环中等待，不占用线程
+- 请求体读完后才把请求交给线程池中的 Flask 应用执行，路由和模型与 WSGI 模式完全相同
+- 响应经队列交回事件循环发送，小响应不会因为客户端接收慢而占住线程
+数据库访问仍是同步的：视图执行期间（包括等待慢查询）占用一个 ASGI_THREADS 线程，与 gunicorn 的线程相同
+需要安装 requirements-asgi.txt 中的 uvicorn 和 a2wsgi
+"""
+import json
+import tempfile
+
+try:
+    from a2wsgi import WSGIMiddleware
+except ImportError:
+    WSGIMiddleware = None
+
+# 回放请求体时每次交给 WSGI 的块大小
+REPLAY_CHUNK_SIZE = 64 * 1024
+
+
+async def _json_response(send, status, data):
+    """发送一个 JSON 响应"""
+    body = json.dumps(data, separators=(',', ':')).encode('utf-8')
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())],
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+class BodyTooLarge(Exception):
+    """请求体超过 MAX_CONTENT_LENGTH"""
+
+
+async def _read_body(receive, memory_limit, max_size=None):
+    """
+    在事件循环中读完请求体，超过 memory_limit 时写入临时文件；客户端断开时返回 None
+    按实际读到的字节数检查 max_size（分块传输的请求没有 Content-Length），超过时抛出 BodyTooLarge
+    """
+    body = tempfile.SpooledTemporaryFile(max_size=memory_limit)
+    size = 0
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            body.close()
+            return None
+        chunk = message.get('body', b'')
+        size += len(chunk)
+        if max_size is not None and size > max_size:
+            body.close()
+            raise BodyTooLarge()
+        body.write(chunk)
+        if not message.get('more_body', False):
+            body.seek(0)
+            return body
+
+
+def _replay(body, receive):
+    """把已读完的请求体按块重新交给 WSGI 适配层，之后的消息（如断开）由原 receive 提供"""
+    done = False
+
+    async def replay():
+        nonlocal done
+        if done:
+            return await receive()
+        chunk = body.read(REPLAY_CHUNK_SIZE)
+        if len(chunk) < REPLAY_CHUNK_SIZE:
+            done = True
+        return {'type': 'http.request', 'body': chunk, 'more_body': not done}
+    return replay
+
+
+class AsgiApp:
+    """把 Flask 应用包装为 ASGI 应用"""
+
+    def __init__(self, flask_app):
+        if WSGIMiddleware is None:
+            raise RuntimeError('ASGI 模式需要安装 a2wsgi 包')
+        config = flask_app.config
+        self.flask_app = flask_app
+        self.wsgi = WSGIMiddleware(flask_app, workers=config['ASGI_THREADS'],
+                                   send_queue_size=config['ASGI_SEND_QUEUE_SIZE'])
+        self.body_memory_limit = config['ASGI_BODY_MEMORY_LIMIT']
+        self.max_body_size = config.get('MAX_CONTENT_LENGTH')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.wsgi(scope, receive, send)
+            return
+
+        # 声明的长度已超出时不读请求体，直接拒绝
+        if self.max_body_size is not None:
+            length = dict(scope['headers']).get(b'content-length')
+            if length and length.isdigit() and int(length) > self.max_body_size:
+                await _json_response(send, 413, {'error': '请求体过大'})
+                return
+
+        try:
+            body = await _read_body(receive, self.body_memory_limit, self.max_body_size)
+        except BodyTooLarge:
+            await _json_response(send, 413, {'error': '请求体过大'})
+            return
+        if body is None:
+            return
+        try:
+            await self.wsgi(scope, _replay(body, receive), send)
+        finally:
+            body.close()
+
+
+def create_asgi_app(flask_app):
+    """创建 ASGI 应用"""
+    return AsgiApp(flask_app)
@@ -1,7 +1,11 @@
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import create_access_token, create_refresh_token
 from app import db
+from app.identity import current_user, user_claims, user_from_claims
 from app.models import User
+from app.replicas import use_replica
+from app.security import check_login_rate
+import math
 import re
 
 bp = Blueprint('auth', __name__)
@@ -15,9 +19,20 @@ def validate_password(password):
     """验证密码强度：至少8个字符"""
     return len(password) >= 8
 
+def too_many_requests(wait):
+    """返回 429 响应"""
+    response = jsonify({'error': '请求过于频繁，请稍后再试'})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(math.ceil(wait))
+    return response
+
 @bp.route('/register', methods=['POST'])
 def register():
     """用户注册"""
+    wait = check_login_rate(request.remote_addr)
+    if wait:
+        return too_many_requests(wait)
+
     data = request.get_json()
 
     # 验证必需字段
@@ -56,7 +71,7 @@ def register():
     db.session.commit()
 
     # 生成token
-    access_token = create_access_token(identity=user.id)
+    access_token = create_access_token(identity=user.id, additional_claims=user_claims(user))
     refresh_token = create_refresh_token(identity=user.id)
 
     return jsonify({
@@ -77,14 +92,24 @@ def login():
     if not username or not password:
         return jsonify({'error': '用户名和密码不能为空'}), 400
 
+    # 按 IP 和用户名限流，在查询和计算哈希之前拒绝
+    wait = check_login_rate(request.remote_addr, username)
+    if wait:
+        return too_many_requests(wait)
+
     # 查找用户
     user = User.query.filter_by(username=username).first()
 
     if not user or not user.check_password(password):
         return jsonify({'error': '用户名或密码错误'}), 401
 
+    # cost 配置变化后，登录成功时透明地重新计算哈希
+    if user.password_needs_rehash():
+        user.set_password(password)
+        db.session.commit()
+
     # 生成token
-    access_token = create_access_token(identity=user.id)
+    access_token = create_access_token(identity=user.id, additional_claims=user_claims(user))
     refresh_token = create_refresh_token(identity=user.id)
 
     return jsonify({
@@ -102,24 +127,25 @@ def refresh():
     @jwt_required(refresh=True)
     def _refresh():
         current_user_id = get_jwt_identity()
-        new_access_token = create_access_token(identity=current_user_id)
+        user = current_user()
+        if user is None:
+            return jsonify({'error': '用户不存在'}), 401
+        new_access_token = create_access_token(identity=current_user_id, additional_claims=user_claims(user))
         return jsonify({'access_token': new_access_token}), 200
 
     return _refresh()
 
 @bp.route('/me', methods=['GET'])
 def get_current_user():
-    """获取当前用户信息"""
-    from flask_jwt_extended import jwt_required, get_jwt_identity
+    """获取当前用户信息，token 中带有用户字段时直接返回，旧 token 通过身份缓存加载"""
+    from flask_jwt_extended import jwt_required, get_jwt, get_jwt_identity
 
     @jwt_required()
+    @use_replica
     def _get_current_user():
-        current_user_id = get_jwt_identity()
-        user = User.query.get(current_user_id)
-
-        if not user:
+        user = user_from_claims(get_jwt_identity(), get_jwt()) or current_user()
+        if user is None:
             return jsonify({'error': '用户不存在'}), 404
-
-        return jsonify(user.to_dict()), 200
+        return jsonify(user), 200
 
     return _get_current_user()
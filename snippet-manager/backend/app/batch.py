@@ -0,0 +1,144 @@
+"""
+批量修改片段
+每个操作对一组 id 执行一条 UPDATE / DELETE ... WHERE id IN (...) AND user_id = ?，
+修改版本字段时用 INSERT ... SELECT 记录修改前后的历史版本，全部操作在同一个事务中提交
+"""
+from app import db
+from app.models import Snippet, snippet_tags
+from app.revisions import STATE_FIELDS, delete_revisions, record_batch_after, record_batch_before
+
+OPERATIONS = ('delete', 'favorite', 'update')
+
+# update 操作允许批量修改的字段及其最大长度（None 表示不限制），is_favorite 为布尔值，其余为字符串
+UPDATABLE_FIELDS = {'title': 200, 'description': None, 'snippet_type': 20, 'language': 50, 'is_favorite': None}
+
+# 可以批量设为 null 的字段
+NULLABLE_FIELDS = ('description', 'language')
+
+MAX_BATCH_IDS = 5000
+
+# 参与片段向量计算的字段（app.embeddings）
+TEXT_FIELDS = ('title', 'description')
+
+# 单条语句中 IN 列表的最大长度
+CHUNK_SIZE = 500
+
+
+class BatchError(ValueError):
+    """批量请求格式无效"""
+
+
+def _chunks(ids):
+    """把 id 列表切成多段"""
+    for start in range(0, len(ids), CHUNK_SIZE):
+        yield ids[start:start + CHUNK_SIZE]
+
+
+def parse_operations(data):
+    """校验请求体，返回 [(op, ids, values), ...]"""
+    operations = data.get('operations') if isinstance(data, dict) else None
+    if not isinstance(operations, list) or not operations:
+        raise BatchError('operations 必须是非空数组')
+
+    parsed, total = [], 0
+    for index, operation in enumerate(operations):
+        if not isinstance(operation, dict) or operation.get('op') not in OPERATIONS:
+            raise BatchError(f'第 {index + 1} 个操作无效，op 必须是 {"/".join(OPERATIONS)} 之一')
+
+        ids = operation.get('ids')
+        if not isinstance(ids, list) or not all(isinstance(i, int) and not isinstance(i, bool) for i in ids):
+            raise BatchError(f'第 {index + 1} 个操作的 ids 必须是整数数组')
+        ids = list(dict.fromkeys(ids))
+        total += len(ids)
+        if total > MAX_BATCH_IDS:
+            raise BatchError(f'单次最多处理 {MAX_BATCH_IDS} 个片段')
+
+        op = operation['op']
+        values = {}
+        if op == 'favorite':
+            value = operation.get('value', True)
+            if not isinstance(value, bool):
+                raise BatchError(f'第 {index + 1} 个操作的 value 必须是布尔值')
+            values = {'is_favorite': value}
+        elif op == 'update':
+            fields = operation.get('fields')
+            if not isinstance(fields, dict) or not fields:
+                raise BatchError(f'第 {index + 1} 个操作缺少 fields')
+            unknown = set(fields) - set(UPDATABLE_FIELDS)
+            if unknown:
+                raise BatchError(f'不支持批量修改的字段: {", ".join(sorted(unknown))}')
+            for name, value in fields.items():
+                limit = UPDATABLE_FIELDS[name]
+                if value is None:
+                    if name not in NULLABLE_FIELDS:
+                        raise BatchError(f'第 {index + 1} 个操作的 {name} 不能为 null')
+                elif name == 'is_favorite':
+                    if not isinstance(value, bool):
+                        raise BatchError(f'第 {index + 1} 个操作的 is_favorite 必须是布尔值')
+                elif not isinstance(value, str):
+                    raise BatchError(f'第 {index + 1} 个操作的 {name} 必须是字符串')
+                elif name == 'title' and not value:
+                    raise BatchError('标题不能为空')
+                elif limit and len(value) > limit:
+                    raise BatchError(f'{name} 长度不能超过 {limit}')
+                values[name] = value
+        parsed.append((op, ids, values))
+    return parsed
+
+
+def _owned_ids(user_id, ids):
+    """返回 ids 中属于该用户的 id 集合"""
+    owned = set()
+    for chunk in _chunks(ids):
+        owned.update(db.session.scalars(
+            db.select(Snippet.id).where(Snippet.id.in_(chunk), Snippet.user_id == user_id)
+        ))
+    return owned
+
+
+def _changed_fields(ids, values):
+    """返回 {id: 值会改变的字段集合}，只包含至少有一个字段改变的片段（不比较 is_favorite）"""
+    fields = [name for name in values if name != 'is_favorite']
+    if not fields:
+        return {}
+    differs = [
+        (db.func.coalesce(getattr(Snippet, name), '') != ('' if values[name] is None else values[name])).label(name)
+        for name in fields
+    ]
+    rows = db.session.execute(
+        db.select(Snippet.id, *differs).where(Snippet.id.in_(ids), db.or_(*differs))
+    ).all()
+    return {row.id: {name for name in fields if getattr(row, name)} for row in rows}
+
+
+def apply_operations(user_id, operations):
+    """
+    执行批量操作（不提交事务）
+    返回 (每个 id 的结果, 标题或描述改变、需要重新计算向量的片段 id 列表)
+    """
+    results, text_changed = [], []
+    for op, ids, values in operations:
+        owned = _owned_ids(user_id, ids)
+        targets = [i for i in ids if i in owned]
+
+        for chunk in _chunks(targets):
+            versioned = []
+            if op == 'delete':
+                db.session.execute(db.delete(snippet_tags).where(snippet_tags.c.snippet_id.in_(chunk)))
+                delete_revisions(chunk)
+                statement = db.delete(Snippet)
+            else:
+                changed = _changed_fields(chunk, values)
+                text_changed.extend(i for i, fields in changed.items() if fields & set(TEXT_FIELDS))
+                # 与逐个修改相同，标题、描述等版本字段的修改记录历史版本
+                versioned = [i for i, fields in changed.items() if fields & set(STATE_FIELDS)]
+                record_batch_before(versioned)
+                statement = db.update(Snippet).values(values)
+            db.session.execute(
+                statement.where(Snippet.id.in_(chunk), Snippet.user_id == user_id),
+                execution_options={'synchronize_session': False}
+            )
+            record_batch_after(versioned)
+
+        results.extend({'id': i, 'op': op, 'status': 'ok' if i in owned else 'not_found'} for i in ids)
+    return results, list(dict.fromkeys(text_changed))
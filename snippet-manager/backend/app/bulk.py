@@ -0,0 +1,162 @@
+"""
+批量导入 / 流式导出
+导入按批次使用多行 INSERT ... RETURNING 写入，全部批次在同一个事务中提交；
+导出逐批从数据库读取并以 NDJSON 流式输出，不在内存中保留完整列表
+"""
+import json
+from datetime import datetime
+from app import db
+from app.models import Snippet, Tag, TagError, parse_tags, snippet_tags
+from app.content import store_contents
+from app.serialization import snippet_columns, snippet_rows, with_content
+
+# 导出不包含 user_id，导出文件可以直接导入到其他账号
+EXPORT_FIELDS = tuple(name for name in Snippet.FIELDS if name != 'user_id')
+
+# 与列定义一致的长度限制，提前校验避免整批写入失败
+MAX_LENGTHS = {'title': 200, 'snippet_type': 20, 'language': 50, 'tags': 500}
+
+
+class RowError(ValueError):
+    """单行数据无效"""
+
+
+def _parse_datetime(value, name):
+    """解析可选的 ISO 格式时间"""
+    if value in (None, ''):
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise RowError(f'{name} 不是有效的时间格式')
+
+
+def validate_row(data):
+    """校验一行导入数据，返回 (列值, 标签列表)"""
+    if not isinstance(data, dict):
+        raise RowError('每条记录必须是 JSON 对象')
+    if not data.get('title') or not data.get('content'):
+        raise RowError('标题和内容不能为空')
+
+    try:
+        tags = parse_tags(data.get('tags'))
+    except TagError as e:
+        raise RowError(str(e))
+    values = {
+        'title': str(data['title']),
+        'content': str(data['content']),
+        'description': str(data.get('description') or ''),
+        'snippet_type': str(data.get('snippet_type') or 'code'),
+        'language': str(data.get('language') or ''),
+        'tags': ','.join(tags),
+        'is_favorite': bool(data.get('is_favorite', False)),
+    }
+    for name, limit in MAX_LENGTHS.items():
+        if len(values[name]) > limit:
+            raise RowError(f'{name} 长度不能超过 {limit}')
+
+    created_at = _parse_datetime(data.get('created_at'), 'created_at')
+    updated_at = _parse_datetime(data.get('updated_at'), 'updated_at')
+    if created_at:
+        values['created_at'] = created_at
+    if updated_at or created_at:
+        values['updated_at'] = updated_at or created_at
+    return values, tags
+
+
+def iter_records(stream, is_ndjson, data=None):
+    """逐条产生 (行号, 记录)，NDJSON 按行解析，JSON 数组按元素"""
+    if not is_ndjson:
+        if not isinstance(data, list):
+            raise RowError('请求体必须是 JSON 数组或 NDJSON')
+        yield from enumerate(data, 1)
+        return
+
+    for line_no, line in enumerate(stream, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield line_no, json.loads(line)
+        except ValueError:
+            yield line_no, RowError('不是有效的 JSON')
+
+
+def _link_tags(user_id, snippet_ids, tag_lists):
+    """为一批新片段创建标签关联"""
+    names = {name for tags in tag_lists for name in tags}
+    if not names:
+        return
+
+    tag_ids = dict(db.session.execute(
+        db.select(Tag.name, Tag.id).where(Tag.user_id == user_id, Tag.name.in_(names))
+    ).all())
+    missing = sorted(names - tag_ids.keys())
+    if missing:
+        new_ids = db.session.scalars(
+            db.insert(Tag).returning(Tag.id, sort_by_parameter_order=True),
+            [{'user_id': user_id, 'name': name} for name in missing]
+        ).all()
+        tag_ids.update(zip(missing, new_ids))
+
+    db.session.execute(db.insert(snippet_tags), [
+        {'snippet_id': snippet_id, 'tag_id': tag_ids[name]}
+        for snippet_id, tags in zip(snippet_ids, tag_lists)
+        for name in tags
+    ])
+
+
+def insert_batch(user_id, rows):
+    """插入一批 (列值, 标签列表)，返回新片段 id 列表，不提交事务"""
+    if not rows:
+        return []
+    # 正文先写入 snippet_contents，重复的正文只存一份
+    hashes = store_contents([values['content'] for values, _ in rows])
+    ids = db.session.scalars(
+        db.insert(Snippet).returning(Snippet.id, sort_by_parameter_order=True),
+        [{**{key: value for key, value in values.items() if key != 'content'},
+          'content_hash': digest, 'user_id': user_id}
+         for (values, _), digest in zip(rows, hashes)]
+    ).all()
+    _link_tags(user_id, ids, [tags for _, tags in rows])
+    return ids
+
+
+def import_records(user_id, records, batch_size=500, max_rows=None):
+    """
+    校验并分批插入记录，返回 (插入数, 错误列表)
+    无效记录跳过并记录错误，有效记录在调用方的事务中写入
+    """
+    inserted, errors, batch = 0, [], []
+
+    for line_no, record in records:
+        if max_rows is not None and inserted + len(batch) + len(errors) >= max_rows:
+            errors.append({'line': line_no, 'error': f'超过单次导入上限 {max_rows} 条'})
+            break
+        try:
+            if isinstance(record, RowError):
+                raise record
+            batch.append(validate_row(record))
+        except RowError as e:
+            errors.append({'line': line_no, 'error': str(e)})
+            continue
+
+        if len(batch) >= batch_size:
+            inserted += len(insert_batch(user_id, batch))
+            batch = []
+
+    inserted += len(insert_batch(user_id, batch))
+    return inserted, errors
+
+
+def export_lines(user_id, batch_size=500):
+    """逐批产生用户片段的 NDJSON 行（读取行元组，不创建 ORM 实例）"""
+    # 按 (updated_at, id) 升序，反向扫描 ix_snippets_user_updated，不需要排序
+    query = with_content(db.select(*snippet_columns(EXPORT_FIELDS)), EXPORT_FIELDS).where(
+        Snippet.user_id == user_id
+    ).order_by(Snippet.updated_at, Snippet.id)
+    result = db.session.execute(query.execution_options(yield_per=batch_size))
+    for rows in result.partitions():
+        yield ''.join(
+            json.dumps(item, ensure_ascii=False) + '\n' for item in snippet_rows(rows, EXPORT_FIELDS)
+        )
@@ -0,0 +1,226 @@
+"""
+按用户缓存 GET 接口的响应
+缓存键 = 用户 + 数据代数 + 路径 + 规范化的查询参数；用户执行写操作后代数加一，
+旧的缓存条目不再可达，由 LRU / TTL 自然淘汰
+
+后端：
+- memory: 进程内 LRU，只能用于单进程部署（多个 worker 之间不共享失效信息，gunicorn 多 worker 时拒绝启动）
+- redis: 多 worker / 多实例共享，需要安装 redis 包并配置 RESPONSE_CACHE_REDIS_URL
+"""
+import json
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from flask import current_app, request
+from flask_jwt_extended import get_jwt_identity
+from app.etag import is_fresh, not_modified, with_etag
+
+# 不随响应体缓存的响应头（命中时重新生成或不应重复发送）
+UNCACHED_HEADERS = ('content-length', 'etag', 'set-cookie')
+
+
+class LRUCache:
+    """线程安全的进程内 LRU 缓存，带 TTL 和条目数上限"""
+
+    def __init__(self, max_entries=1024, ttl=60):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data = OrderedDict()
+        # 计数器单独按 LRU 淘汰；取值来自全局递增序列，被淘汰后重新分配的值不会与旧值相同，
+        # 因此不会回退到旧代数而命中旧条目
+        self._counters = OrderedDict()
+        self._sequence = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """读取条目，过期时返回 None"""
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires = item
+            if expires < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        """写入条目，超过上限时淘汰最久未使用的条目"""
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        """删除条目"""
+        with self._lock:
+            self._data.pop(key, None)
+
+    def _assign(self, key):
+        """给计数器分配序列中的下一个值，计数器数超过上限时淘汰最久未使用的"""
+        self._sequence += 1
+        self._counters[key] = self._sequence
+        self._counters.move_to_end(key)
+        while len(self._counters) > self.max_entries:
+            self._counters.popitem(last=False)
+        return self._sequence
+
+    def counter(self, key):
+        """读取计数器，不存在（或已被淘汰）时分配新值"""
+        with self._lock:
+            value = self._counters.get(key)
+            if value is None:
+                return self._assign(key)
+            self._counters.move_to_end(key)
+            return value
+
+    def incr(self, key):
+        """改变计数器的值，返回新值"""
+        with self._lock:
+            return self._assign(key)
+
+
+class RedisCache:
+    """Redis 缓存后端"""
+
+    def __init__(self, url, ttl=60, prefix='snippets:cache:'):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError('RESPONSE_CACHE=redis 需要安装 redis 包')
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, key):
+        """读取条目"""
+        return self.client.get(self.prefix + key)
+
+    def set(self, key, value):
+        """写入条目并设置 TTL"""
+        self.client.set(self.prefix + key, value, ex=self.ttl)
+
+    def counter(self, key):
+        """读取计数器"""
+        value = self.client.get(self.prefix + key)
+        return int(value) if value else 0
+
+    def incr(self, key):
+        """计数器加一（不过期），返回新值"""
+        return self.client.incr(self.prefix + key)
+
+
+class ResponseCache:
+    """响应缓存，记录命中 / 未命中次数"""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def _count(self, hit):
+        """记录一次命中或未命中"""
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def generation(self, user_id):
+        """用户的数据代数"""
+        return self.backend.counter(f'gen:{user_id}')
+
+    def invalidate(self, user_id):
+        """使该用户的所有缓存响应失效"""
+        self.backend.incr(f'gen:{user_id}')
+
+    def make_key(self, user_id):
+        """根据当前请求生成缓存键"""
+        args = '&'.join(f'{k}={v}' for k, v in sorted(request.args.items(multi=True)))
+        return f'resp2:{user_id}:{self.generation(user_id)}:{request.path}?{args}'
+
+    def get(self, key):
+        """读取缓存的响应，返回 (etag, 响应头列表, body) 或 None"""
+        value = self.backend.get(key)
+        self._count(value is not None)
+        if value is None:
+            return None
+        etag, headers, body = value.split(b'\n', 2)
+        return etag.decode('ascii'), json.loads(headers), body
+
+    def set(self, key, etag, headers, body):
+        """缓存响应体、对应的 ETag 和其余响应头"""
+        self.backend.set(key, b'\n'.join([
+            etag.encode('ascii'), json.dumps(headers, separators=(',', ':')).encode('utf-8'), body
+        ]))
+
+    def stats(self):
+        """命中率统计"""
+        total = self.hits + self.misses
+        return {
+            'backend': type(self.backend).__name__,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+def init_cache(app):
+    """按配置创建响应缓存，RESPONSE_CACHE=none 时不启用"""
+    kind = app.config['RESPONSE_CACHE']
+    ttl = app.config['RESPONSE_CACHE_TTL']
+    if kind == 'memory':
+        backend = LRUCache(app.config['RESPONSE_CACHE_MAX_ENTRIES'], ttl)
+    elif kind == 'redis':
+        backend = RedisCache(app.config['RESPONSE_CACHE_REDIS_URL'], ttl)
+    elif kind == 'none':
+        backend = None
+    else:
+        raise ValueError(f'未知的 RESPONSE_CACHE: {kind}')
+    app.extensions['response_cache'] = ResponseCache(backend) if backend is not None else None
+
+
+def get_cache():
+    """当前应用的响应缓存，未启用时为 None"""
+    return current_app.extensions.get('response_cache')
+
+
+def invalidate_user(user_id):
+    """写操作后调用，使该用户的缓存失效"""
+    cache = get_cache()
+    if cache is not None:
+        cache.invalidate(user_id)
+
+
+def cached_response(view):
+    """
+    缓存 GET 接口的 200 响应（需放在 jwt_required 之后、collection_etag 之前）
+    命中时同样支持 If-None-Match
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        cache = get_cache()
+        if cache is None:
+            return view(*args, **kwargs)
+
+        # 先取缓存键（包含代数），保证与查询期间发生的写操作不会混淆
+        key = cache.make_key(get_jwt_identity())
+        cached = cache.get(key)
+        if cached is not None:
+            etag, headers, body = cached
+            if is_fresh(etag):
+                return not_modified(etag)
+            response = current_app.response_class(body, headers=headers)
+            return with_etag(response, etag)
+
+        response = view(*args, **kwargs)
+        if not isinstance(response, tuple) and response.status_code == 200 and response.get_etag()[0]:
+            headers = [[name, value] for name, value in response.headers.items()
+                       if name.lower() not in UNCACHED_HEADERS]
+            cache.set(key, response.get_etag()[0], headers, response.get_data())
+        return response
+    return wrapper
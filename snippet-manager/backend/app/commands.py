@@ -0,0 +1,121 @@
+"""
+Flask CLI 维护命令，例如: flask --app run.py backfill-tags
+"""
+import click
+
+
+def migrate_snippet_indexes():
+    """
+    为已有数据库创建 snippets 表上缺少的索引，并删除被复合索引取代的单列索引
+    PostgreSQL 上使用 CONCURRENTLY，不阻塞写入；返回 (新建, 删除) 的索引名列表
+    """
+    from sqlalchemy import inspect, text
+    from app import db
+    from app.models import LEGACY_INDEXES, Snippet
+
+    existing = {index['name'] for index in inspect(db.engine).get_indexes('snippets')}
+    concurrently = db.engine.dialect.name == 'postgresql'
+    created, dropped = [], []
+
+    with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+        for index in sorted(Snippet.__table__.indexes, key=lambda ix: ix.name):
+            if index.name in existing:
+                continue
+            index.dialect_options['postgresql']['concurrently'] = concurrently
+            try:
+                index.create(conn)
+            finally:
+                index.dialect_options['postgresql']['concurrently'] = False
+            created.append(index.name)
+
+        for name in LEGACY_INDEXES:
+            if name in existing:
+                conn.execute(text(f'DROP INDEX {"CONCURRENTLY " if concurrently else ""}{name}'))
+                dropped.append(name)
+    return created, dropped
+
+
+def register_commands(app):
+    """注册维护命令"""
+
+    @app.cli.command('backfill-tags')
+    @click.option('--batch-size', default=500, show_default=True, help='每批提交的片段数')
+    def backfill_tags_command(batch_size):
+        """从旧的 tags 列回填标签关联表"""
+        from app.tags import backfill_tags
+        count = backfill_tags(batch_size)
+        click.echo(f'已回填 {count} 个片段的标签')
+
+    @app.cli.command('repair-stats')
+    @click.option('--user-id', type=int, default=None, help='只重算指定用户')
+    def repair_stats_command(user_id):
+        """从片段数据重算 user_stats 计数表"""
+        from app.stats import repair_counters
+        count = repair_counters(user_id)
+        click.echo(f'已重算 {count} 个用户的统计计数')
+
+    @app.cli.command('create-indexes')
+    def create_indexes_command():
+        """为已有数据库创建片段列表的复合索引，并删除旧的单列索引"""
+        created, dropped = migrate_snippet_indexes()
+        click.echo(f'新建索引: {", ".join(created) or "无"}')
+        click.echo(f'删除索引: {", ".join(dropped) or "无"}')
+
+    @app.cli.command('gc-contents')
+    @click.option('--min-age', default=60, show_default=True, help='只删除创建超过该分钟数的正文')
+    def gc_contents_command(min_age):
+        """删除不再被任何片段引用的正文"""
+        from app.content import gc_contents
+        count = gc_contents(min_age)
+        click.echo(f'已删除 {count} 条未引用的正文')
+
+    @app.cli.command('compact-revisions')
+    @click.option('--max-age-days', type=int, default=None, help='删除超过该天数的版本（默认 REVISION_MAX_AGE_DAYS）')
+    @click.option('--keep', type=int, default=None, help='每个片段保留的版本数（默认 REVISION_MAX_COUNT）')
+    def compact_revisions_command(max_age_days, keep):
+        """按保留策略清理片段的旧版本"""
+        from app.revisions import compact_revisions
+        count = compact_revisions(max_age_days, keep)
+        click.echo(f'已删除 {count} 个历史版本')
+
+    @app.cli.command('embed-snippets')
+    @click.option('--user-id', type=int, default=None, help='只处理指定用户')
+    @click.option('--rebuild', is_flag=True, help='清空所有向量后重新计算')
+    def embed_snippets_command(user_id, rebuild):
+        """为缺少向量的片段计算向量（更换 EMBEDDING_MODEL 后使用 --rebuild）"""
+        from flask import current_app
+        from app.embeddings import embed_missing
+        embeddings = current_app.extensions.get('embeddings')
+        if embeddings is None:
+            raise click.ClickException('未启用相似片段搜索（EMBEDDINGS_ENABLED=false）')
+        if rebuild and user_id is not None:
+            raise click.ClickException('--rebuild 会清空所有用户的向量，不能与 --user-id 同时使用')
+        if rebuild:
+            embeddings.store.rebuild()
+        count = embed_missing(user_id)
+        click.echo(f'已计算 {count} 个片段的向量')
+
+    @app.cli.command('run-jobs')
+    @click.option('--burst', is_flag=True, help='队列为空时退出，不持续轮询')
+    @click.option('--poll-interval', type=float, default=None, help='队列为空时的轮询间隔秒数（默认 JOB_POLL_INTERVAL）')
+    def run_jobs_command(burst, poll_interval):
+        """执行后台任务队列（JOBS_MODE=worker 时的 worker 进程），收到 SIGTERM / SIGINT 后执行完当前任务退出"""
+        import signal
+        import threading
+        from app.jobs import run_worker
+
+        stop = threading.Event()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, lambda *_: stop.set())
+        count = run_worker(stop, poll_interval=poll_interval, burst=burst)
+        click.echo(f'已执行 {count} 个任务')
+
+    @app.cli.command('retry-jobs')
+    @click.option('--name', default=None, help='只重试指定名称的任务')
+    def retry_jobs_command(name):
+        """把超过重试次数而失败的任务重新排队"""
+        from app import db
+        from app.jobs import retry_failed
+        count = retry_failed(name)
+        db.session.commit()
+        click.echo(f'已重新排队 {count} 个任务')
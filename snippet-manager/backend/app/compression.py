@@ -0,0 +1,162 @@
+"""
+响应压缩
+根据 Accept-Encoding 协商 br / zstd / gzip（br 需要 brotli 包，zstd 需要 zstandard 包，未安装时跳过）
+- 普通响应小于 COMPRESSION_MIN_SIZE 时不压缩
+- 流式响应（如 NDJSON 导出）逐块压缩并立即刷新，不在内存中缓冲完整响应
+- 压缩后的响应把 ETag 改为弱 ETag，条件请求使用弱比较，304 / If-Match 不受影响
+"""
+import zlib
+from flask import request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# 只压缩文本类响应
+COMPRESSIBLE_MIMETYPES = {'application/json', 'application/x-ndjson', 'text/plain', 'text/html', 'text/csv'}
+
+
+class GzipCodec:
+    """gzip 编码（标准库 zlib）"""
+
+    name = 'gzip'
+
+    def __init__(self, level):
+        self.level = level
+
+    def compress(self, data):
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, 31)
+        return compressor.compress(data) + compressor.flush()
+
+    def stream(self, chunks):
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, 31)
+        for chunk in chunks:
+            yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        yield compressor.flush()
+
+
+class BrotliCodec:
+    """br 编码（brotli 包）"""
+
+    name = 'br'
+
+    def __init__(self, level):
+        self.level = level
+
+    def compress(self, data):
+        return brotli.compress(data, quality=self.level)
+
+    def stream(self, chunks):
+        compressor = brotli.Compressor(quality=self.level)
+        for chunk in chunks:
+            yield compressor.process(chunk) + compressor.flush()
+        yield compressor.finish()
+
+
+class ZstdCodec:
+    """zstd 编码（zstandard 包）"""
+
+    name = 'zstd'
+
+    def __init__(self, level):
+        self.level = level
+
+    def compress(self, data):
+        return zstandard.ZstdCompressor(level=self.level).compress(data)
+
+    def stream(self, chunks):
+        compressor = zstandard.ZstdCompressor(level=self.level).compressobj()
+        for chunk in chunks:
+            yield compressor.compress(chunk) + compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+        yield compressor.flush()
+
+
+def available_codecs(config):
+    """按 COMPRESSION_ALGORITHMS 的优先顺序返回可用的编码"""
+    factories = {
+        'gzip': lambda: GzipCodec(config['COMPRESSION_GZIP_LEVEL']),
+        'br': lambda: BrotliCodec(config['COMPRESSION_BR_LEVEL']) if brotli is not None else None,
+        'zstd': lambda: ZstdCodec(config['COMPRESSION_ZSTD_LEVEL']) if zstandard is not None else None,
+    }
+    codecs = []
+    for name in config['COMPRESSION_ALGORITHMS'].split(','):
+        name = name.strip()
+        if name not in factories:
+            raise ValueError(f'未知的压缩算法: {name}')
+        codec = factories[name]()
+        if codec is not None:
+            codecs.append(codec)
+    return codecs
+
+
+def negotiate(codecs):
+    """选择客户端接受的、质量值最高的编码，相同时按服务端优先顺序"""
+    best, best_quality = None, 0
+    for codec in codecs:
+        quality = request.accept_encodings.quality(codec.name)
+        if quality > best_quality:
+            best, best_quality = codec, quality
+    return best
+
+
+def _encode_chunks(chunks, charset='utf-8'):
+    """把流式响应的 str 块转换为 bytes，并在结束时关闭原迭代器"""
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode(charset)
+            if chunk:
+                yield chunk
+    finally:
+        close = getattr(chunks, 'close', None)
+        if close is not None:
+            close()
+
+
+def compress_response(response, codecs, min_size):
+    """按需压缩响应"""
+    if response.mimetype not in COMPRESSIBLE_MIMETYPES or response.direct_passthrough:
+        return response
+    response.vary.add('Accept-Encoding')
+    if (response.status_code < 200 or response.status_code in (204, 304)
+            or 'Content-Encoding' in response.headers):
+        return response
+
+    codec = negotiate(codecs)
+    if codec is None:
+        return response
+
+    if response.is_streamed:
+        response.response = codec.stream(_encode_chunks(response.response))
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < min_size:
+            return response
+        response.set_data(codec.compress(data))
+
+    response.headers['Content-Encoding'] = codec.name
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+def init_compression(app):
+    """注册压缩钩子，COMPRESSION_ENABLED 为 false 时不做任何事"""
+    if not app.config['COMPRESSION_ENABLED']:
+        return
+
+    codecs = available_codecs(app.config)
+    min_size = app.config['COMPRESSION_MIN_SIZE']
+
+    @app.after_request
+    def compress(response):
+        """根据 Accept-Encoding 压缩响应"""
+        return compress_response(response, codecs, min_size)
@@ -0,0 +1,216 @@
+"""
+片段正文存储
+正文按 SHA-256 存放在 snippet_contents 表中，相同内容（跨用户、复制、重复导入）只存一份；
+snippets 表只保存 content_hash，列表查询不再读取大字段。
+超过 CONTENT_COMPRESSION_MIN_SIZE 的正文按 CONTENT_COMPRESSION（none / zlib / zstd）压缩，读取时透明解压。
+未被引用的正文由 flask gc-contents 清理
+"""
+import hashlib
+import zlib
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import event, inspect, text
+from app import db
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# 压缩后至少要小这么多才保存压缩结果
+MIN_COMPRESSION_RATIO = 0.9
+
+# 迁移旧 content 列时每批处理的片段数
+MIGRATE_BATCH_SIZE = 500
+
+
+def content_hash(value):
+    """正文的内容地址"""
+    return hashlib.sha256(value.encode('utf-8')).hexdigest()
+
+
+def encode_content(value, compression='none', min_size=4096):
+    """把正文编码为 (bytes, 压缩方式)，压缩方式为空字符串表示未压缩"""
+    raw = value.encode('utf-8')
+    if compression == 'none' or len(raw) < min_size:
+        return raw, ''
+    if compression == 'zlib':
+        data = zlib.compress(raw, 6)
+    elif compression == 'zstd':
+        if zstandard is None:
+            raise RuntimeError('CONTENT_COMPRESSION=zstd 需要安装 zstandard 包')
+        data = zstandard.ZstdCompressor(level=3).compress(raw)
+    else:
+        raise ValueError(f'未知的 CONTENT_COMPRESSION: {compression}')
+    if len(data) > len(raw) * MIN_COMPRESSION_RATIO:
+        return raw, ''
+    return data, compression
+
+
+def decode_content(data, compression):
+    """解码 snippet_contents 中保存的正文"""
+    if data is None:
+        return None
+    if compression == 'zlib':
+        data = zlib.decompress(data)
+    elif compression == 'zstd':
+        if zstandard is None:
+            raise RuntimeError('读取 zstd 压缩的正文需要安装 zstandard 包')
+        data = zstandard.ZstdDecompressor().decompress(data)
+    return bytes(data).decode('utf-8')
+
+
+def _insert_ignore(rows):
+    """插入正文，哈希已存在时跳过（并发写入相同内容时不会冲突）"""
+    from app.models import SnippetContent
+
+    if db.session.get_bind().dialect.name == 'postgresql':
+        # 同时计算正文的 tsvector，snippets 的搜索触发器直接复用
+        db.session.execute(text(
+            'INSERT INTO snippet_contents (hash, data, compression, size, created_at, search_vector) '
+            'VALUES (:hash, :data, :compression, :size, :created_at, '
+            'to_tsvector(CAST(:ts_config AS regconfig), :text)) ON CONFLICT (hash) DO NOTHING'
+        ), [dict(row, ts_config=current_app.config['SEARCH_TS_CONFIG']) for row in rows])
+        return
+
+    from sqlalchemy.dialects.sqlite import insert
+    db.session.execute(
+        insert(SnippetContent).on_conflict_do_nothing(index_elements=['hash']),
+        [{key: value for key, value in row.items() if key != 'text'} for row in rows]
+    )
+
+
+def store_contents(values):
+    """保存一批正文，返回对应的哈希列表（不提交事务）"""
+    from app.models import SnippetContent
+
+    hashes = [content_hash(value) for value in values]
+    unique = dict(zip(hashes, values))
+    keys = list(unique)
+    config = current_app.config
+
+    # 此时会话中可能有引用这些正文的待写入片段，不能提前 flush
+    with db.session.no_autoflush:
+        # 复用已有正文时刷新 created_at：gc_contents 只删除超过宽限期的正文，
+        # 行锁保证并发的 GC 要么等本事务提交后看到新时间，要么已删除（此时 UPDATE 不返回该行，重新插入）
+        now = datetime.utcnow()
+        existing = set()
+        for start in range(0, len(keys), 500):
+            existing.update(db.session.scalars(
+                db.update(SnippetContent).where(SnippetContent.hash.in_(keys[start:start + 500]))
+                .values(created_at=now).returning(SnippetContent.hash),
+                execution_options={'synchronize_session': False}
+            ))
+
+        rows = []
+        for digest, value in unique.items():
+            if digest in existing:
+                continue
+            data, compression = encode_content(value, config['CONTENT_COMPRESSION'],
+                                               config['CONTENT_COMPRESSION_MIN_SIZE'])
+            rows.append({'hash': digest, 'data': data, 'compression': compression,
+                         'size': len(value.encode('utf-8')), 'created_at': now, 'text': value})
+        if rows:
+            _insert_ignore(rows)
+    return hashes
+
+
+def store_content(value):
+    """保存单个正文，返回 SnippetContent（不提交事务）"""
+    from app.models import SnippetContent
+
+    digest = store_contents([value])[0]
+    with db.session.no_autoflush:
+        return db.session.get(SnippetContent, digest)
+
+
+def register_sqlite_functions(engine):
+    """SQLite 连接上注册 snippet_content_text()，供全文索引触发器和 LIKE 搜索解压正文"""
+    if engine.dialect.name != 'sqlite':
+        return
+
+    @event.listens_for(engine, 'connect')
+    def add_functions(dbapi_connection, connection_record):
+        dbapi_connection.create_function('snippet_content_text', 2, decode_content, deterministic=True)
+
+
+def content_text_expression(contents):
+    """正文明文的 SQL 表达式，contents 为 SnippetContent 或其别名"""
+    if db.session.get_bind().dialect.name == 'sqlite':
+        return db.func.snippet_content_text(contents.data, contents.compression)
+    # 数据库中无法解压，压缩过的正文不参与匹配
+    return db.case((contents.compression == '', db.func.convert_from(contents.data, 'UTF8')))
+
+
+def migrate_legacy_content(app):
+    """
+    旧版本的正文保存在 snippets.content 列中：添加 content_hash 列，
+    把正文分批移入 snippet_contents，然后删除旧列（幂等，启动时执行）
+    """
+    engine = db.engine
+    columns = {column['name'] for column in inspect(engine).get_columns('snippets')}
+    if 'content_hash' in columns and 'content' not in columns:
+        return
+
+    dialect = engine.dialect.name
+    with engine.begin() as connection:
+        if dialect == 'postgresql':
+            # 写入正文时同时计算 tsvector（init_search 同样会创建该列）
+            connection.exec_driver_sql(
+                'ALTER TABLE snippet_contents ADD COLUMN IF NOT EXISTS search_vector tsvector'
+            )
+        if 'content_hash' not in columns:
+            connection.exec_driver_sql(
+                'ALTER TABLE snippets ADD COLUMN content_hash VARCHAR(64) REFERENCES snippet_contents (hash)'
+            )
+        if 'content' in columns:
+            # 旧的全文索引结构引用了 content 列，删除后由 init_search 按新结构重建
+            if dialect == 'sqlite':
+                for name in ('snippets_fts_ai', 'snippets_fts_ad', 'snippets_fts_au'):
+                    connection.exec_driver_sql(f'DROP TRIGGER IF EXISTS {name}')
+                connection.exec_driver_sql('DROP TABLE IF EXISTS snippets_fts')
+            elif dialect == 'postgresql':
+                connection.exec_driver_sql('ALTER TABLE snippets DROP COLUMN IF EXISTS search_vector')
+
+    if 'content' not in columns:
+        return
+
+    moved = 0
+    while True:
+        rows = db.session.execute(text(
+            'SELECT id, content FROM snippets WHERE content_hash IS NULL ORDER BY id LIMIT :limit'
+        ), {'limit': MIGRATE_BATCH_SIZE}).all()
+        if not rows:
+            break
+        hashes = store_contents([row.content or '' for row in rows])
+        db.session.execute(
+            text('UPDATE snippets SET content_hash = :hash WHERE id = :id'),
+            [{'id': row.id, 'hash': digest} for row, digest in zip(rows, hashes)]
+        )
+        db.session.commit()
+        moved += len(rows)
+
+    with engine.begin() as connection:
+        connection.exec_driver_sql('ALTER TABLE snippets DROP COLUMN content')
+    app.logger.info('已把 %d 个片段的正文迁移到 snippet_contents', moved)
+
+
+def gc_contents(min_age_minutes=60):
+    """
+    删除不再被任何片段或历史版本关键帧引用的正文，返回删除数；
+    只删除超过 min_age_minutes 未被写入引用（created_at 在复用时刷新）的，避免与正在写入的片段冲突
+    """
+    from app.models import Snippet, SnippetContent, SnippetRevision
+
+    cutoff = datetime.utcnow() - timedelta(minutes=min_age_minutes)
+    result = db.session.execute(
+        db.delete(SnippetContent).where(
+            SnippetContent.created_at < cutoff,
+            ~db.exists().where(Snippet.content_hash == SnippetContent.hash),
+            ~db.exists().where(SnippetRevision.content_hash == SnippetContent.hash,
+                               SnippetRevision.delta.is_(None))
+        ),
+        execution_options={'synchronize_session': False}
+    )
+    db.session.commit()
+    return result.rowcount
@@ -0,0 +1,435 @@
+"""
+相似片段搜索（EMBEDDINGS_ENABLED）
+创建、修改片段时加入后台任务（app.jobs）计算片段向量，写接口不等待计算完成：
+- 向量模型由 EMBEDDING_MODEL 选择：hashed-tfidf（默认，无额外依赖）或 sentence-transformers:<模型名>（本地 CPU 推理）
+- 向量以 float32 保存：PostgreSQL 上使用 pgvector（snippet_embeddings 表 + HNSW 索引），
+  其他数据库（或无法启用 pgvector 时）每个用户一个 NumPy 矩阵文件，保存在 EMBEDDING_DIR
+- GET /api/snippets/similar?id= 或 ?q= 返回最相似的 k 个片段
+需要安装 numpy 包
+"""
+import math
+import os
+import re
+import tempfile
+import threading
+import zlib
+from collections import Counter
+from flask import current_app
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+from app import db
+from app.content import decode_content
+from app.jobs import enqueue, job
+from app.models import Snippet, SnippetContent
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+_WORD = re.compile(r'\w+')
+
+# 参与向量计算的正文最大字符数
+MAX_CONTENT_CHARS = 8000
+
+# 补算缺失向量时每批处理的片段数
+BATCH_SIZE = 256
+
+
+def embedding_text(title, description, content):
+    """参与向量计算的文本"""
+    return '\n'.join(part for part in (title, description, (content or '')[:MAX_CONTENT_CHARS]) if part)
+
+
+class HashedTfidfEmbedder:
+    """
+    词频向量的特征哈希：英文按词、中文等按相邻两个字切分，对数词频，L2 归一化
+    IDF 权重在查询时按该用户的全部向量计算（idf_weighting）
+    """
+
+    name = 'hashed-tfidf'
+    idf_weighting = True
+
+    def __init__(self, dim=512):
+        self.dim = dim
+
+    @staticmethod
+    def tokens(value):
+        for word in _WORD.findall(value.lower()):
+            if word.isascii():
+                yield word
+            elif len(word) == 1:
+                yield word
+            else:
+                yield from (word[i:i + 2] for i in range(len(word) - 1))
+
+    def embed(self, texts):
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, value in enumerate(texts):
+            for token, count in Counter(self.tokens(value)).items():
+                digest = zlib.crc32(token.encode('utf-8'))
+                sign = 1.0 if digest & 0x80000000 else -1.0
+                vectors[row, digest % self.dim] += sign * (1.0 + math.log(count))
+        return _normalize(vectors)
+
+
+class SentenceTransformerEmbedder:
+    """sentence-transformers 本地模型（CPU 推理，启动时加载）"""
+
+    idf_weighting = False
+
+    def __init__(self, model_name):
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError:
+            raise RuntimeError('EMBEDDING_MODEL=sentence-transformers 需要安装 sentence-transformers 包')
+        self.name = f'sentence-transformers:{model_name}'
+        self.model = SentenceTransformer(model_name, device='cpu')
+        self.dim = self.model.get_sentence_embedding_dimension()
+
+    def embed(self, texts):
+        return self.model.encode(texts, normalize_embeddings=True, convert_to_numpy=True).astype(np.float32)
+
+
+def create_embedder(config):
+    """按 EMBEDDING_MODEL 创建向量模型"""
+    model = config['EMBEDDING_MODEL']
+    if model == 'hashed-tfidf':
+        return HashedTfidfEmbedder(config['EMBEDDING_DIM'])
+    if model.startswith('sentence-transformers:'):
+        return SentenceTransformerEmbedder(model.partition(':')[2])
+    raise ValueError(f'未知的 EMBEDDING_MODEL: {model}')
+
+
+def _normalize(vectors):
+    """按行 L2 归一化"""
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def _top_k(ids, scores, k, exclude):
+    """取相似度最高的 k 个 (id, 相似度)"""
+    if exclude is not None:
+        scores = np.where(ids == exclude, -np.inf, scores)
+    k = min(k, len(ids))
+    if k == 0:
+        return []
+    best = np.argpartition(-scores, k - 1)[:k]
+    best = best[np.argsort(-scores[best])]
+    return [(int(ids[i]), float(scores[i])) for i in best if np.isfinite(scores[i])]
+
+
+class NumpyVectorStore:
+    """每个用户一个 .npz 文件（ids + float32 矩阵），写入时加文件锁并原子替换"""
+
+    def __init__(self, directory, idf_weighting=False):
+        self.directory = directory
+        self.idf_weighting = idf_weighting
+        os.makedirs(directory, exist_ok=True)
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def _path(self, user_id):
+        return os.path.join(self.directory, f'{int(user_id)}.npz')
+
+    def _read(self, user_id):
+        path = self._path(user_id)
+        if not os.path.exists(path):
+            return np.zeros(0, dtype=np.int64), None
+        with np.load(path) as data:
+            return data['ids'], data['vectors']
+
+    def _write(self, user_id, ids, vectors):
+        path = self._path(user_id)
+        if len(ids) == 0:
+            if os.path.exists(path):
+                os.remove(path)
+            return
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(f, ids=ids, vectors=vectors)
+        os.replace(tmp, path)
+
+    def _modify(self, user_id, update):
+        """在文件锁内读取、修改并写回用户的矩阵（多个进程可能同时写入）"""
+        with open(os.path.join(self.directory, f'{int(user_id)}.lock'), 'w') as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            ids, vectors = self._read(user_id)
+            ids, vectors = update(ids, vectors)
+            self._write(user_id, ids, vectors)
+
+    def upsert(self, user_id, snippet_ids, new_vectors):
+        new_ids = np.asarray(snippet_ids, dtype=np.int64)
+
+        def update(ids, vectors):
+            keep = ~np.isin(ids, new_ids)
+            if vectors is None:
+                return new_ids, new_vectors
+            return np.concatenate([ids[keep], new_ids]), np.concatenate([vectors[keep], new_vectors])
+        self._modify(user_id, update)
+
+    def delete(self, user_id, snippet_ids):
+        def update(ids, vectors):
+            keep = ~np.isin(ids, np.asarray(snippet_ids, dtype=np.int64))
+            return ids[keep], vectors[keep] if vectors is not None else None
+        self._modify(user_id, update)
+
+    def ids(self, user_id):
+        return set(self._read(user_id)[0].tolist())
+
+    def _load(self, user_id):
+        """读取用于查询的矩阵，按文件修改时间缓存（含 IDF 加权）"""
+        path = self._path(user_id)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+        with self._lock:
+            cached = self._cache.get(user_id)
+        if cached is not None and cached[0] == mtime:
+            return cached[1:]
+
+        ids, vectors = self._read(user_id)
+        idf = None
+        if self.idf_weighting:
+            df = np.count_nonzero(vectors, axis=0)
+            idf = (np.log((1 + len(ids)) / (1 + df)) + 1).astype(np.float32)
+            vectors = _normalize(vectors * idf)
+        with self._lock:
+            self._cache[user_id] = (mtime, ids, vectors, idf)
+        return ids, vectors, idf
+
+    def search(self, user_id, vector, k, exclude=None):
+        loaded = self._load(user_id)
+        if loaded is None:
+            return []
+        ids, vectors, idf = loaded
+        if idf is not None:
+            vector = _normalize(vector * idf)
+        return _top_k(ids, vectors @ vector, k, exclude)
+
+    def rebuild(self):
+        for name in os.listdir(self.directory):
+            if name.endswith('.npz'):
+                os.remove(os.path.join(self.directory, name))
+        with self._lock:
+            self._cache.clear()
+
+
+def _vector_literal(vector):
+    return '[' + ','.join(f'{value:.7g}' for value in vector) + ']'
+
+
+class PgVectorStore:
+    """
+    pgvector 存储，按余弦距离查询
+    HNSW 是全表共用的索引，user_id 条件在扫描之后过滤，只在约 hnsw.ef_search 个候选中取该用户的片段；
+    向量数不超过 exact_max 的用户走 user_id 索引精确排序，其余用户开启 hnsw.iterative_scan（pgvector 0.8+）
+    继续扫描直到取满 k 个
+    """
+
+    def __init__(self, dim, exact_max=10000):
+        self.dim = dim
+        self.exact_max = exact_max
+
+    def create(self, connection):
+        for statement in (
+            'CREATE EXTENSION IF NOT EXISTS vector',
+            f"""CREATE TABLE IF NOT EXISTS snippet_embeddings (
+                snippet_id INTEGER PRIMARY KEY REFERENCES snippets (id) ON DELETE CASCADE,
+                user_id INTEGER NOT NULL,
+                embedding vector({self.dim}) NOT NULL
+            )""",
+            'CREATE INDEX IF NOT EXISTS ix_snippet_embeddings_user ON snippet_embeddings (user_id)',
+            'CREATE INDEX IF NOT EXISTS ix_snippet_embeddings_hnsw ON snippet_embeddings '
+            'USING hnsw (embedding vector_cosine_ops)',
+        ):
+            connection.exec_driver_sql(statement)
+
+    def upsert(self, user_id, snippet_ids, vectors):
+        db.session.execute(text(
+            'INSERT INTO snippet_embeddings (snippet_id, user_id, embedding) '
+            'VALUES (:snippet_id, :user_id, CAST(:embedding AS vector)) '
+            'ON CONFLICT (snippet_id) DO UPDATE SET embedding = excluded.embedding'
+        ), [{'snippet_id': int(snippet_id), 'user_id': user_id, 'embedding': _vector_literal(vector)}
+            for snippet_id, vector in zip(snippet_ids, vectors)])
+
+    def delete(self, user_id, snippet_ids):
+        # 外键 ON DELETE CASCADE 已随片段删除
+        pass
+
+    def ids(self, user_id):
+        return set(db.session.scalars(
+            text('SELECT snippet_id FROM snippet_embeddings WHERE user_id = :user_id'), {'user_id': user_id}
+        ))
+
+    def search(self, user_id, vector, k, exclude=None):
+        params = {'query': _vector_literal(vector), 'user_id': user_id, 'exclude': exclude or 0, 'k': k}
+        count = db.session.scalar(
+            text('SELECT count(*) FROM snippet_embeddings WHERE user_id = :user_id'), {'user_id': user_id}
+        )
+        if count <= self.exact_max:
+            # MATERIALIZED 使排序只在经 user_id 索引取出的该用户向量上进行，不走 HNSW 索引
+            rows = db.session.execute(text(
+                'WITH candidates AS MATERIALIZED ('
+                'SELECT snippet_id, embedding FROM snippet_embeddings '
+                'WHERE user_id = :user_id AND snippet_id != :exclude) '
+                'SELECT snippet_id, 1 - (embedding <=> CAST(:query AS vector)) AS score FROM candidates '
+                'ORDER BY embedding <=> CAST(:query AS vector) LIMIT :k'
+            ), params).all()
+            return [(row.snippet_id, float(row.score)) for row in rows]
+
+        try:
+            with db.session.begin_nested():
+                db.session.execute(db.select(db.func.set_config('hnsw.iterative_scan', 'relaxed_order', True)))
+        except DBAPIError:
+            # 旧版本 pgvector 不支持迭代扫描，扩大候选数
+            db.session.execute(db.select(db.func.set_config('hnsw.ef_search', str(min(max(k * 10, 40), 1000)), True)))
+        # relaxed_order 的结果可能略微乱序，外层重新排序
+        rows = db.session.execute(text(
+            'SELECT snippet_id, score FROM ('
+            'SELECT snippet_id, 1 - (embedding <=> CAST(:query AS vector)) AS score FROM snippet_embeddings '
+            'WHERE user_id = :user_id AND snippet_id != :exclude '
+            'ORDER BY embedding <=> CAST(:query AS vector) LIMIT :k) AS nearest ORDER BY score DESC'
+        ), params).all()
+        return [(row.snippet_id, float(row.score)) for row in rows]
+
+    def rebuild(self):
+        with db.engine.begin() as connection:
+            connection.exec_driver_sql('DROP TABLE IF EXISTS snippet_embeddings')
+            self.create(connection)
+
+
+def _extension():
+    return current_app.extensions.get('embeddings')
+
+
+@job('embeddings.embed')
+def embed_snippets(snippet_ids):
+    """计算并保存片段向量"""
+    embeddings = _extension()
+    if embeddings is None:
+        return
+    rows = db.session.execute(
+        db.select(Snippet.id, Snippet.user_id, Snippet.title, Snippet.description,
+                  SnippetContent.data, SnippetContent.compression)
+        .outerjoin(SnippetContent, SnippetContent.hash == Snippet.content_hash)
+        .where(Snippet.id.in_(snippet_ids))
+    ).all()
+    by_user = {}
+    for row in rows:
+        content = decode_content(row.data, row.compression)
+        by_user.setdefault(row.user_id, []).append((row.id, embedding_text(row.title, row.description, content)))
+    for user_id, items in by_user.items():
+        vectors = embeddings.embedder.embed([value for _, value in items])
+        embeddings.store.upsert(user_id, [snippet_id for snippet_id, _ in items], vectors)
+
+
+@job('embeddings.embed_missing')
+def embed_missing(user_id=None):
+    """补算缺少向量的片段，返回处理数"""
+    embeddings = _extension()
+    if embeddings is None:
+        return 0
+    user_ids = [user_id] if user_id is not None else db.session.scalars(
+        db.select(Snippet.user_id).distinct()
+    ).all()
+    processed = 0
+    for uid in user_ids:
+        existing = embeddings.store.ids(uid)
+        missing = [snippet_id for snippet_id in db.session.scalars(
+            db.select(Snippet.id).where(Snippet.user_id == uid).order_by(Snippet.id)
+        ) if snippet_id not in existing]
+        for start in range(0, len(missing), BATCH_SIZE):
+            embed_snippets(missing[start:start + BATCH_SIZE])
+            db.session.commit()
+        processed += len(missing)
+    return processed
+
+
+@job('embeddings.delete')
+def delete_embeddings(user_id, snippet_ids):
+    """删除片段的向量"""
+    embeddings = _extension()
+    if embeddings is not None:
+        embeddings.store.delete(user_id, snippet_ids)
+
+
+def schedule_embedding(snippet_ids):
+    """片段创建或标题、描述、正文修改后加入计算向量的任务（不提交事务）"""
+    snippet_ids = list(snippet_ids)
+    if _extension() is None or not snippet_ids:
+        return
+    if len(snippet_ids) == 1:
+        enqueue('embeddings.embed', {'snippet_ids': snippet_ids}, key=f'embed:{snippet_ids[0]}')
+        return
+    for start in range(0, len(snippet_ids), BATCH_SIZE):
+        enqueue('embeddings.embed', {'snippet_ids': snippet_ids[start:start + BATCH_SIZE]})
+
+
+def schedule_missing(user_id):
+    """批量导入后加入补算该用户缺少的向量的任务（不提交事务）"""
+    if _extension() is not None:
+        enqueue('embeddings.embed_missing', {'user_id': user_id}, key=f'embed-missing:{user_id}')
+
+
+def schedule_removal(user_id, snippet_ids):
+    """删除片段后加入移除其向量的任务（不提交事务）"""
+    snippet_ids = list(snippet_ids)
+    if _extension() is not None and snippet_ids:
+        enqueue('embeddings.delete', {'user_id': user_id, 'snippet_ids': snippet_ids})
+
+
+def text_changed(previous, snippet):
+    """修改是否影响片段向量，previous 为修改前的 revision_state()"""
+    return any(previous[name] != (getattr(snippet, name) or '') for name in ('title', 'description', 'content'))
+
+
+def find_similar(user_id, k, snippet=None, query=None):
+    """返回与片段或查询文本最相似的 [(snippet_id, 相似度), ...]"""
+    embeddings = _extension()
+    if snippet is not None:
+        value = embedding_text(snippet.title, snippet.description, snippet.content)
+    else:
+        value = query
+    vector = embeddings.embedder.embed([value])[0]
+    return embeddings.store.search(user_id, vector, k, exclude=snippet.id if snippet is not None else None)
+
+
+class Embeddings:
+    """相似片段搜索的组件"""
+
+    def __init__(self, embedder, store):
+        self.embedder = embedder
+        self.store = store
+
+
+def init_embeddings(app):
+    """按配置创建向量模型和存储，EMBEDDINGS_ENABLED 为 false 时不做任何事"""
+    app.extensions['embeddings'] = None
+    if not app.config['EMBEDDINGS_ENABLED']:
+        return
+    if np is None:
+        raise RuntimeError('EMBEDDINGS_ENABLED 需要安装 numpy 包')
+
+    embedder = create_embedder(app.config)
+    store = None
+    if db.engine.dialect.name == 'postgresql':
+        store = PgVectorStore(embedder.dim, app.config['EMBEDDING_EXACT_SEARCH_MAX'])
+        try:
+            with db.engine.begin() as connection:
+                store.create(connection)
+        except DBAPIError as e:
+            app.logger.warning('无法启用 pgvector（%s），片段向量保存到 %s', e.orig, app.config['EMBEDDING_DIR'])
+            store = None
+    if store is None:
+        store = NumpyVectorStore(app.config['EMBEDDING_DIR'], idf_weighting=embedder.idf_weighting)
+
+    app.extensions['embeddings'] = Embeddings(embedder, store)
@@ -0,0 +1,102 @@
+"""
+ETag 与条件请求
+单个片段的 ETag 由 id + updated_at 生成；集合接口使用用户的数据版本号（user_versions 表），
+命中 If-None-Match 时直接返回 304，不再查询和序列化。
+版本号由写接口在写入的事务中调用 bump_version 加一，单调递增：批量导入可以保留客户端的
+updated_at，不能用 max(updated_at) + 片段数代替（导入旧时间的片段同时删除一个时两者都不变）
+"""
+import hashlib
+from functools import wraps
+from flask import current_app, request, jsonify
+from flask_jwt_extended import get_jwt_identity
+from app import db
+from app.models import UserVersion
+
+
+def _digest(*parts):
+    """把若干值哈希成 ETag 字符串"""
+    raw = '|'.join(str(part) for part in parts).encode('utf-8')
+    return hashlib.sha1(raw).hexdigest()[:32]
+
+
+def snippet_etag(snippet):
+    """单个片段的 ETag"""
+    return _digest('snippet', snippet.id, snippet.updated_at.isoformat())
+
+
+def user_version(user_id):
+    """用户片段数据的版本号，任意增删改都会改变它"""
+    version = db.session.scalar(db.select(UserVersion.version).where(UserVersion.user_id == user_id))
+    return str(version or 0)
+
+
+def bump_version(user_id):
+    """在当前事务中把用户的数据版本号加一（不提交事务），写接口修改片段时调用"""
+    dialect = db.session.get_bind().dialect.name
+    if dialect in ('postgresql', 'sqlite'):
+        if dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+        db.session.execute(insert(UserVersion).values(user_id=user_id, version=1).on_conflict_do_update(
+            index_elements=['user_id'], set_={'version': UserVersion.version + 1}
+        ))
+        return
+    updated = db.session.execute(
+        db.update(UserVersion).where(UserVersion.user_id == user_id).values(version=UserVersion.version + 1),
+        execution_options={'synchronize_session': False}
+    ).rowcount
+    if not updated:
+        db.session.add(UserVersion(user_id=user_id, version=1))
+
+
+def with_etag(response, etag):
+    """设置 ETag，并要求浏览器每次用 If-None-Match 重新验证"""
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+
+def not_modified(etag):
+    """返回 304 响应"""
+    return with_etag(current_app.response_class(status=304), etag)
+
+
+def is_fresh(etag):
+    """客户端缓存的版本是否仍然有效（If-None-Match）"""
+    return request.if_none_match.contains_weak(etag)
+
+
+def precondition_failed(etag):
+    """
+    If-Match 不满足时返回 412，否则返回 None
+    ETag 由版本号而不是响应字节生成，压缩后的弱 ETag 同样有效，因此使用弱比较
+    """
+    if request.if_match and not request.if_match.contains_weak(etag):
+        response = jsonify({'error': '片段已被修改，请刷新后重试'})
+        response.status_code = 412
+        response.set_etag(etag)
+        return response
+    return None
+
+
+def collection_etag(view):
+    """
+    集合 GET 接口的条件请求装饰器
+    ETag 由用户数据版本和请求参数共同决定
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        version = user_version(get_jwt_identity())
+        etag = _digest(request.path, request.query_string.decode('utf-8'), version)
+        if is_fresh(etag):
+            return not_modified(etag)
+
+        response = view(*args, **kwargs)
+        if isinstance(response, tuple):
+            return response
+        if response.status_code == 200:
+            with_etag(response, etag)
+        return response
+    return wrapper
@@ -0,0 +1,224 @@
+"""
+模糊搜索（match=fuzzy）
+按 trigram 相似度匹配标题和标签，容忍拼写错误和只记得一部分的名称，结果按相似度排序：
+- PostgreSQL: pg_trgm 的 word_similarity，title / tags 列上有 GIN trigram 索引
+- 其他数据库: 每个用户一份进程内 trigram 倒排索引，首次搜索时构建，
+  片段数据版本变化（或本进程内的写请求）后重建
+相似度为查询的 trigram 出现在标题或标签中的比例，低于 FUZZY_SEARCH_THRESHOLD 的不返回；
+单次搜索超过 FUZZY_SEARCH_BUDGET_MS 时返回已得到的结果，并标记为截断
+"""
+import heapq
+import re
+import threading
+import time
+from collections import Counter, OrderedDict, defaultdict
+from flask import current_app
+from sqlalchemy.exc import DBAPIError, OperationalError
+from app import db
+from app.models import Snippet, Tag
+
+_WORD = re.compile(r'\w+')
+
+_POSTGRES_DDL = [
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    'CREATE INDEX IF NOT EXISTS ix_snippets_title_trgm ON snippets USING GIN (title gin_trgm_ops)',
+    'CREATE INDEX IF NOT EXISTS ix_snippets_tags_trgm ON snippets USING GIN (tags gin_trgm_ops)',
+    'CREATE INDEX IF NOT EXISTS ix_tags_name_trgm ON tags USING GIN (name gin_trgm_ops)',
+    # 供全文搜索的 ILIKE 子串匹配使用（app.search）
+    'CREATE INDEX IF NOT EXISTS ix_snippets_description_trgm ON snippets USING GIN (description gin_trgm_ops)',
+]
+
+
+def trigrams(value):
+    """与 pg_trgm 相同的切分方式：按词小写，词前补两个空格、词后补一个空格"""
+    grams = set()
+    for word in _WORD.findall((value or '').lower()):
+        padded = f'  {word} '
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def _coverage(query_grams, grams):
+    """查询的 trigram 出现在 grams 中的比例"""
+    return len(query_grams & grams) / len(query_grams) if query_grams else 0.0
+
+
+class TrigramIndex:
+    """单个用户片段的 trigram 倒排索引"""
+
+    def __init__(self, rows):
+        self.ids = []
+        self.postings = defaultdict(list)
+        self.tag_grams = {}
+        for snippet_id, title, tags in rows:
+            doc = len(self.ids)
+            self.ids.append(snippet_id)
+            names = [name for name in (tags or '').split(',') if name]
+            for gram in trigrams(title) | trigrams(' '.join(names)):
+                self.postings[gram].append(doc)
+            for name in names:
+                if name not in self.tag_grams:
+                    self.tag_grams[name] = trigrams(name)
+
+    def search(self, query, limit, threshold, deadline):
+        """返回 ([(snippet_id, 相似度), ...], 是否因超出时间预算而截断)"""
+        query_grams = trigrams(query)
+        if not query_grams:
+            return [], False
+
+        counts = Counter()
+        truncated = False
+        # 先处理罕见的 trigram，预算用尽时已统计的是区分度最高的部分
+        for gram in sorted(query_grams, key=lambda g: len(self.postings.get(g, ()))):
+            if time.perf_counter() > deadline:
+                truncated = True
+                break
+            counts.update(self.postings.get(gram, ()))
+
+        total = len(query_grams)
+        # 行按更新时间倒序加载，相似度相同时较新的片段在前
+        best = heapq.nlargest(
+            limit,
+            ((count / total, -doc) for doc, count in counts.items() if count / total >= threshold)
+        )
+        return [(self.ids[-negated_doc], score) for score, negated_doc in best], truncated
+
+    def resolve_tag(self, name, threshold):
+        """返回与 name 最相似的已有标签，没有足够相似的时返回 None"""
+        if name in self.tag_grams:
+            return name
+        query_grams = trigrams(name)
+        scored = [(_coverage(query_grams, grams), tag) for tag, grams in self.tag_grams.items()]
+        score, tag = max(scored, default=(0.0, None))
+        return tag if score >= threshold else None
+
+
+class TrigramIndexCache:
+    """按用户缓存 TrigramIndex，记录构建时的数据版本"""
+
+    def __init__(self, max_users=256):
+        self.max_users = max_users
+        self._indexes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        from app.etag import user_version
+
+        version = user_version(user_id)
+        with self._lock:
+            entry = self._indexes.get(user_id)
+            if entry is not None and entry[0] == version:
+                self._indexes.move_to_end(user_id)
+                return entry[1]
+
+        rows = db.session.execute(
+            db.select(Snippet.id, Snippet.title, Snippet.tags).where(Snippet.user_id == user_id)
+            .order_by(Snippet.updated_at.desc(), Snippet.id.desc())
+        ).all()
+        index = TrigramIndex(rows)
+        with self._lock:
+            self._indexes[user_id] = (version, index)
+            self._indexes.move_to_end(user_id)
+            while len(self._indexes) > self.max_users:
+                self._indexes.popitem(last=False)
+        return index
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._indexes.pop(user_id, None)
+
+
+def _budget(config):
+    return time.perf_counter() + config['FUZZY_SEARCH_BUDGET_MS'] / 1000
+
+
+def _postgres_search(user_id, search, config):
+    """在 PostgreSQL 中按 word_similarity 排序，超出时间预算时返回空结果并标记截断"""
+    score = db.func.greatest(
+        db.func.word_similarity(search, Snippet.title),
+        db.func.word_similarity(search, db.func.coalesce(Snippet.tags, ''))
+    )
+    query = db.select(Snippet.id, score).where(
+        Snippet.user_id == user_id,
+        db.or_(Snippet.title.op('%>')(search), Snippet.tags.op('%>')(search))
+    ).order_by(score.desc(), Snippet.updated_at.desc()).limit(config['FUZZY_SEARCH_LIMIT'])
+
+    timeout = db.session.scalar(db.select(db.func.current_setting('statement_timeout')))
+    try:
+        with db.session.begin_nested():
+            db.session.execute(db.select(
+                db.func.set_config('pg_trgm.word_similarity_threshold',
+                                   str(config['FUZZY_SEARCH_THRESHOLD']), True),
+                db.func.set_config('statement_timeout', str(config['FUZZY_SEARCH_BUDGET_MS']), True)
+            ))
+            rows = db.session.execute(query).all()
+            db.session.execute(db.select(db.func.set_config('statement_timeout', timeout, True)))
+    except OperationalError as e:
+        if getattr(e.orig, 'pgcode', None) != '57014':  # query_canceled
+            raise
+        return [], True
+    return [(row[0], row[1]) for row in rows], False
+
+
+def fuzzy_search(user_id, search):
+    """返回 ([(snippet_id, 相似度), ...], 是否截断)，按相似度从高到低"""
+    config = current_app.config
+    if current_app.extensions.get('fuzzy_backend') == 'pg_trgm':
+        return _postgres_search(user_id, search, config)
+    index = current_app.extensions['fuzzy_indexes'].get(user_id)
+    return index.search(search, config['FUZZY_SEARCH_LIMIT'], config['FUZZY_SEARCH_THRESHOLD'], _budget(config))
+
+
+def apply_fuzzy_search(query, user_id, search):
+    """给列表查询加上模糊搜索条件并按相似度排序，返回 (查询, 是否截断)"""
+    matches, truncated = fuzzy_search(user_id, search)
+    ids = [snippet_id for snippet_id, _ in matches]
+    query = query.filter(Snippet.id.in_(ids))
+    if ids:
+        query = query.order_by(db.case({snippet_id: rank for rank, snippet_id in enumerate(ids)},
+                                       value=Snippet.id))
+    return query, truncated
+
+
+def resolve_tags(user_id, names):
+    """把可能拼错的标签名替换为最相似的已有标签，找不到时保留原名（不会匹配到片段）"""
+    config = current_app.config
+    threshold = config['FUZZY_SEARCH_THRESHOLD']
+    if current_app.extensions.get('fuzzy_backend') == 'pg_trgm':
+        resolved = []
+        for name in names:
+            score = db.func.word_similarity(name, Tag.name)
+            match = db.session.scalars(
+                db.select(Tag.name).where(Tag.user_id == user_id, score >= threshold)
+                .order_by(score.desc(), Tag.name).limit(1)
+            ).first()
+            resolved.append(match or name)
+        return list(dict.fromkeys(resolved))
+
+    index = current_app.extensions['fuzzy_indexes'].get(user_id)
+    return list(dict.fromkeys(index.resolve_tag(name, threshold) or name for name in names))
+
+
+def invalidate_fuzzy_index(user_id):
+    """写操作后丢弃该用户的进程内索引"""
+    indexes = current_app.extensions.get('fuzzy_indexes')
+    if indexes is not None:
+        indexes.invalidate(user_id)
+
+
+def init_fuzzy(app):
+    """PostgreSQL 上启用 pg_trgm 并创建 trigram 索引，无权限创建扩展时退回进程内索引"""
+    app.extensions['fuzzy_backend'] = 'memory'
+    app.extensions['fuzzy_indexes'] = TrigramIndexCache(app.config['FUZZY_INDEX_MAX_USERS'])
+
+    engine = db.engine
+    if engine.dialect.name != 'postgresql':
+        return
+    try:
+        with engine.begin() as connection:
+            for statement in _POSTGRES_DDL:
+                connection.exec_driver_sql(statement)
+    except DBAPIError as e:
+        app.logger.warning('无法启用 pg_trgm（%s），模糊搜索使用进程内索引', e.orig)
+        return
+    app.extensions['fuzzy_backend'] = 'pg_trgm'
@@ -0,0 +1,70 @@
+"""
+JWT 用户身份
+- access token 中携带 username 等稳定字段，/api/auth/me 直接从 token 返回，不查询数据库
+- 需要用户记录的接口调用 current_user() 按需加载（没有全局的 user_lookup_loader，其他接口不做用户查询），
+  通过进程内 TTL/LRU 缓存，用户被修改或删除时失效
+- 缓存失效只发生在执行修改的进程内：多个 gunicorn worker 时，其他 worker 在 IDENTITY_CACHE_TTL 内
+  仍可能返回已删除或已改名的用户
+"""
+from flask import current_app, has_app_context
+from flask_jwt_extended import get_jwt_identity
+from sqlalchemy import event
+from app import db
+from app.cache import LRUCache
+from app.models import User
+
+# 写入 access token 的用户字段
+USER_CLAIMS = ('username', 'email', 'created_at')
+
+
+def user_claims(user):
+    """生成 access token 的附加 claims，user 为 User 或 to_dict() 结果"""
+    data = user if isinstance(user, dict) else user.to_dict()
+    return {name: data[name] for name in USER_CLAIMS}
+
+
+def user_from_claims(identity, claims):
+    """从 token claims 还原用户信息，旧 token 不含这些字段时返回 None"""
+    if not all(name in claims for name in USER_CLAIMS):
+        return None
+    return dict({name: claims[name] for name in USER_CLAIMS}, id=identity)
+
+
+def init_identity(app):
+    """创建身份缓存"""
+    app.extensions['identity_cache'] = LRUCache(
+        app.config['IDENTITY_CACHE_SIZE'], app.config['IDENTITY_CACHE_TTL']
+    )
+
+
+def invalidate_identity(user_id):
+    """使某个用户的身份缓存失效"""
+    if has_app_context():
+        cache = current_app.extensions.get('identity_cache')
+        if cache is not None:
+            cache.delete(user_id)
+
+
+def load_user(identity):
+    """通过身份缓存加载用户信息（to_dict() 结果），用户不存在时返回 None"""
+    cache = current_app.extensions['identity_cache']
+    user = cache.get(identity)
+    if user is None:
+        record = db.session.get(User, identity)
+        if record is None:
+            return None
+        user = record.to_dict()
+        cache.set(identity, user)
+    return user
+
+
+def current_user():
+    """当前请求 token 对应的用户信息（调用时才加载），用户不存在时返回 None"""
+    return load_user(get_jwt_identity())
+
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def _user_changed(mapper, connection, target):
+    """用户被修改或删除时清除缓存"""
+    invalidate_identity(target.id)
@@ -0,0 +1,237 @@
+"""
+后台任务队列
+写请求在同一个事务中把任务写入 jobs 表，提交后由 worker 领取执行，派生数据（向量、版本差异）不占用请求时间：
+- 领取: PostgreSQL 上 SELECT ... FOR UPDATE SKIP LOCKED，多个 worker 并发领取互不阻塞；
+  其他数据库用带状态条件的 UPDATE 领取，同一任务只会被一个 worker 拿到
+- 执行: 每个任务一个事务，成功后删除任务，处理函数的写入与删除一起提交
+- 失败: 按指数退避重试，超过最大次数后标记为 failed 保留，由 flask retry-jobs 重新排队
+- 去重: 带 idempotency key 的任务排队期间只保留一个，开始执行时释放 key
+- 超时: 执行超过 JOB_LOCK_TIMEOUT 秒仍未结束的任务（worker 崩溃）重新领取
+JOBS_MODE: thread（每个进程一个后台线程）/ worker（只入队，由 flask run-jobs 执行）/ sync（请求结束前执行，用于测试）
+"""
+import os
+import random
+import socket
+import threading
+from datetime import datetime, timedelta
+from flask import current_app, g
+from app import db
+from app.models import Job
+
+_handlers = {}
+
+
+def job(name):
+    """注册任务处理函数，payload 的字段作为关键字参数传入"""
+    def decorator(func):
+        _handlers[name] = func
+        return func
+    return decorator
+
+
+def _insert(row):
+    """写入任务，idempotency key 已在排队时跳过，返回是否写入"""
+    dialect = db.session.get_bind().dialect.name
+    if row['idempotency_key'] is None or dialect not in ('postgresql', 'sqlite'):
+        db.session.execute(db.insert(Job), [row])
+        return True
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    result = db.session.execute(
+        insert(Job).values(row).on_conflict_do_nothing(index_elements=['idempotency_key'])
+    )
+    return result.rowcount == 1
+
+
+def enqueue(name, payload=None, key=None, delay=0):
+    """在当前事务中加入任务（不提交事务），返回是否加入"""
+    if name not in _handlers:
+        raise ValueError(f'未注册的任务: {name}')
+    now = datetime.utcnow()
+    added = _insert({
+        'name': name, 'payload': payload or {}, 'idempotency_key': key, 'status': 'queued',
+        'attempts': 0, 'max_attempts': current_app.config['JOB_MAX_ATTEMPTS'],
+        'run_at': now + timedelta(seconds=delay), 'created_at': now
+    })
+    g._jobs_enqueued = True
+    return added
+
+
+def _worker_name():
+    return f'{socket.gethostname()}:{os.getpid()}:{threading.current_thread().name}'
+
+
+def _claim(limit):
+    """领取最多 limit 个到期的任务并提交，返回任务列表"""
+    now = datetime.utcnow()
+    claimable = db.or_(
+        db.and_(Job.status == 'queued', Job.run_at <= now),
+        db.and_(Job.status == 'running',
+                Job.locked_at < now - timedelta(seconds=current_app.config['JOB_LOCK_TIMEOUT']))
+    )
+    ids = db.session.scalars(
+        db.select(Job.id).where(claimable).order_by(Job.run_at, Job.id).limit(limit)
+        .with_for_update(skip_locked=True)
+    ).all()
+    if not ids:
+        db.session.rollback()
+        return []
+    claimed = db.session.scalars(
+        db.update(Job).where(Job.id.in_(ids), claimable)
+        .values(status='running', locked_at=now, locked_by=_worker_name(),
+                attempts=Job.attempts + 1, idempotency_key=None)
+        .returning(Job.id),
+        execution_options={'synchronize_session': False}
+    ).all()
+    db.session.commit()
+    if not claimed:
+        return []
+    return db.session.scalars(db.select(Job).where(Job.id.in_(claimed)).order_by(Job.run_at, Job.id)).all()
+
+
+def retry_delay(attempts, config):
+    """第 attempts 次失败后的等待秒数：指数退避加随机抖动"""
+    delay = min(config['JOB_RETRY_BASE_SECONDS'] * 2 ** (attempts - 1), config['JOB_RETRY_MAX_SECONDS'])
+    return delay * random.uniform(0.5, 1.0)
+
+
+def _execute(job_id, name, payload):
+    """执行一个已领取的任务，返回是否成功"""
+    handler = _handlers.get(name)
+    try:
+        if handler is None:
+            raise LookupError(f'未注册的任务: {name}')
+        handler(**payload)
+        db.session.execute(db.delete(Job).where(Job.id == job_id),
+                           execution_options={'synchronize_session': False})
+        db.session.commit()
+        return True
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.exception('任务 %s#%s 执行失败', name, job_id)
+        error = f'{type(e).__name__}: {e}'
+
+    job = db.session.get(Job, job_id)
+    if job is None:
+        return False
+    job.last_error = error[:2000]
+    job.locked_at = job.locked_by = None
+    if handler is None or job.attempts >= job.max_attempts:
+        job.status = 'failed'
+    else:
+        job.status = 'queued'
+        job.run_at = datetime.utcnow() + timedelta(seconds=retry_delay(job.attempts, current_app.config))
+    db.session.commit()
+    return False
+
+
+def run_pending(limit=None):
+    """领取并执行一批到期的任务，返回执行的任务数"""
+    jobs = _claim(limit or current_app.config['JOB_BATCH_SIZE'])
+    # 先取出字段，处理函数失败回滚后不再访问过期的对象
+    for job_id, name, payload in [(job.id, job.name, job.payload) for job in jobs]:
+        _execute(job_id, name, payload)
+    return len(jobs)
+
+
+def run_worker(stop, poll_interval=None, burst=False):
+    """持续执行任务直到 stop（threading.Event）被设置，burst 为真时队列为空即返回"""
+    poll_interval = current_app.config['JOB_POLL_INTERVAL'] if poll_interval is None else poll_interval
+    processed = 0
+    while not stop.is_set():
+        try:
+            count = run_pending()
+        except Exception:
+            db.session.rollback()
+            current_app.logger.exception('领取任务失败')
+            count = 0
+        finally:
+            db.session.remove()
+        processed += count
+        if count:
+            continue
+        if burst:
+            break
+        stop.wait(poll_interval)
+    return processed
+
+
+def retry_failed(name=None):
+    """把失败的任务重新排队（不提交事务），返回数量"""
+    query = db.update(Job).where(Job.status == 'failed')
+    if name is not None:
+        query = query.where(Job.name == name)
+    return db.session.execute(
+        query.values(status='queued', attempts=0, run_at=datetime.utcnow(), last_error=None),
+        execution_options={'synchronize_session': False}
+    ).rowcount
+
+
+def job_counts():
+    """按状态统计任务数"""
+    rows = db.session.execute(db.select(Job.status, db.func.count()).group_by(Job.status)).all()
+    counts = {'queued': 0, 'running': 0, 'failed': 0}
+    counts.update({status: count for status, count in rows})
+    return counts
+
+
+class JobRunner:
+    """按 JOBS_MODE 在请求结束后触发任务执行"""
+
+    def __init__(self, app):
+        self.app = app
+        self.mode = app.config['JOBS_MODE']
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """
+        thread 模式下启动本进程的轮询线程（已启动时不做任何事）
+        gunicorn 在 worker 初始化后调用，其他服务器在第一个请求时调用；
+        按进程记录，fork 出的子进程会重新启动
+        """
+        if self.mode != 'thread' or self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._thread = threading.Thread(target=self._loop, name='jobs', daemon=True)
+                self._thread.start()
+                self._pid = os.getpid()
+
+    def _loop(self):
+        poll_interval = self.app.config['JOB_POLL_INTERVAL']
+        while not self._stop.is_set():
+            self._wake.clear()
+            with self.app.app_context():
+                run_worker(self._stop, burst=True)
+            self._wake.wait(poll_interval)
+
+    def notify(self):
+        """有新任务入队的请求结束后调用"""
+        if self.mode == 'sync':
+            run_worker(self._stop, burst=True)
+        elif self.mode == 'thread':
+            self.start()
+            self._wake.set()
+
+
+def init_jobs(app):
+    """创建任务执行器：thread 模式下请求到来时确保轮询线程已启动，写入了任务的请求结束后通知执行"""
+    if app.config['JOBS_MODE'] not in ('thread', 'worker', 'sync'):
+        raise RuntimeError('JOBS_MODE 必须是 thread / worker / sync 之一')
+    runner = JobRunner(app)
+    app.extensions['jobs'] = runner
+
+    @app.before_request
+    def start_jobs():
+        runner.start()
+
+    @app.teardown_request
+    def notify_jobs(exc):
+        if g.pop('_jobs_enqueued', False) and exc is None:
+            runner.notify()
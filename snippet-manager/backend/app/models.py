@@ -1,5 +1,8 @@
 from datetime import datetime
+from flask import current_app
 from app import db, bcrypt
+from app.security import run_hash
+from app.content import decode_content
 
 class User(db.Model):
     """用户模型"""
@@ -15,12 +18,20 @@ class User(db.Model):
     snippets = db.relationship('Snippet', backref='user', lazy=True, cascade='all, delete-orphan')
 
     def set_password(self, password):
-        """设置密码"""
-        self.password_hash = bcrypt.generate_password_hash(password).decode('utf-8')
+        """设置密码（在哈希线程池中计算）"""
+        self.password_hash = run_hash(bcrypt.generate_password_hash, password).decode('utf-8')
 
     def check_password(self, password):
-        """验证密码"""
-        return bcrypt.check_password_hash(self.password_hash, password)
+        """验证密码（在哈希线程池中计算）"""
+        return run_hash(bcrypt.check_password_hash, self.password_hash, password)
+
+    def password_needs_rehash(self):
+        """密码哈希的 cost 与当前配置不同时需要重新计算"""
+        try:
+            rounds = int(self.password_hash.split('$')[2])
+        except (IndexError, ValueError):
+            return True
+        return rounds != current_app.config['BCRYPT_LOG_ROUNDS']
 
     def to_dict(self):
         """转换为字典格式"""
@@ -35,37 +46,274 @@ class User(db.Model):
         return f'<User {self.username}>'
 
 
+# 片段与标签的多对多关联表
+snippet_tags = db.Table(
+    'snippet_tags',
+    db.Column('snippet_id', db.Integer, db.ForeignKey('snippets.id', ondelete='CASCADE'), primary_key=True),
+    db.Column('tag_id', db.Integer, db.ForeignKey('tags.id', ondelete='CASCADE'), primary_key=True),
+    db.Index('ix_snippet_tags_tag_snippet', 'tag_id', 'snippet_id')
+)
+
+
+# 单个标签名和逗号分隔的 snippets.tags 列的最大长度
+TAG_MAX_LENGTH = 100
+TAGS_MAX_LENGTH = 500
+
+
+class TagError(ValueError):
+    """标签名无效"""
+
+
+class Tag(db.Model):
+    """标签模型，每个用户的标签名唯一"""
+    __tablename__ = 'tags'
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    name = db.Column(db.String(TAG_MAX_LENGTH), nullable=False)
+
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'name', name='uq_tags_user_name'),
+    )
+
+    def __repr__(self):
+        return f'<Tag {self.name}>'
+
+
+class SnippetContent(db.Model):
+    """片段正文，按 SHA-256 内容寻址，相同正文只存一份"""
+    __tablename__ = 'snippet_contents'
+
+    hash = db.Column(db.String(64), primary_key=True)
+    data = db.Column(db.LargeBinary, nullable=False)
+    compression = db.Column(db.String(10), nullable=False, default='')  # '' / 'zlib' / 'zstd'
+    size = db.Column(db.Integer, nullable=False)  # 未压缩的字节数
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)  # 写入或最近一次被复用的时间，GC 宽限期以此为准
+
+    @property
+    def text(self):
+        """解压后的正文"""
+        return decode_content(self.data, self.compression)
+
+    def __repr__(self):
+        return f'<SnippetContent {self.hash[:12]}>'
+
+
+def split_tags(value):
+    """把列表或逗号分隔字符串解析为去重后的标签列表（不校验长度）"""
+    if not value:
+        return []
+    if isinstance(value, str):
+        value = value.split(',')
+    names = []
+    for name in value:
+        name = str(name).strip()
+        if name and name not in names:
+            names.append(name)
+    return names
+
+
+def parse_tags(value):
+    """解析请求中的标签，不是字符串或数组、标签名或合计长度超过限制时抛出 TagError"""
+    if value is not None and not isinstance(value, (str, list)):
+        raise TagError('tags 必须是字符串或数组')
+    names = split_tags(value)
+    for name in names:
+        if len(name) > TAG_MAX_LENGTH:
+            raise TagError(f'标签长度不能超过 {TAG_MAX_LENGTH} 个字符: {name[:20]}...')
+    if len(','.join(names)) > TAGS_MAX_LENGTH:
+        raise TagError(f'标签合计长度不能超过 {TAGS_MAX_LENGTH} 个字符')
+    return names
+
+
 class Snippet(db.Model):
     """代码片段和提示词片段模型"""
     __tablename__ = 'snippets'
 
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     title = db.Column(db.String(200), nullable=False)
-    content = db.Column(db.Text, nullable=False)
+    content_hash = db.Column(db.String(64), db.ForeignKey('snippet_contents.hash'), nullable=False)
     description = db.Column(db.Text)
-    snippet_type = db.Column(db.String(20), nullable=False, index=True)  # 'code' 或 'prompt'
+    snippet_type = db.Column(db.String(20), nullable=False)  # 'code' 或 'prompt'
     language = db.Column(db.String(50))  # 编程语言（仅代码片段）
-    tags = db.Column(db.String(500))  # 逗号分隔的标签
-    is_favorite = db.Column(db.Boolean, default=False, index=True)  # 是否收藏
+    tags = db.Column(db.String(500))  # 逗号分隔的标签（展示用，筛选走 snippet_tags）
+    is_favorite = db.Column(db.Boolean, default=False)  # 是否收藏
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+    tag_objects = db.relationship('Tag', secondary=snippet_tags, lazy='select')
+    # 正文在单独的表中，访问 content 时才加载
+    body = db.relationship('SnippetContent', lazy='select')
+
+    # API 可返回的字段
+    FIELDS = ('id', 'user_id', 'title', 'content', 'description', 'snippet_type',
+              'language', 'tags', 'is_favorite', 'created_at', 'updated_at')
+
+    @property
+    def content(self):
+        """片段正文"""
+        return self.body.text if self.body is not None else None
+
+    @content.setter
+    def content(self, value):
+        from app.content import content_hash, store_content
+        if self.content_hash is not None and self.content_hash == content_hash(value):
+            return
+        self.body = store_content(value)
+
+    def to_dict(self, fields=FIELDS):
+        """转换为字典格式，fields 指定输出的字段"""
+        data = {}
+        for name in fields:
+            value = getattr(self, name)
+            if name == 'tags':
+                value = value.split(',') if value else []
+            elif isinstance(value, datetime):
+                value = value.isoformat()
+            data[name] = value
+        return data
+
+    def set_tags(self, value):
+        """设置标签，同时维护逗号分隔列和 snippet_tags 关联"""
+        names = parse_tags(value)
+        self.tags = ','.join(names)
+
+        existing = {}
+        if names:
+            existing = {
+                tag.name: tag
+                for tag in Tag.query.filter(Tag.user_id == self.user_id, Tag.name.in_(names))
+            }
+        tag_objects = []
+        for name in names:
+            tag = existing.get(name)
+            if tag is None:
+                tag = Tag(user_id=self.user_id, name=name)
+                db.session.add(tag)
+            tag_objects.append(tag)
+        self.tag_objects = tag_objects
+
+    def __repr__(self):
+        return f'<Snippet {self.title}>'
+
+
+# 列表查询都是 WHERE user_id = ? [AND snippet_type = ? / is_favorite] ORDER BY updated_at DESC, id DESC，
+# 复合索引同时满足过滤和排序，不需要额外排序；user_id 单列查询也由这些索引的前缀覆盖
+db.Index('ix_snippets_user_updated', Snippet.user_id, Snippet.updated_at.desc(), Snippet.id.desc())
+db.Index('ix_snippets_user_type_updated',
+         Snippet.user_id, Snippet.snippet_type, Snippet.updated_at.desc(), Snippet.id.desc())
+# 收藏只占少数，用部分索引；查询条件必须写成 Snippet.is_favorite == db.true() 才能匹配
+db.Index('ix_snippets_user_favorite_updated', Snippet.user_id, Snippet.updated_at.desc(), Snippet.id.desc(),
+         postgresql_where=Snippet.is_favorite == db.true(), sqlite_where=Snippet.is_favorite == db.true())
+
+# 被复合索引取代的旧单列索引，由 create-indexes 命令删除
+LEGACY_INDEXES = ('ix_snippets_user_id', 'ix_snippets_snippet_type', 'ix_snippets_is_favorite')
+
+
+class SnippetRevision(db.Model):
+    """
+    片段历史版本，由 app.revisions 维护
+    delta 为空的是关键帧，正文在 snippet_contents 中；其余只保存相对上一版本的正文差异
+    """
+    __tablename__ = 'snippet_revisions'
+
+    id = db.Column(db.Integer, primary_key=True)
+    snippet_id = db.Column(db.Integer, db.ForeignKey('snippets.id', ondelete='CASCADE'), nullable=False)
+    number = db.Column(db.Integer, nullable=False)  # 每个片段从 1 开始递增
+    title = db.Column(db.String(200), nullable=False)
+    description = db.Column(db.Text)
+    snippet_type = db.Column(db.String(20), nullable=False)
+    language = db.Column(db.String(50))
+    tags = db.Column(db.String(500))
+    content_hash = db.Column(db.String(64), nullable=False)  # 该版本正文的哈希，关键帧时引用 snippet_contents
+    delta = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.UniqueConstraint('snippet_id', 'number', name='uq_snippet_revisions_number'),
+    )
+
+    @property
+    def is_keyframe(self):
+        return self.delta is None
+
+    def to_dict(self, content=None):
+        """转换为字典格式，content 为重建出的正文（列表中不返回正文）"""
+        data = {
+            'number': self.number,
+            'title': self.title,
+            'is_keyframe': self.is_keyframe,
+            'created_at': self.created_at.isoformat()
+        }
+        if content is not None:
+            data.update({
+                'content': content,
+                'description': self.description,
+                'snippet_type': self.snippet_type,
+                'language': self.language,
+                'tags': self.tags.split(',') if self.tags else []
+            })
+        return data
+
+    def __repr__(self):
+        return f'<SnippetRevision {self.snippet_id}#{self.number}>'
+
+
+class UserStats(db.Model):
+    """每个用户的片段计数缓存，由写接口维护，可用 flask repair-stats 重算"""
+    __tablename__ = 'user_stats'
+
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    total = db.Column(db.Integer, nullable=False, default=0)
+    code = db.Column(db.Integer, nullable=False, default=0)
+    prompt = db.Column(db.Integer, nullable=False, default=0)
+    favorite = db.Column(db.Integer, nullable=False, default=0)
+
     def to_dict(self):
         """转换为字典格式"""
         return {
-            'id': self.id,
-            'user_id': self.user_id,
-            'title': self.title,
-            'content': self.content,
-            'description': self.description,
-            'snippet_type': self.snippet_type,
-            'language': self.language,
-            'tags': self.tags.split(',') if self.tags else [],
-            'is_favorite': self.is_favorite,
-            'created_at': self.created_at.isoformat(),
-            'updated_at': self.updated_at.isoformat()
+            'total': self.total,
+            'code': self.code,
+            'prompt': self.prompt,
+            'favorite': self.favorite
         }
 
     def __repr__(self):
-        return f'<Snippet {self.title}>'
+        return f'<UserStats {self.user_id}>'
+
+
+class UserVersion(db.Model):
+    """每个用户的数据版本号，片段的每次写入在同一个事务中加一，由 app.etag 维护"""
+    __tablename__ = 'user_versions'
+
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    version = db.Column(db.BigInteger, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<UserVersion {self.user_id}:{self.version}>'
+
+
+class Job(db.Model):
+    """后台任务，由 app.jobs 入队和执行，成功后删除"""
+    __tablename__ = 'jobs'
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False)
+    payload = db.Column(db.JSON, nullable=False)
+    idempotency_key = db.Column(db.String(200), unique=True)  # 排队期间去重，开始执行时清空
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued / running / failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False)
+    run_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    locked_at = db.Column(db.DateTime)
+    locked_by = db.Column(db.String(200))
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_jobs_status_run_at', 'status', 'run_at'),
+    )
+
+    def __repr__(self):
+        return f'<Job {self.name}#{self.id}>'
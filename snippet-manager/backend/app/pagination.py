@@ -0,0 +1,88 @@
+"""
+片段列表的游标分页
+普通列表按 (updated_at, id) 做 keyset 分页；搜索结果按相关度排序，使用偏移量游标
+游标中记录分页方式（m: k / o），与请求的分页方式不一致时视为无效，避免从第一页重新开始
+"""
+import base64
+import json
+from datetime import datetime
+from app import db
+from app.models import Snippet
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+class CursorError(ValueError):
+    """分页游标无效"""
+
+
+def encode_cursor(payload):
+    """把游标数据编码为 URL 安全的字符串"""
+    raw = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """解析游标字符串"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        payload = json.loads(raw)
+    except (ValueError, TypeError):
+        raise CursorError(cursor)
+    if not isinstance(payload, dict):
+        raise CursorError(cursor)
+    return payload
+
+
+def parse_limit(value):
+    """解析 limit 参数，限制在 1..MAX_PAGE_SIZE 之间"""
+    if value is None:
+        return DEFAULT_PAGE_SIZE
+    try:
+        limit = int(value)
+    except ValueError:
+        raise CursorError(value)
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+
+def paginate(query, limit, cursor=None, keyset=True):
+    """
+    取一页数据，返回 (items, next_cursor)
+    keyset=True 时查询必须按 updated_at DESC, id DESC 排序
+    """
+    payload = decode_cursor(cursor) if cursor else {}
+    if payload and payload.get('m') != ('k' if keyset else 'o'):
+        raise CursorError(cursor)
+
+    if keyset:
+        if payload:
+            try:
+                updated_at = datetime.fromisoformat(payload['u'])
+                last_id = int(payload['i'])
+            except (KeyError, TypeError, ValueError):
+                raise CursorError(cursor)
+            query = query.filter(db.or_(
+                Snippet.updated_at < updated_at,
+                db.and_(Snippet.updated_at == updated_at, Snippet.id < last_id)
+            ))
+        items = query.limit(limit + 1).all()
+    else:
+        offset = 0
+        if payload:
+            try:
+                offset = int(payload['o'])
+            except (KeyError, TypeError, ValueError):
+                raise CursorError(cursor)
+            if offset < 0:
+                raise CursorError(cursor)
+        items = query.offset(offset).limit(limit + 1).all()
+
+    if len(items) <= limit:
+        return items, None
+
+    items = items[:limit]
+    last = items[-1]
+    if keyset:
+        return items, encode_cursor({'m': 'k', 'u': last.updated_at.isoformat(), 'i': last.id})
+    return items, encode_cursor({'m': 'o', 'o': offset + limit})
@@ -0,0 +1,118 @@
+"""
+数据库连接池配置与指标
+连接池参数由环境变量控制（见 config.py），指标按进程统计，
+gunicorn 多 worker 时每个 worker 各自一份
+"""
+import logging
+import threading
+import time
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import NullPool, QueuePool
+
+logger = logging.getLogger(__name__)
+
+
+class PoolMetrics:
+    """连接池计数器：checkout/checkin 次数、新建连接、失效连接、等待时间"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.slow_checkout_ms = None
+        self.reset()
+
+    def reset(self):
+        """清零所有计数"""
+        with self._lock:
+            self.checkouts = 0
+            self.checkins = 0
+            self.connects = 0
+            self.invalidations = 0
+            self.timeouts = 0
+            self.wait_count = 0
+            self.wait_total = 0.0
+            self.wait_max = 0.0
+
+    def incr(self, name):
+        """计数器加一"""
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def record_wait(self, seconds):
+        """记录一次获取连接的等待时间"""
+        with self._lock:
+            self.wait_count += 1
+            self.wait_total += seconds
+            self.wait_max = max(self.wait_max, seconds)
+        if self.slow_checkout_ms is not None and seconds * 1000 >= self.slow_checkout_ms:
+            logger.warning('获取数据库连接等待 %.1fms，连接池可能不足', seconds * 1000)
+
+    def snapshot(self, pool):
+        """当前指标和连接池状态"""
+        with self._lock:
+            data = {
+                'checkouts': self.checkouts,
+                'checkins': self.checkins,
+                'connects': self.connects,
+                'invalidations': self.invalidations,
+                'timeouts': self.timeouts,
+                'wait_avg_ms': round(self.wait_total / self.wait_count * 1000, 3) if self.wait_count else 0.0,
+                'wait_max_ms': round(self.wait_max * 1000, 3),
+            }
+        data['pool'] = type(pool).__name__
+        if isinstance(pool, QueuePool):
+            data.update({
+                'size': pool.size(),
+                'checked_out': pool.checkedout(),
+                'checked_in': pool.checkedin(),
+                'overflow': pool.overflow(),
+            })
+        return data
+
+
+metrics = PoolMetrics()
+
+
+class InstrumentedQueuePool(QueuePool):
+    """记录获取连接等待时间的 QueuePool"""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            metrics.incr('timeouts')
+            raise
+        finally:
+            metrics.record_wait(time.perf_counter() - start)
+
+
+def engine_options(config):
+    """根据配置生成 SQLALCHEMY_ENGINE_OPTIONS，SQLite 保持 Flask-SQLAlchemy 的默认设置"""
+    options = dict(config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+    if config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite'):
+        return options
+
+    options.setdefault('pool_pre_ping', config['DB_POOL_PRE_PING'])
+
+    if config['DB_PGBOUNCER']:
+        # PgBouncer 事务模式下由 PgBouncer 负责复用连接，应用端不再保持连接
+        options.setdefault('poolclass', NullPool)
+        return options
+
+    options.setdefault('poolclass', InstrumentedQueuePool)
+    options.setdefault('pool_size', config['DB_POOL_SIZE'])
+    options.setdefault('max_overflow', config['DB_MAX_OVERFLOW'])
+    options.setdefault('pool_timeout', config['DB_POOL_TIMEOUT'])
+    options.setdefault('pool_recycle', config['DB_POOL_RECYCLE'])
+    return options
+
+
+def init_pool_metrics(app, engine):
+    """在引擎上注册连接池事件"""
+    metrics.slow_checkout_ms = app.config['DB_POOL_SLOW_CHECKOUT_MS']
+
+    event.listen(engine, 'connect', lambda *args: metrics.incr('connects'))
+    event.listen(engine, 'checkout', lambda *args: metrics.incr('checkouts'))
+    event.listen(engine, 'checkin', lambda *args: metrics.incr('checkins'))
+    event.listen(engine, 'invalidate', lambda *args: metrics.incr('invalidations'))
@@ -0,0 +1,271 @@
+"""
+请求耗时剖析与 SQL 统计
+开启 PROFILING_ENABLED 后，每个请求记录总耗时、SQL 语句数及耗时、JSON 序列化耗时和响应大小：
+- 通过 Server-Timing 响应头返回，浏览器开发者工具的 Timing 面板可以直接查看
+- 按接口汇总，在 /metrics 以 Prometheus 文本格式输出，需要 Authorization: Bearer <PROFILING_METRICS_TOKEN>
+  （未设置令牌时不提供 /metrics；后端端口可能被直接访问，不能只依赖 Nginx 不转发）
+- SQL 语句数超过阈值（疑似 N+1）或单条语句过慢时记录警告日志
+- 可按比例对请求做 cProfile / pyinstrument 剖析，只保留耗时超过阈值的结果
+指标按进程统计，gunicorn 多 worker 时每个 worker 各自一份
+"""
+import cProfile
+import hmac
+import io
+import logging
+import os
+import pstats
+import random
+import threading
+import time
+from flask import current_app, g, has_request_context, jsonify, request
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+# 请求耗时直方图的分桶（秒）
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class RequestMetrics:
+    """单个请求的耗时记录"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self.serialize_time = 0.0
+        self.profiler = None
+
+
+class MetricsRegistry:
+    """按 (方法, 接口, 状态码) 汇总请求指标"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def observe(self, method, endpoint, status, duration, sql_count, sql_time, serialize_time, size):
+        """记录一个已完成的请求"""
+        key = (method, endpoint, str(status))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {
+                    'count': 0, 'duration': 0.0, 'buckets': [0] * len(BUCKETS),
+                    'sql_count': 0, 'sql_time': 0.0, 'serialize_time': 0.0, 'bytes': 0,
+                }
+            series['count'] += 1
+            series['duration'] += duration
+            for index, bound in enumerate(BUCKETS):
+                if duration <= bound:
+                    series['buckets'][index] += 1
+            series['sql_count'] += sql_count
+            series['sql_time'] += sql_time
+            series['serialize_time'] += serialize_time
+            series['bytes'] += size
+
+    def reset(self):
+        """清空所有指标"""
+        with self._lock:
+            self._series.clear()
+
+    def render(self):
+        """Prometheus 文本格式"""
+        with self._lock:
+            items = sorted((key, dict(value, buckets=list(value['buckets'])))
+                           for key, value in self._series.items())
+
+        lines = [
+            '# HELP http_request_duration_seconds Request wall time.',
+            '# TYPE http_request_duration_seconds histogram',
+        ]
+        for (method, endpoint, status), series in items:
+            labels = f'method="{method}",endpoint="{endpoint}",status="{status}"'
+            for bound, count in zip(BUCKETS, series['buckets']):
+                lines.append(f'http_request_duration_seconds_bucket{{{labels},le="{bound}"}} {count}')
+            lines.append(f'http_request_duration_seconds_bucket{{{labels},le="+Inf"}} {series["count"]}')
+            lines.append(f'http_request_duration_seconds_sum{{{labels}}} {series["duration"]:.6f}')
+            lines.append(f'http_request_duration_seconds_count{{{labels}}} {series["count"]}')
+
+        counters = (
+            ('http_request_sql_statements_total', 'SQL statements executed.', 'sql_count', '{}'),
+            ('http_request_sql_seconds_total', 'Time spent in SQL statements.', 'sql_time', '{:.6f}'),
+            ('http_request_serialize_seconds_total', 'Time spent serializing JSON.', 'serialize_time', '{:.6f}'),
+            ('http_response_bytes_total', 'Response body bytes.', 'bytes', '{}'),
+        )
+        for name, help_text, field, fmt in counters:
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} counter')
+            for (method, endpoint, status), series in items:
+                labels = f'method="{method}",endpoint="{endpoint}",status="{status}"'
+                lines.append(f'{name}{{{labels}}} ' + fmt.format(series[field]))
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+
+class TimedJSONProvider:
+    """包装应用的 JSON provider，记录 jsonify 的序列化耗时"""
+
+    def __init__(self, provider):
+        self._provider = provider
+
+    def __getattr__(self, name):
+        return getattr(self._provider, name)
+
+    def _timed(self, func, *args, **kwargs):
+        """执行 func 并把耗时计入当前请求"""
+        metrics = _current()
+        if metrics is None:
+            return func(*args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            metrics.serialize_time += time.perf_counter() - start
+
+    def dumps(self, obj, **kwargs):
+        return self._timed(self._provider.dumps, obj, **kwargs)
+
+    def response(self, *args, **kwargs):
+        return self._timed(self._provider.response, *args, **kwargs)
+
+
+def _current():
+    """当前请求的耗时记录，不在请求中或未开启时为 None"""
+    if not has_request_context():
+        return None
+    return g.get('request_metrics')
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get('query_start')
+    if not starts:
+        return
+    elapsed = time.perf_counter() - starts.pop()
+
+    metrics = _current()
+    if metrics is not None:
+        metrics.sql_count += 1
+        metrics.sql_time += elapsed
+
+    slow_ms = current_app.config['PROFILING_SLOW_QUERY_MS'] if has_request_context() else 0
+    if slow_ms and elapsed * 1000 >= slow_ms:
+        logger.warning('慢查询 %.1fms: %s', elapsed * 1000, ' '.join(statement.split())[:500])
+
+
+def _start_profiler(app):
+    """按采样比例启动剖析器"""
+    if not app.config['PROFILING_SLOW_MS'] or random.random() >= app.config['PROFILING_SAMPLE_RATE']:
+        return None
+    if app.config['PROFILER'] == 'pyinstrument':
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            raise RuntimeError('PROFILER=pyinstrument 需要安装 pyinstrument 包')
+        profiler = Profiler()
+        profiler.start()
+        return profiler
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # 同一时间只能有一个 cProfile 在运行（Python 3.12+），其他线程的请求跳过采样
+        return None
+    return profiler
+
+
+def _save_profile(app, profiler, duration):
+    """停止剖析器，请求足够慢时保存结果"""
+    is_cprofile = isinstance(profiler, cProfile.Profile)
+    if is_cprofile:
+        profiler.disable()
+    else:
+        profiler.stop()
+
+    if duration * 1000 < app.config['PROFILING_SLOW_MS']:
+        return
+
+    directory = app.config['PROFILING_DIR']
+    os.makedirs(directory, exist_ok=True)
+    name = f'{time.strftime("%Y%m%d-%H%M%S")}-{request.method}-{request.endpoint or "unknown"}-{int(duration * 1000)}ms'
+    if is_cprofile:
+        path = os.path.join(directory, name + '.prof')
+        profiler.dump_stats(path)
+        summary = io.StringIO()
+        pstats.Stats(profiler, stream=summary).sort_stats('cumulative').print_stats(15)
+        logger.warning('慢请求 %s %s %.1fms，剖析结果: %s\n%s',
+                       request.method, request.path, duration * 1000, path, summary.getvalue())
+    else:
+        path = os.path.join(directory, name + '.html')
+        with open(path, 'w') as f:
+            f.write(profiler.output_html())
+        logger.warning('慢请求 %s %s %.1fms，剖析结果: %s', request.method, request.path, duration * 1000, path)
+
+
+def _server_timing(metrics, total):
+    """生成 Server-Timing 响应头"""
+    app_time = max(0.0, total - metrics.sql_time - metrics.serialize_time)
+    return ', '.join([
+        f'db;dur={metrics.sql_time * 1000:.2f};desc="{metrics.sql_count} queries"',
+        f'serialize;dur={metrics.serialize_time * 1000:.2f}',
+        f'app;dur={app_time * 1000:.2f}',
+        f'total;dur={total * 1000:.2f}',
+    ])
+
+
+def instrument_engine(engine):
+    """在引擎上注册 SQL 计时事件"""
+    event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+
+
+def init_profiling(app, engine):
+    """注册请求钩子和 SQL 事件，PROFILING_ENABLED 为 false 时不做任何事"""
+    if not app.config['PROFILING_ENABLED']:
+        return
+
+    app.json = TimedJSONProvider(app.json)
+    instrument_engine(engine)
+
+    @app.before_request
+    def start_request_metrics():
+        """开始记录当前请求"""
+        g.request_metrics = RequestMetrics()
+        g.request_metrics.profiler = _start_profiler(app)
+
+    @app.after_request
+    def finish_request_metrics(response):
+        """汇总当前请求的耗时并写入响应头"""
+        metrics = g.pop('request_metrics', None)
+        if metrics is None:
+            return response
+        duration = time.perf_counter() - metrics.start
+        if metrics.profiler is not None:
+            _save_profile(app, metrics.profiler, duration)
+
+        warn_count = app.config['PROFILING_SQL_WARN_COUNT']
+        if warn_count and metrics.sql_count > warn_count:
+            logger.warning('%s %s 执行了 %d 条 SQL，可能存在 N+1 查询',
+                           request.method, request.path, metrics.sql_count)
+
+        size = 0 if response.is_streamed else response.calculate_content_length() or 0
+        registry.observe(request.method, request.endpoint or 'unknown', response.status_code,
+                         duration, metrics.sql_count, metrics.sql_time, metrics.serialize_time, size)
+        response.headers['Server-Timing'] = _server_timing(metrics, duration)
+        return response
+
+    @app.route('/metrics')
+    def prometheus_metrics():
+        """Prometheus 格式的请求指标，令牌不匹配时返回 401"""
+        token = current_app.config['PROFILING_METRICS_TOKEN']
+        if not token:
+            return jsonify({'error': '未启用'}), 404
+        if not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+            return jsonify({'error': '未授权'}), 401
+        return current_app.response_class(registry.render(), mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,154 @@
+"""
+只读副本路由
+配置 DATABASE_REPLICA_URLS 后，用 use_replica 装饰的只读接口在副本上查询，写操作始终在主库：
+- 副本按轮询（round_robin）或最少连接（least_connections）选择
+- 读己之写：成功的写请求之后 DATABASE_REPLICA_STICKY_SECONDS 秒内，该用户的读请求固定走主库；
+  同时记录在进程内和 db_pin cookie 中，请求落到其他 worker 时同样生效
+- 会话 flush 时总是使用主库
+"""
+import itertools
+import threading
+import time
+from functools import wraps
+from flask import current_app, g, has_app_context, request
+from flask_jwt_extended import get_jwt_identity, verify_jwt_in_request
+from flask_sqlalchemy.session import Session
+from sqlalchemy import create_engine, event
+
+PIN_COOKIE = 'db_pin'
+
+WRITE_METHODS = ('POST', 'PUT', 'PATCH', 'DELETE')
+
+
+class RoutingSession(Session):
+    """请求选定了副本时，查询使用副本引擎"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and has_app_context():
+            replica = g.get('db_replica')
+            if replica is not None:
+                return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+class ReplicaSet:
+    """一组只读副本引擎及读己之写的固定记录"""
+
+    MAX_PINNED = 10000
+
+    def __init__(self, engines, strategy='round_robin', sticky_seconds=5):
+        if strategy not in ('round_robin', 'least_connections'):
+            raise ValueError(f'未知的 DATABASE_REPLICA_STRATEGY: {strategy}')
+        self.engines = engines
+        self.strategy = strategy
+        self.sticky_seconds = sticky_seconds
+        self._cycle = itertools.cycle(engines)
+        self._in_use = {engine: 0 for engine in engines}
+        self._pinned = {}
+        self._lock = threading.Lock()
+        for engine in engines:
+            event.listen(engine, 'checkout', lambda *args, engine=engine: self._track(engine, 1))
+            event.listen(engine, 'checkin', lambda *args, engine=engine: self._track(engine, -1))
+
+    def _track(self, engine, delta):
+        """记录副本当前借出的连接数"""
+        with self._lock:
+            self._in_use[engine] += delta
+
+    def choose(self):
+        """选择一个副本"""
+        with self._lock:
+            if self.strategy == 'least_connections':
+                return min(self.engines, key=self._in_use.__getitem__)
+            return next(self._cycle)
+
+    def pin(self, user_id):
+        """用户刚执行了写操作，在固定窗口内读主库"""
+        now = time.monotonic()
+        with self._lock:
+            self._pinned[str(user_id)] = now + self.sticky_seconds
+            if len(self._pinned) > self.MAX_PINNED:
+                self._pinned = {key: until for key, until in self._pinned.items() if until > now}
+
+    def is_pinned(self, user_id):
+        """用户是否处在写后固定窗口内"""
+        with self._lock:
+            until = self._pinned.get(str(user_id))
+        return until is not None and until > time.monotonic()
+
+    def dispose(self, close=True):
+        """释放所有副本连接"""
+        for engine in self.engines:
+            engine.dispose(close=close)
+
+
+def _pinned_by_cookie():
+    """请求是否带有未过期的 db_pin cookie"""
+    try:
+        return float(request.cookies.get(PIN_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+def use_replica(view):
+    """
+    只读接口装饰器（放在 jwt_required 之后）
+    配置了副本且用户不在写后固定窗口内时，本次请求的查询走副本
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        replicas = current_app.extensions.get('db_replicas')
+        if replicas is not None and request.method in ('GET', 'HEAD') and not _pinned_by_cookie():
+            user_id = get_jwt_identity()
+            if user_id is None or not replicas.is_pinned(user_id):
+                g.db_replica = replicas.choose()
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def on_replica():
+    """当前请求是否在副本上查询（此时不应写入）"""
+    return has_app_context() and g.get('db_replica') is not None
+
+
+def init_replicas(app):
+    """按 DATABASE_REPLICA_URLS 创建副本引擎，未配置时不做任何事"""
+    from app.content import register_sqlite_functions
+    from app.pool import engine_options
+    from app.profiling import instrument_engine
+
+    urls = [url.strip() for url in app.config['DATABASE_REPLICA_URLS'].split(',') if url.strip()]
+    if not urls:
+        app.extensions['db_replicas'] = None
+        return
+
+    engines = [create_engine(url, **engine_options(dict(app.config, SQLALCHEMY_DATABASE_URI=url)))
+               for url in urls]
+    for engine in engines:
+        register_sqlite_functions(engine)
+        if app.config['PROFILING_ENABLED']:
+            instrument_engine(engine)
+
+    replicas = ReplicaSet(
+        engines,
+        strategy=app.config['DATABASE_REPLICA_STRATEGY'],
+        sticky_seconds=app.config['DATABASE_REPLICA_STICKY_SECONDS'],
+    )
+    app.extensions['db_replicas'] = replicas
+
+    @app.after_request
+    def pin_after_write(response):
+        """成功的片段写请求之后，固定该用户在窗口内读主库"""
+        if request.blueprint == 'api' and request.method in WRITE_METHODS and response.status_code < 400:
+            verify_jwt_in_request(optional=True)
+            user_id = get_jwt_identity()
+            if user_id is not None:
+                replicas.pin(user_id)
+            response.set_cookie(PIN_COOKIE, str(time.time() + replicas.sticky_seconds),
+                                max_age=replicas.sticky_seconds, httponly=True, samesite='Lax')
+        return response
+
+    @app.teardown_request
+    def release_replica(exc):
+        """请求结束后清除副本选择"""
+        g.pop('db_replica', None)
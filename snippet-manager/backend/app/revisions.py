@@ -0,0 +1,307 @@
+"""
+片段历史版本
+每次修改标题、正文等字段时追加一个版本：正文保存为相对上一版本的按行差异，
+每 REVISION_KEYFRAME_INTERVAL 个版本保存一个关键帧（正文存入 snippet_contents，享有去重和压缩），
+重建任意版本最多应用 REVISION_KEYFRAME_INTERVAL - 1 个差异。
+首次修改时才记录修改前的版本，从未修改过的片段没有历史记录。
+写入时版本先保存为关键帧（正文已在 snippet_contents 中，不需要额外写入），差异由后台任务计算后替换，
+不在关键帧位置上的版本差异过大时保留为关键帧。
+保留策略：每个片段最多 REVISION_MAX_COUNT 个版本（写入时裁剪），
+超过 REVISION_MAX_AGE_DAYS 天的版本由 flask compact-revisions 清理（始终保留最新版本）
+"""
+import json
+from datetime import datetime, timedelta
+from difflib import SequenceMatcher
+from flask import current_app
+from app import db
+from app.content import content_hash, store_content
+from app.jobs import enqueue, job
+from app.models import Snippet, SnippetContent, SnippetRevision
+
+# 记录到版本中的字段
+STATE_FIELDS = ('title', 'content', 'description', 'snippet_type', 'language', 'tags')
+
+# 差异超过正文长度的该比例时改存关键帧
+MAX_DELTA_RATIO = 0.5
+
+
+def encode_delta(old, new):
+    """
+    按行计算 old -> new 的差异，编码为 JSON 数组：
+    正整数表示复制原文的行数，负整数表示跳过原文的行数，字符串表示插入的文本
+    """
+    a = old.splitlines(keepends=True)
+    b = new.splitlines(keepends=True)
+    ops = []
+    for tag, i1, i2, j1, j2 in SequenceMatcher(None, a, b, autojunk=False).get_opcodes():
+        if tag == 'equal':
+            ops.append(i2 - i1)
+            continue
+        if i2 > i1:
+            ops.append(i1 - i2)
+        if j2 > j1:
+            ops.append(''.join(b[j1:j2]))
+    return json.dumps(ops, ensure_ascii=False, separators=(',', ':'))
+
+
+def apply_delta(base, delta):
+    """把 encode_delta 的差异应用到 base 上"""
+    lines = base.splitlines(keepends=True)
+    out, pos = [], 0
+    for op in json.loads(delta):
+        if isinstance(op, str):
+            out.append(op)
+        elif op > 0:
+            out.extend(lines[pos:pos + op])
+            pos += op
+        else:
+            pos -= op
+    return ''.join(out)
+
+
+def revision_state(snippet):
+    """片段当前需要记录到版本中的字段"""
+    return {name: getattr(snippet, name) or '' for name in STATE_FIELDS}
+
+
+def _matches(revision, state):
+    """版本记录与片段状态是否一致"""
+    return revision.content_hash == content_hash(state['content']) and all(
+        (getattr(revision, name) or '') == state[name] for name in STATE_FIELDS if name != 'content'
+    )
+
+
+def _latest(snippet_id):
+    return db.session.scalars(
+        db.select(SnippetRevision).where(SnippetRevision.snippet_id == snippet_id)
+        .order_by(SnippetRevision.number.desc()).limit(1)
+    ).first()
+
+
+def _append(snippet_id, latest, state):
+    """追加一个关键帧版本，差异由 encode_revision_deltas 任务计算"""
+    number = latest.number + 1 if latest is not None else 1
+    text = state['content']
+    store_content(text)
+
+    revision = SnippetRevision(
+        snippet_id=snippet_id, number=number, content_hash=content_hash(text), delta=None,
+        **{name: state[name] for name in STATE_FIELDS if name != 'content'}
+    )
+    db.session.add(revision)
+    return revision
+
+
+def record_revision(snippet, previous):
+    """
+    片段修改后记录版本（不提交事务），previous 为修改前的 revision_state()
+    最新版本与修改前的状态不一致（首次修改，或经批量接口修改过）时先补记修改前的版本
+    """
+    config = current_app.config
+    if not config['REVISIONS_ENABLED']:
+        return None
+    current = revision_state(snippet)
+    if current == previous:
+        return None
+
+    latest = _latest(snippet.id)
+    numbers = []
+    if latest is None or not _matches(latest, previous):
+        latest = _append(snippet.id, latest, previous)
+        numbers.append(latest.number)
+    revision = _append(snippet.id, latest, current)
+    numbers.append(revision.number)
+    enqueue('revisions.encode_deltas', {'snippet_id': snippet.id, 'numbers': numbers})
+
+    keep = config['REVISION_MAX_COUNT']
+    if keep and revision.number > keep:
+        prune_revisions(snippet.id, keep=keep)
+    return revision
+
+
+def _lock_revision(snippet_id, number):
+    """锁定一个版本，计算差异和裁剪旧版本不会同时修改它"""
+    return db.session.scalars(
+        db.select(SnippetRevision).where(SnippetRevision.snippet_id == snippet_id, SnippetRevision.number == number)
+        .with_for_update().execution_options(populate_existing=True)
+    ).first()
+
+
+@job('revisions.encode_deltas')
+def encode_revision_deltas(snippet_id, numbers):
+    """
+    把写入时保存为关键帧的版本改为相对上一版本的差异（后台任务）
+    关键帧位置上的版本、上一版本已被裁剪的版本（保留的最早版本）以及差异过大的版本保持关键帧
+    """
+    interval = current_app.config['REVISION_KEYFRAME_INTERVAL']
+    for number in sorted(numbers):
+        if (number - 1) % interval == 0:
+            continue
+        revision = _lock_revision(snippet_id, number)
+        if revision is None or not revision.is_keyframe:
+            continue
+        _, base_text = get_revision(snippet_id, number - 1)
+        if base_text is None:
+            continue
+        text = db.session.get(SnippetContent, revision.content_hash).text
+        delta = encode_delta(base_text, text)
+        if len(delta) <= len(text) * MAX_DELTA_RATIO:
+            revision.delta = delta
+
+
+_REVISION_COLUMNS = ('snippet_id', 'number', 'title', 'description', 'snippet_type', 'language',
+                     'tags', 'content_hash', 'delta', 'created_at')
+
+
+def _insert_states(condition):
+    """为满足 condition 的片段各追加一个当前状态的关键帧版本（正文已在 snippet_contents 中）"""
+    number = db.select(db.func.coalesce(db.func.max(SnippetRevision.number), 0) + 1).where(
+        SnippetRevision.snippet_id == Snippet.id
+    ).correlate(Snippet).scalar_subquery()
+    db.session.execute(db.insert(SnippetRevision).from_select(_REVISION_COLUMNS, db.select(
+        Snippet.id, number, Snippet.title, Snippet.description, Snippet.snippet_type, Snippet.language,
+        Snippet.tags, Snippet.content_hash, db.null(), db.literal(datetime.utcnow(), db.DateTime)
+    ).where(condition)))
+
+
+def record_batch_before(snippet_ids):
+    """
+    批量修改前调用（不提交事务），snippet_ids 为版本字段会改变的片段；
+    与 record_revision 相同，最新版本与修改前状态不一致的片段先补记修改前的版本
+    """
+    if not current_app.config['REVISIONS_ENABLED'] or not snippet_ids:
+        return
+
+    previous = db.aliased(SnippetRevision)
+    latest = db.select(db.func.max(previous.number)).where(
+        previous.snippet_id == Snippet.id
+    ).correlate(Snippet).scalar_subquery()
+    matches = db.exists().where(
+        SnippetRevision.snippet_id == Snippet.id,
+        SnippetRevision.number == latest,
+        SnippetRevision.content_hash == Snippet.content_hash,
+        *[db.func.coalesce(getattr(SnippetRevision, name), '') == db.func.coalesce(getattr(Snippet, name), '')
+          for name in STATE_FIELDS if name != 'content']
+    )
+    _insert_states(db.and_(Snippet.id.in_(snippet_ids), ~matches))
+
+
+def record_batch_after(snippet_ids):
+    """
+    批量修改后调用（不提交事务），为 record_batch_before 的片段追加修改后的版本
+    批量修改不改变正文，新版本是引用同一正文的关键帧，不需要计算差异；超出保留数量时裁剪
+    """
+    if not current_app.config['REVISIONS_ENABLED'] or not snippet_ids:
+        return
+    _insert_states(Snippet.id.in_(snippet_ids))
+
+    keep = current_app.config['REVISION_MAX_COUNT']
+    if keep:
+        over = db.session.scalars(
+            db.select(SnippetRevision.snippet_id).where(SnippetRevision.snippet_id.in_(snippet_ids))
+            .group_by(SnippetRevision.snippet_id).having(db.func.count() > keep)
+        ).all()
+        for snippet_id in over:
+            prune_revisions(snippet_id, keep=keep)
+
+
+def list_revisions(snippet_id):
+    """片段的版本列表，新的在前"""
+    return db.session.scalars(
+        db.select(SnippetRevision).where(SnippetRevision.snippet_id == snippet_id)
+        .order_by(SnippetRevision.number.desc())
+    ).all()
+
+
+def _chain(snippet_id, number):
+    """重建 number 版本需要的记录：最近的关键帧到目标版本"""
+    keyframe = db.select(db.func.max(SnippetRevision.number)).where(
+        SnippetRevision.snippet_id == snippet_id,
+        SnippetRevision.number <= number,
+        SnippetRevision.delta.is_(None)
+    ).scalar_subquery()
+    return db.session.scalars(
+        db.select(SnippetRevision).where(
+            SnippetRevision.snippet_id == snippet_id,
+            SnippetRevision.number.between(keyframe, number)
+        ).order_by(SnippetRevision.number)
+    ).all()
+
+
+def get_revision(snippet_id, number):
+    """重建指定版本，返回 (版本记录, 正文)，不存在时返回 (None, None)"""
+    chain = _chain(snippet_id, number)
+    if not chain or chain[-1].number != number:
+        return None, None
+    text = db.session.get(SnippetContent, chain[0].content_hash).text
+    for revision in chain[1:]:
+        text = apply_delta(text, revision.delta)
+    return chain[-1], text
+
+
+def prune_revisions(snippet_id, keep=0, before=None):
+    """
+    删除旧版本（不提交事务），返回删除数
+    keep 为保留的最新版本数（0 表示不限），before 之前创建的版本也删除，最新版本始终保留；
+    保留下来的最早版本如果是差异，先转为关键帧
+    """
+    numbers = db.session.execute(
+        db.select(SnippetRevision.number, SnippetRevision.created_at)
+        .where(SnippetRevision.snippet_id == snippet_id).order_by(SnippetRevision.number)
+    ).all()
+    if not numbers:
+        return 0
+
+    first = numbers[0].number
+    if keep:
+        first = max(first, numbers[-1].number - keep + 1)
+    if before is not None:
+        recent = [row.number for row in numbers if row.created_at >= before]
+        first = max(first, recent[0] if recent else numbers[-1].number)
+    if first == numbers[0].number:
+        return 0
+
+    _lock_revision(snippet_id, first)
+    revision, text = get_revision(snippet_id, first)
+    if not revision.is_keyframe:
+        store_content(text)
+        revision.delta = None
+    return db.session.execute(
+        db.delete(SnippetRevision).where(
+            SnippetRevision.snippet_id == snippet_id, SnippetRevision.number < first
+        ),
+        execution_options={'synchronize_session': False}
+    ).rowcount
+
+
+def compact_revisions(max_age_days=None, keep=None):
+    """按保留策略清理所有片段的旧版本，返回删除数"""
+    config = current_app.config
+    max_age_days = config['REVISION_MAX_AGE_DAYS'] if max_age_days is None else max_age_days
+    keep = config['REVISION_MAX_COUNT'] if keep is None else keep
+    before = datetime.utcnow() - timedelta(days=max_age_days) if max_age_days else None
+
+    conditions = []
+    if keep:
+        conditions.append(db.func.count() > keep)
+    if before is not None:
+        conditions.append(db.func.min(SnippetRevision.created_at) < before)
+    if not conditions:
+        return 0
+
+    snippet_ids = db.session.scalars(
+        db.select(SnippetRevision.snippet_id).group_by(SnippetRevision.snippet_id).having(db.or_(*conditions))
+    ).all()
+    deleted = 0
+    for snippet_id in snippet_ids:
+        deleted += prune_revisions(snippet_id, keep=keep, before=before)
+        db.session.commit()
+    return deleted
+
+
+def delete_revisions(snippet_ids):
+    """删除片段时一并删除其版本（不提交事务）"""
+    db.session.execute(
+        db.delete(SnippetRevision).where(SnippetRevision.snippet_id.in_(snippet_ids)),
+        execution_options={'synchronize_session': False}
+    )
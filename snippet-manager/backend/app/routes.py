@@ -1,56 +1,206 @@
-from flask import Blueprint, request, jsonify
-from flask_jwt_extended import jwt_required, get_jwt_identity
+from flask import Blueprint, Response, current_app, request, jsonify, stream_with_context
+from flask_jwt_extended import jwt_required, get_jwt_identity, verify_jwt_in_request
+from sqlalchemy.exc import SQLAlchemyError
 from app import db
-from app.models import Snippet, User
+from app.batch import BatchError, apply_operations, parse_operations
+from app.bulk import RowError, export_lines, import_records, iter_records
+from app.cache import cached_response, get_cache, invalidate_user
+from app.embeddings import (find_similar, schedule_embedding, schedule_missing, schedule_removal,
+                            text_changed)
+from app.etag import (bump_version, collection_etag, is_fresh, not_modified, precondition_failed, snippet_etag,
+                      with_etag)
+from app.fuzzy import apply_fuzzy_search, invalidate_fuzzy_index, resolve_tags
+from app.jobs import job_counts
+from app.models import Snippet, TagError, User, parse_tags
+from app.pagination import CursorError, paginate, parse_limit
+from app.replicas import use_replica
+from app.revisions import delete_revisions, get_revision, list_revisions, record_revision, revision_state
+from app.search import apply_search
+from app.serialization import snippet_columns, snippet_rows, with_content
+from app.stats import adjust_counters, get_stats as load_stats, invalidate_counters, snapshot
+from app.tags import filter_by_tags, tag_counts
 
 bp = Blueprint('api', __name__)
 
+@bp.after_request
+def invalidate_cache_after_write(response):
+    """写操作成功后使当前用户的响应缓存失效"""
+    if request.method in ('POST', 'PUT', 'PATCH', 'DELETE') and response.status_code < 400:
+        verify_jwt_in_request(optional=True)
+        user_id = get_jwt_identity()
+        if user_id is not None:
+            invalidate_user(user_id)
+            invalidate_fuzzy_index(user_id)
+    return response
+
 @bp.route('/health', methods=['GET'])
 def health():
-    """健康检查端点"""
+    """健康检查端点，数据库不可用时返回503，用作就绪探针"""
+    try:
+        db.session.execute(db.text('SELECT 1'))
+    except SQLAlchemyError:
+        db.session.rollback()
+        return jsonify({'status': 'unavailable'}), 503
     return jsonify({'status': 'ok'}), 200
 
+@bp.route('/metrics/pool', methods=['GET'])
+def pool_metrics():
+    """当前 worker 的数据库连接池指标（需开启 POOL_METRICS_ENABLED）"""
+    if not current_app.config['POOL_METRICS_ENABLED']:
+        return jsonify({'error': '未启用'}), 404
+
+    from app.pool import metrics
+    return jsonify(metrics.snapshot(db.engine.pool))
+
+@bp.route('/metrics/cache', methods=['GET'])
+def cache_metrics():
+    """当前 worker 的响应缓存命中统计（需开启 CACHE_METRICS_ENABLED）"""
+    cache = get_cache()
+    if cache is None or not current_app.config['CACHE_METRICS_ENABLED']:
+        return jsonify({'error': '未启用'}), 404
+    return jsonify(cache.stats())
+
+@bp.route('/metrics/jobs', methods=['GET'])
+def job_metrics():
+    """后台任务队列中各状态的任务数（需开启 JOB_METRICS_ENABLED）"""
+    if not current_app.config['JOB_METRICS_ENABLED']:
+        return jsonify({'error': '未启用'}), 404
+    return jsonify(job_counts())
+
 @bp.route('/snippets', methods=['GET'])
 @jwt_required()
+@use_replica
+@cached_response
+@collection_etag
 def get_snippets():
-    """获取当前用户的所有片段，支持搜索和过滤"""
+    """
+    获取当前用户的所有片段，支持搜索和过滤
+    传入 limit 或 cursor 时分页返回 {'items': [...], 'next_cursor': ...}
+    fields 参数（逗号分隔）可只返回部分字段，例如列表视图不需要 content
+    tag 可重复或逗号分隔，tag_mode=all 时要求包含全部标签，默认包含任一标签
+    match=fuzzy 时 search 按 trigram 相似度匹配标题和标签并按相似度排序，tag 匹配最相似的已有标签；
+    超出 FUZZY_SEARCH_BUDGET_MS 时响应带 X-Search-Truncated: true
+    """
     current_user_id = get_jwt_identity()
     snippet_type = request.args.get('type')
     search = request.args.get('search')
-    tag = request.args.get('tag')
+    try:
+        tags = parse_tags(','.join(request.args.getlist('tag')))
+    except TagError as e:
+        return jsonify({'error': str(e)}), 400
+    tag_mode = request.args.get('tag_mode', 'any')
     favorite = request.args.get('favorite')  # 'true' 或 'false'
+    match = request.args.get('match', 'exact')  # 'exact' 或 'fuzzy'
+    fields = request.args.get('fields')
+    limit = request.args.get('limit')
+    cursor = request.args.get('cursor')
 
     # 只查询当前用户的片段
     query = Snippet.query.filter_by(user_id=current_user_id)
 
+    # 字段投影：只从数据库加载需要的列
+    if fields:
+        fields = list(dict.fromkeys(f.strip() for f in fields.split(',') if f.strip()))
+        unknown = set(fields) - set(Snippet.FIELDS)
+        if unknown:
+            return jsonify({'error': f'未知字段: {", ".join(sorted(unknown))}'}), 400
+    else:
+        fields = list(Snippet.FIELDS)
+
+    if match not in ('exact', 'fuzzy'):
+        return jsonify({'error': 'match 只能是 exact 或 fuzzy'}), 400
+    if tag_mode not in ('any', 'all'):
+        return jsonify({'error': 'tag_mode 只能是 any 或 all'}), 400
+    fuzzy = match == 'fuzzy'
+    truncated = False
+
     # 按类型过滤
     if snippet_type:
         query = query.filter_by(snippet_type=snippet_type)
 
-    # 搜索功能
-    if search:
-        search_pattern = f'%{search}%'
-        query = query.filter(
-            db.or_(
-                Snippet.title.like(search_pattern),
-                Snippet.content.like(search_pattern),
-                Snippet.description.like(search_pattern)
-            )
-        )
+    # 搜索功能（全文索引或 trigram 相似度，按相关度排序）
+    if search and fuzzy:
+        query, truncated = apply_fuzzy_search(query, current_user_id, search)
+    elif search:
+        query = apply_search(query, search)
 
-    # 按标签过滤
-    if tag:
-        query = query.filter(Snippet.tags.like(f'%{tag}%'))
+    # 按标签过滤（模糊模式下先把标签名纠正为最相似的已有标签）
+    if tags:
+        if fuzzy:
+            tags = resolve_tags(current_user_id, tags)
+        query = filter_by_tags(query, current_user_id, tags, match_all=tag_mode == 'all')
 
     # 按收藏过滤
     if favorite and favorite.lower() == 'true':
-        query = query.filter_by(is_favorite=True)
+        query = query.filter(Snippet.is_favorite == db.true())
+
+    # 搜索时先按相关度排序，其余按更新时间倒序
+    query = query.order_by(Snippet.updated_at.desc(), Snippet.id.desc())
+
+    # 只查询需要的列，结果是行元组而不是 ORM 实例
+    query = with_content(query.with_entities(*snippet_columns(fields)), fields)
+    native_datetime = getattr(current_app.json, 'native_datetime', False)
+
+    if limit is None and cursor is None:
+        response = jsonify(snippet_rows(query.all(), fields, native_datetime))
+    else:
+        # 普通列表使用 keyset 分页；搜索结果按相关度排序，只能按偏移量翻页
+        try:
+            rows, next_cursor = paginate(query, parse_limit(limit), cursor, keyset=not search)
+        except CursorError:
+            return jsonify({'error': '无效的分页参数'}), 400
+
+        response = jsonify({
+            'items': snippet_rows(rows, fields, native_datetime),
+            'next_cursor': next_cursor
+        })
+
+    if truncated:
+        response.headers['X-Search-Truncated'] = 'true'
+    return response
+
+@bp.route('/snippets/similar', methods=['GET'])
+@jwt_required()
+@use_replica
+def get_similar_snippets():
+    """
+    查找相似片段：id 为参照片段（结果不含其本身），或 q 为查询文本
+    k 为返回数量（默认 10），type 只返回指定类型；结果按相似度从高到低，带 score 字段
+    """
+    if current_app.extensions.get('embeddings') is None:
+        return jsonify({'error': '未启用相似片段搜索'}), 404
+
+    current_user_id = get_jwt_identity()
+    snippet_id = request.args.get('id', type=int)
+    query = request.args.get('q', '').strip()
+    snippet_type = request.args.get('type')
+    k = request.args.get('k', 10, type=int)
+    if not 1 <= k <= current_app.config['SIMILAR_MAX_K']:
+        return jsonify({'error': f"k 必须在 1 到 {current_app.config['SIMILAR_MAX_K']} 之间"}), 400
+
+    if snippet_id is not None:
+        snippet = Snippet.query.filter_by(id=snippet_id, user_id=current_user_id).first()
+        if not snippet:
+            return jsonify({'error': '片段不存在或无权访问'}), 404
+        # 按类型过滤时多取一些候选
+        matches = find_similar(current_user_id, k * 4 if snippet_type else k, snippet=snippet)
+    elif query:
+        matches = find_similar(current_user_id, k * 4 if snippet_type else k, query=query)
+    else:
+        return jsonify({'error': '需要 id 或 q 参数'}), 400
+
+    scores = dict(matches)
+    candidates = Snippet.query.filter(Snippet.user_id == current_user_id, Snippet.id.in_(scores))
+    if snippet_type:
+        candidates = candidates.filter(Snippet.snippet_type == snippet_type)
+    # 向量可能属于刚删除的片段，以数据库中存在的为准
+    found = sorted(candidates, key=lambda s: -scores[s.id])[:k]
 
-    snippets = query.order_by(Snippet.updated_at.desc()).all()
-    return jsonify([snippet.to_dict() for snippet in snippets])
+    return jsonify([dict(s.to_dict(), score=round(scores[s.id], 4)) for s in found])
 
 @bp.route('/snippets/<int:id>', methods=['GET'])
 @jwt_required()
+@use_replica
 def get_snippet(id):
     """获取单个片段"""
     current_user_id = get_jwt_identity()
@@ -59,7 +209,11 @@ def get_snippet(id):
     if not snippet:
         return jsonify({'error': '片段不存在或无权访问'}), 404
 
-    return jsonify(snippet.to_dict())
+    etag = snippet_etag(snippet)
+    if is_fresh(etag):
+        return not_modified(etag)
+
+    return with_etag(jsonify(snippet.to_dict()), etag)
 
 @bp.route('/snippets', methods=['POST'])
 @jwt_required()
@@ -70,6 +224,10 @@ def create_snippet():
 
     if not data.get('title') or not data.get('content'):
         return jsonify({'error': '标题和内容不能为空'}), 400
+    try:
+        tags = parse_tags(data.get('tags'))
+    except TagError as e:
+        return jsonify({'error': str(e)}), 400
 
     snippet = Snippet(
         user_id=current_user_id,
@@ -78,15 +236,87 @@ def create_snippet():
         description=data.get('description', ''),
         snippet_type=data.get('snippet_type', 'code'),
         language=data.get('language', ''),
-        tags=','.join(data.get('tags', [])) if isinstance(data.get('tags'), list) else data.get('tags', ''),
         is_favorite=data.get('is_favorite', False)
     )
+    snippet.set_tags(tags)
 
     db.session.add(snippet)
+    adjust_counters(current_user_id, None, snapshot(snippet))
+    bump_version(current_user_id)
+    db.session.flush()
+    schedule_embedding([snippet.id])
     db.session.commit()
 
     return jsonify(snippet.to_dict()), 201
 
+@bp.route('/snippets/bulk', methods=['POST'])
+@jwt_required()
+def bulk_import():
+    """
+    批量导入片段，请求体为 JSON 数组或 NDJSON（Content-Type: application/x-ndjson）
+    无效记录跳过并在 errors 中返回行号，有效记录在同一个事务中写入
+    """
+    current_user_id = get_jwt_identity()
+    is_ndjson = request.mimetype in ('application/x-ndjson', 'application/ndjson')
+    data = None if is_ndjson else request.get_json(silent=True)
+
+    try:
+        inserted, errors = import_records(
+            current_user_id,
+            iter_records(request.stream, is_ndjson, data),
+            batch_size=current_app.config['BULK_BATCH_SIZE'],
+            max_rows=current_app.config['BULK_IMPORT_MAX_ROWS']
+        )
+    except RowError as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 400
+
+    invalidate_counters(current_user_id)
+    bump_version(current_user_id)
+    if inserted:
+        schedule_missing(current_user_id)
+    db.session.commit()
+
+    return jsonify({'inserted': inserted, 'errors': errors}), 200
+
+@bp.route('/snippets/batch', methods=['POST'])
+@jwt_required()
+def batch_snippets():
+    """
+    批量修改片段，请求体: {'operations': [{'op': 'delete' | 'favorite' | 'update', 'ids': [...], ...}]}
+    favorite 可带 value（默认 true），update 需要 fields；所有操作在同一个事务中执行
+    """
+    current_user_id = get_jwt_identity()
+
+    try:
+        operations = parse_operations(request.get_json(silent=True))
+    except BatchError as e:
+        return jsonify({'error': str(e)}), 400
+
+    results, text_changed = apply_operations(current_user_id, operations)
+    invalidate_counters(current_user_id)
+    bump_version(current_user_id)
+    deleted = {item['id'] for item in results if item['op'] == 'delete' and item['status'] == 'ok'}
+    schedule_removal(current_user_id, list(deleted))
+    # 只为标题或描述实际改变（且没有在同一请求中删除）的片段重新计算向量
+    schedule_embedding(i for i in text_changed if i not in deleted)
+    db.session.commit()
+
+    return jsonify({'results': results}), 200
+
+@bp.route('/snippets/export', methods=['GET'])
+@jwt_required()
+@use_replica
+def export_snippets():
+    """以 NDJSON 流式导出当前用户的全部片段"""
+    current_user_id = get_jwt_identity()
+    lines = export_lines(current_user_id, batch_size=current_app.config['BULK_BATCH_SIZE'])
+    return Response(
+        stream_with_context(lines),
+        mimetype='application/x-ndjson',
+        headers={'Content-Disposition': 'attachment; filename=snippets.ndjson'}
+    )
+
 @bp.route('/snippets/<int:id>', methods=['PUT'])
 @jwt_required()
 def update_snippet(id):
@@ -97,7 +327,19 @@ def update_snippet(id):
     if not snippet:
         return jsonify({'error': '片段不存在或无权修改'}), 404
 
+    # If-Match 乐观并发控制
+    failed = precondition_failed(snippet_etag(snippet))
+    if failed:
+        return failed
+
     data = request.get_json()
+    if 'tags' in data:
+        try:
+            tags = parse_tags(data['tags'])
+        except TagError as e:
+            return jsonify({'error': str(e)}), 400
+    before = snapshot(snippet)
+    previous = revision_state(snippet)
 
     snippet.title = data.get('title', snippet.title)
     snippet.content = data.get('content', snippet.content)
@@ -106,14 +348,19 @@ def update_snippet(id):
     snippet.language = data.get('language', snippet.language)
 
     if 'tags' in data:
-        snippet.tags = ','.join(data['tags']) if isinstance(data['tags'], list) else data['tags']
+        snippet.set_tags(tags)
 
     if 'is_favorite' in data:
         snippet.is_favorite = data['is_favorite']
 
+    record_revision(snippet, previous)
+    adjust_counters(current_user_id, before, snapshot(snippet))
+    bump_version(current_user_id)
+    if text_changed(previous, snippet):
+        schedule_embedding([snippet.id])
     db.session.commit()
 
-    return jsonify(snippet.to_dict())
+    return with_etag(jsonify(snippet.to_dict()), snippet_etag(snippet))
 
 @bp.route('/snippets/<int:id>', methods=['DELETE'])
 @jwt_required()
@@ -125,7 +372,15 @@ def delete_snippet(id):
     if not snippet:
         return jsonify({'error': '片段不存在或无权删除'}), 404
 
+    failed = precondition_failed(snippet_etag(snippet))
+    if failed:
+        return failed
+
+    adjust_counters(current_user_id, snapshot(snippet), None)
+    bump_version(current_user_id)
+    delete_revisions([snippet.id])
     db.session.delete(snippet)
+    schedule_removal(current_user_id, [id])
     db.session.commit()
 
     return '', 204
@@ -140,38 +395,81 @@ def toggle_favorite(id):
     if not snippet:
         return jsonify({'error': '片段不存在或无权修改'}), 404
 
+    failed = precondition_failed(snippet_etag(snippet))
+    if failed:
+        return failed
+
+    before = snapshot(snippet)
     snippet.is_favorite = not snippet.is_favorite
+    adjust_counters(current_user_id, before, snapshot(snippet))
+    bump_version(current_user_id)
     db.session.commit()
 
-    return jsonify(snippet.to_dict())
+    return with_etag(jsonify(snippet.to_dict()), snippet_etag(snippet))
+
+@bp.route('/snippets/<int:id>/revisions', methods=['GET'])
+@jwt_required()
+@use_replica
+def get_snippet_revisions(id):
+    """获取片段的历史版本列表（新的在前，不含正文）"""
+    current_user_id = get_jwt_identity()
+    snippet = Snippet.query.filter_by(id=id, user_id=current_user_id).first()
+
+    if not snippet:
+        return jsonify({'error': '片段不存在或无权访问'}), 404
+
+    return jsonify([revision.to_dict() for revision in list_revisions(id)])
+
+@bp.route('/snippets/<int:id>/revisions/<int:number>', methods=['GET'])
+@jwt_required()
+@use_replica
+def get_snippet_revision(id, number):
+    """获取片段的某个历史版本"""
+    current_user_id = get_jwt_identity()
+    snippet = Snippet.query.filter_by(id=id, user_id=current_user_id).first()
+
+    if not snippet:
+        return jsonify({'error': '片段不存在或无权访问'}), 404
+
+    revision, content = get_revision(id, number)
+    if revision is None:
+        return jsonify({'error': '版本不存在'}), 404
+
+    return jsonify(revision.to_dict(content))
 
 @bp.route('/tags', methods=['GET'])
 @jwt_required()
+@use_replica
+@cached_response
+@collection_etag
 def get_tags():
-    """获取当前用户的所有标签"""
+    """
+    获取当前用户的所有标签
+    prefix: 只返回以此开头的标签（自动补全）；limit: 最多返回数量（正整数）
+    counts=true 时返回 [{'name': ..., 'count': ...}]，否则返回标签名列表
+    """
     current_user_id = get_jwt_identity()
-    snippets = Snippet.query.filter_by(user_id=current_user_id).all()
-    tags = set()
+    prefix = request.args.get('prefix', '').strip()
+    limit = request.args.get('limit')
+    with_counts = request.args.get('counts', '').lower() == 'true'
+
+    if limit is not None:
+        limit = int(limit) if limit.isdigit() else 0
+        if limit < 1:
+            return jsonify({'error': 'limit 必须是正整数'}), 400
 
-    for snippet in snippets:
-        if snippet.tags:
-            tags.update(snippet.tags.split(','))
+    rows = tag_counts(current_user_id, prefix=prefix or None, limit=limit)
 
-    return jsonify(sorted(list(tags)))
+    if with_counts:
+        return jsonify([{'name': name, 'count': count} for name, count in rows])
+    return jsonify([name for name, _ in rows])
 
 @bp.route('/stats', methods=['GET'])
 @jwt_required()
+@use_replica
+@cached_response
+@collection_etag
 def get_stats():
     """获取当前用户的统计信息"""
     current_user_id = get_jwt_identity()
-    total = Snippet.query.filter_by(user_id=current_user_id).count()
-    code_count = Snippet.query.filter_by(user_id=current_user_id, snippet_type='code').count()
-    prompt_count = Snippet.query.filter_by(user_id=current_user_id, snippet_type='prompt').count()
-    favorite_count = Snippet.query.filter_by(user_id=current_user_id, is_favorite=True).count()
-
-    return jsonify({
-        'total': total,
-        'code': code_count,
-        'prompt': prompt_count,
-        'favorite': favorite_count
-    })
+    return jsonify(load_stats(current_user_id))
@@ -0,0 +1,191 @@
+"""
+全文搜索支持
+SQLite 使用 FTS5 虚拟表（trigram 分词，可匹配中文子串），以 snippets_search 视图（片段 + 解压后的正文）为外部内容表，
+PostgreSQL 使用触发器维护的 tsvector 列 + GIN 索引（正文的 tsvector 在写入 snippet_contents 时计算），
+tsvector 只能匹配整词（前缀），每个词同时保留 ILIKE 子串匹配（app.fuzzy 创建的 pg_trgm 索引覆盖标题和描述），
+短词、非 ASCII 词（中文）和符号只走子串匹配，与 SQLite 的匹配结果一致；
+结果均按相关度排序
+"""
+import re
+from flask import current_app
+from sqlalchemy import DDL, event, text, func, literal_column
+from sqlalchemy.orm import aliased
+from app import db
+from app.content import content_text_expression
+from app.models import Snippet, SnippetContent
+
+FTS_TABLE = 'snippets_fts'
+FTS_VIEW = 'snippets_search'
+
+# trigram 分词器无法匹配少于3个字符的词，这类词退回 LIKE 匹配
+MIN_TRIGRAM_LENGTH = 3
+
+# 可以交给 tsvector 前缀匹配的词（其他词只做子串匹配）
+_TSQUERY_TERM = re.compile(r'[A-Za-z0-9_]+')
+
+# bm25 列权重：标题 > 描述 > 内容
+BM25_WEIGHTS = (10.0, 1.0, 4.0)
+
+# 触发器中按 content_hash 取正文明文（snippet_content_text 由 app.content 注册到每个连接）
+_CONTENT_TEXT = 'SELECT snippet_content_text(data, compression) FROM snippet_contents WHERE hash = {row}.content_hash'
+
+_SQLITE_DDL = [
+    f"""CREATE VIEW IF NOT EXISTS {FTS_VIEW} AS
+        SELECT s.id, s.title, snippet_content_text(c.data, c.compression) AS content, s.description
+        FROM snippets s LEFT JOIN snippet_contents c ON c.hash = s.content_hash""",
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        title, content, description,
+        content='{FTS_VIEW}', content_rowid='id', tokenize='trigram'
+    )""",
+    f"""CREATE TRIGGER IF NOT EXISTS snippets_fts_ai AFTER INSERT ON snippets BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, title, content, description)
+        VALUES (new.id, new.title, ({_CONTENT_TEXT.format(row='new')}), new.description);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS snippets_fts_ad AFTER DELETE ON snippets BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, content, description)
+        VALUES ('delete', old.id, old.title, ({_CONTENT_TEXT.format(row='old')}), old.description);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS snippets_fts_au AFTER UPDATE OF title, content_hash, description ON snippets
+    BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, content, description)
+        VALUES ('delete', old.id, old.title, ({_CONTENT_TEXT.format(row='old')}), old.description);
+        INSERT INTO {FTS_TABLE}(rowid, title, content, description)
+        VALUES (new.id, new.title, ({_CONTENT_TEXT.format(row='new')}), new.description);
+    END""",
+]
+
+_POSTGRES_DDL = [
+    "ALTER TABLE snippet_contents ADD COLUMN IF NOT EXISTS search_vector tsvector",
+    "ALTER TABLE snippets ADD COLUMN IF NOT EXISTS search_vector tsvector",
+    """CREATE OR REPLACE FUNCTION snippets_search_vector() RETURNS trigger AS $$
+    BEGIN
+        NEW.search_vector :=
+            setweight(to_tsvector('{config}', coalesce(NEW.title, '')), 'A') ||
+            setweight(to_tsvector('{config}', coalesce(NEW.description, '')), 'B') ||
+            setweight(coalesce((SELECT search_vector FROM snippet_contents WHERE hash = NEW.content_hash),
+                               ''::tsvector), 'C');
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql""",
+    "DROP TRIGGER IF EXISTS snippets_search_vector ON snippets",
+    """CREATE TRIGGER snippets_search_vector BEFORE INSERT OR UPDATE OF title, description, content_hash
+        ON snippets FOR EACH ROW EXECUTE FUNCTION snippets_search_vector()""",
+    # 补齐迁移前已有的片段
+    "UPDATE snippets SET title = title WHERE search_vector IS NULL",
+    "CREATE INDEX IF NOT EXISTS ix_snippets_search_vector ON snippets USING GIN (search_vector)",
+]
+
+# drop_all() 删除 snippets 表时一并删除 FTS 虚拟表和视图，避免残留过期索引
+event.listen(
+    Snippet.__table__, 'after_drop',
+    DDL(f'DROP TABLE IF EXISTS {FTS_TABLE}').execute_if(dialect='sqlite')
+)
+event.listen(
+    Snippet.__table__, 'after_drop',
+    DDL(f'DROP VIEW IF EXISTS {FTS_VIEW}').execute_if(dialect='sqlite')
+)
+
+
+def _sqlite_fts_available(connection):
+    """检查 SQLite 是否编译了 FTS5 且支持 trigram 分词器（3.34+）"""
+    version = tuple(int(part) for part in connection.exec_driver_sql('select sqlite_version()').scalar().split('.'))
+    if version < (3, 34, 0):
+        return False
+    options = {row[0] for row in connection.exec_driver_sql('PRAGMA compile_options')}
+    return 'ENABLE_FTS5' in options
+
+
+def init_search(app):
+    """创建全文索引结构（幂等），在 db.create_all() 之后调用"""
+    engine = db.engine
+    dialect = engine.dialect.name
+    app.extensions['search_backend'] = None
+
+    with engine.begin() as connection:
+        if dialect == 'sqlite':
+            if not _sqlite_fts_available(connection):
+                app.logger.warning('SQLite 不支持 FTS5 trigram，搜索将退回 LIKE 匹配')
+                return
+            exists = connection.exec_driver_sql(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (FTS_TABLE,)
+            ).first()
+            for statement in _SQLITE_DDL:
+                connection.exec_driver_sql(statement)
+            if not exists:
+                # 新建索引时同步已有数据
+                connection.exec_driver_sql(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+            app.extensions['search_backend'] = 'fts5'
+        elif dialect == 'postgresql':
+            config = app.config['SEARCH_TS_CONFIG']
+            if not re.fullmatch(r'[A-Za-z_][A-Za-z0-9_]*', config):
+                raise ValueError(f'无效的 SEARCH_TS_CONFIG: {config}')
+            for statement in _POSTGRES_DDL:
+                connection.exec_driver_sql(statement.format(config=config))
+            app.extensions['search_backend'] = 'tsvector'
+
+
+def _like_filter(term):
+    """子串匹配条件（短词或没有全文索引时使用），与 SQLite 的 LIKE 一样不区分 ASCII 大小写"""
+    pattern = f'%{term}%'
+    # 列表查询本身可能已关联 snippet_contents，子查询使用别名避免被关联掉
+    contents = aliased(SnippetContent)
+    operator = 'ilike' if db.session.get_bind().dialect.name == 'postgresql' else 'like'
+    return db.or_(
+        getattr(Snippet.title, operator)(pattern),
+        db.exists().where(contents.hash == Snippet.content_hash,
+                          getattr(content_text_expression(contents), operator)(pattern)),
+        getattr(Snippet.description, operator)(pattern)
+    )
+
+
+def _fts5_phrase(term):
+    """把用户输入转义为 FTS5 短语，避免语法错误"""
+    return '"' + term.replace('"', '""') + '"'
+
+
+def apply_search(query, search):
+    """
+    给查询加上搜索条件
+    使用全文索引时查询会先按相关度排序
+    """
+    backend = current_app.extensions.get('search_backend')
+    terms = search.split()
+    if not terms:
+        return query
+
+    if backend == 'fts5':
+        indexed = [t for t in terms if len(t) >= MIN_TRIGRAM_LENGTH]
+        for term in terms:
+            if len(term) < MIN_TRIGRAM_LENGTH:
+                query = query.filter(_like_filter(term))
+        if not indexed:
+            return query
+
+        weights = ', '.join(str(w) for w in BM25_WEIGHTS)
+        matches = text(
+            f'SELECT rowid AS snippet_id, bm25({FTS_TABLE}, {weights}) AS rank '
+            f'FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH :match'
+        ).bindparams(match=' '.join(_fts5_phrase(t) for t in indexed))
+        matches = matches.columns(snippet_id=db.Integer, rank=db.Float).subquery('fts')
+        query = query.join(matches, matches.c.snippet_id == Snippet.id)
+        # bm25 越小越相关
+        return query.order_by(matches.c.rank)
+
+    if backend == 'tsvector':
+        vector = literal_column('snippets.search_vector')
+        config = current_app.config['SEARCH_TS_CONFIG']
+        ranked = []
+        for term in terms:
+            condition = _like_filter(term)
+            if len(term) >= MIN_TRIGRAM_LENGTH and _TSQUERY_TERM.fullmatch(term):
+                # 前缀匹配覆盖压缩过、无法做子串匹配的正文
+                ranked.append(f'{term}:*')
+                condition = db.or_(vector.op('@@')(func.to_tsquery(config, f'{term}:*')), condition)
+            query = query.filter(condition)
+        if not ranked:
+            return query
+        return query.order_by(func.ts_rank_cd(vector, func.to_tsquery(config, ' & '.join(ranked))).desc())
+
+    for term in terms:
+        query = query.filter(_like_filter(term))
+    return query
@@ -0,0 +1,113 @@
+"""
+认证相关的资源保护
+- bcrypt 计算放到有界线程池中执行，线程池饱和时立即返回 503，不让登录高峰占满所有 worker
+- 登录前按 IP 和用户名做令牌桶限流，在查询用户和计算哈希之前拒绝超额请求
+限流状态保存在进程内，多 worker 部署时每个 worker 各自计数
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app, jsonify
+
+
+class HashPoolBusy(Exception):
+    """哈希线程池已满"""
+
+
+class HashPool:
+    """有界的 bcrypt 线程池（bcrypt 计算时会释放 GIL）"""
+
+    def __init__(self, workers, max_pending):
+        self.workers = workers
+        self._slots = threading.BoundedSemaphore(workers + max_pending)
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        """延迟创建线程，避免 gunicorn 预加载时在 master 中创建"""
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix='bcrypt')
+        return self._executor
+
+    def run(self, func, *args):
+        """在线程池中执行 func 并等待结果，没有空闲名额时抛出 HashPoolBusy"""
+        if not self._slots.acquire(blocking=False):
+            raise HashPoolBusy()
+        try:
+            return self._get_executor().submit(func, *args).result()
+        finally:
+            self._slots.release()
+
+
+class TokenBucketLimiter:
+    """按 key 计数的令牌桶，rate 为每秒补充的令牌数，burst 为桶容量"""
+
+    MAX_KEYS = 10000
+
+    def __init__(self, per_minute, burst=None):
+        self.rate = per_minute / 60.0
+        self.burst = burst or per_minute
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def _prune(self, now):
+        """清理已经补满的桶，限制内存占用"""
+        full = [key for key, (tokens, updated) in self._buckets.items()
+                if tokens + (now - updated) * self.rate >= self.burst]
+        for key in full:
+            del self._buckets[key]
+
+    def consume(self, key):
+        """取一个令牌，成功返回 0，否则返回需要等待的秒数"""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            if tokens < 1:
+                self._buckets[key] = (tokens, now)
+                return (1 - tokens) / self.rate
+            self._buckets[key] = (tokens - 1, now)
+            if len(self._buckets) > self.MAX_KEYS:
+                self._prune(now)
+            return 0
+
+
+def init_security(app):
+    """创建哈希线程池和登录限流器"""
+    app.extensions['hash_pool'] = HashPool(
+        app.config['HASH_POOL_WORKERS'], app.config['HASH_POOL_MAX_PENDING']
+    )
+
+    limiters = {}
+    if app.config['LOGIN_RATE_PER_IP']:
+        limiters['ip'] = TokenBucketLimiter(app.config['LOGIN_RATE_PER_IP'])
+    if app.config['LOGIN_RATE_PER_USER']:
+        limiters['user'] = TokenBucketLimiter(app.config['LOGIN_RATE_PER_USER'])
+    app.extensions['login_limiters'] = limiters
+
+    @app.errorhandler(HashPoolBusy)
+    def handle_hash_pool_busy(error):
+        """线程池饱和时快速失败"""
+        response = jsonify({'error': '服务繁忙，请稍后重试'})
+        response.status_code = 503
+        response.headers['Retry-After'] = '1'
+        return response
+
+
+def run_hash(func, *args):
+    """在哈希线程池中执行 bcrypt 计算"""
+    return current_app.extensions['hash_pool'].run(func, *args)
+
+
+def check_login_rate(ip, username=None):
+    """检查登录限流，超额时返回需要等待的秒数，否则返回 0"""
+    limiters = current_app.extensions['login_limiters']
+    if 'ip' in limiters:
+        wait = limiters['ip'].consume(ip or '-')
+        if wait:
+            return wait
+    if username and 'user' in limiters:
+        return limiters['user'].consume(username.lower())
+    return 0
@@ -0,0 +1,93 @@
+"""
+JSON 序列化
+- 安装了 orjson 时使用 OrjsonProvider 替换 Flask 默认的 JSON provider（JSON_PROVIDER=auto）
+- 片段列表直接从 Core 查询的行元组生成字典，不创建 ORM 实例，也不逐行调用 to_dict()；
+  只有请求了 content 字段时才关联 snippet_contents 读取正文
+"""
+from datetime import datetime
+from flask.json.provider import DefaultJSONProvider
+from app.content import decode_content
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """基于 orjson 的 JSON provider，datetime 原生输出为 ISO 格式"""
+
+    # snippet_rows 据此判断是否需要预先把 datetime 转成字符串
+    native_datetime = True
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default, option=orjson.OPT_NON_STR_KEYS).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        body = orjson.dumps(obj, default=self.default, option=orjson.OPT_NON_STR_KEYS) + b'\n'
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+
+def init_json(app):
+    """按 JSON_PROVIDER 配置选择 JSON provider：auto / orjson / default"""
+    kind = app.config['JSON_PROVIDER']
+    if kind == 'orjson' and orjson is None:
+        raise RuntimeError('JSON_PROVIDER=orjson 需要安装 orjson 包')
+    if kind == 'orjson' or (kind == 'auto' and orjson is not None):
+        app.json = OrjsonProvider(app)
+    elif kind not in ('auto', 'default'):
+        raise ValueError(f'未知的 JSON_PROVIDER: {kind}')
+
+
+def snippet_columns(fields):
+    """
+    列表查询需要的列：先是输出字段，再补上分页用的 id 和 updated_at，
+    请求了 content 时最后附加压缩方式；与 with_content、snippet_rows 配合使用
+    """
+    from app.models import Snippet, SnippetContent
+    names = list(fields) + [name for name in ('id', 'updated_at') if name not in fields]
+    columns = [SnippetContent.data if name == 'content' else getattr(Snippet, name) for name in names]
+    if 'content' in fields:
+        columns.append(SnippetContent.compression)
+    return columns
+
+
+def with_content(query, fields):
+    """请求了 content 时关联正文表（ORM 查询和 Core select 均可）"""
+    from app.models import Snippet, SnippetContent
+    if 'content' not in fields:
+        return query
+    return query.outerjoin(SnippetContent, SnippetContent.hash == Snippet.content_hash)
+
+
+def snippet_rows(rows, fields, native_datetime=False):
+    """
+    把 snippet_columns 查询出的行转换为字典列表，格式与 Snippet.to_dict() 一致
+    native_datetime=True 时保留 datetime，交给 JSON provider 编码
+    """
+    tags_index = fields.index('tags') if 'tags' in fields else None
+    content_index = fields.index('content') if 'content' in fields else None
+    datetime_indexes = [] if native_datetime else [
+        index for index, name in enumerate(fields) if name in ('created_at', 'updated_at')
+    ]
+    if tags_index is None and content_index is None and not datetime_indexes:
+        return [dict(zip(fields, row)) for row in rows]
+
+    items = []
+    for row in rows:
+        values = list(row[:len(fields)])
+        if tags_index is not None:
+            tags = values[tags_index]
+            values[tags_index] = tags.split(',') if tags else []
+        if content_index is not None:
+            values[content_index] = decode_content(values[content_index], row[-1])
+        for index in datetime_indexes:
+            value = values[index]
+            if isinstance(value, datetime):
+                values[index] = value.isoformat()
+        items.append(dict(zip(fields, values)))
+    return items
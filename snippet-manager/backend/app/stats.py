@@ -0,0 +1,108 @@
+"""
+片段统计：单次条件聚合查询，可选地使用 user_stats 计数表缓存结果
+"""
+from flask import current_app
+from app import db
+from app.models import Snippet, UserStats
+from app.replicas import on_replica
+
+COUNTERS = ('total', 'code', 'prompt', 'favorite')
+
+
+def _aggregate_columns():
+    """一次扫描同时计算四个计数"""
+    return (
+        db.func.count(Snippet.id),
+        db.func.count(db.case((Snippet.snippet_type == 'code', 1))),
+        db.func.count(db.case((Snippet.snippet_type == 'prompt', 1))),
+        db.func.count(db.case((Snippet.is_favorite.is_(True), 1))),
+    )
+
+
+def compute_stats(user_id):
+    """直接从 snippets 表聚合统计"""
+    row = db.session.query(*_aggregate_columns()).filter(Snippet.user_id == user_id).one()
+    return dict(zip(COUNTERS, row))
+
+
+def counters_enabled():
+    """是否启用计数表"""
+    return current_app.config.get('STATS_COUNTERS_ENABLED', False)
+
+
+def get_stats(user_id):
+    """获取统计信息，启用计数表时为一次主键查询"""
+    if not counters_enabled():
+        return compute_stats(user_id)
+
+    stats = db.session.get(UserStats, user_id)
+    if stats is None:
+        if on_replica():
+            # 副本上可能只是尚未复制，不在这里初始化
+            return compute_stats(user_id)
+        # 首次访问时从源数据初始化
+        stats = UserStats(user_id=user_id, **compute_stats(user_id))
+        db.session.add(stats)
+        db.session.commit()
+    return stats.to_dict()
+
+
+def snapshot(snippet):
+    """记录片段中影响计数的字段，删除或不存在时为 None"""
+    if snippet is None:
+        return None
+    return snippet.snippet_type, bool(snippet.is_favorite)
+
+
+def _contribution(state):
+    """单个片段对各计数的贡献"""
+    if state is None:
+        return dict.fromkeys(COUNTERS, 0)
+    snippet_type, is_favorite = state
+    return {
+        'total': 1,
+        'code': int(snippet_type == 'code'),
+        'prompt': int(snippet_type == 'prompt'),
+        'favorite': int(is_favorite),
+    }
+
+
+def adjust_counters(user_id, before, after):
+    """
+    按片段变更前后的 snapshot 增量更新计数表
+    在写操作所在的事务中调用，随同一次 commit 生效
+    """
+    if not counters_enabled():
+        return
+    old, new = _contribution(before), _contribution(after)
+    deltas = {name: new[name] - old[name] for name in COUNTERS}
+    if not any(deltas.values()):
+        return
+    # 计数行不存在时跳过，下次读取会从源数据初始化
+    db.session.execute(
+        db.update(UserStats).where(UserStats.user_id == user_id).values({
+            getattr(UserStats, name): getattr(UserStats, name) + delta
+            for name, delta in deltas.items() if delta
+        })
+    )
+
+
+def invalidate_counters(user_id):
+    """删除计数行，下次读取时重新聚合（用于批量写入）"""
+    if counters_enabled():
+        db.session.execute(db.delete(UserStats).where(UserStats.user_id == user_id))
+
+
+def repair_counters(user_id=None):
+    """从 snippets 表重算计数表，返回重算的用户数"""
+    query = db.session.query(Snippet.user_id, *_aggregate_columns()).group_by(Snippet.user_id)
+    stale = db.delete(UserStats)
+    if user_id is not None:
+        query = query.filter(Snippet.user_id == user_id)
+        stale = stale.where(UserStats.user_id == user_id)
+
+    rows = query.all()
+    db.session.execute(stale)
+    db.session.add_all(UserStats(user_id=row[0], **dict(zip(COUNTERS, row[1:]))) for row in rows)
+    db.session.commit()
+    return len(rows)
@@ -0,0 +1,84 @@
+"""
+标签查询：基于 tags / snippet_tags 表的过滤，走 (user_id, name) 唯一索引
+"""
+from sqlalchemy.exc import IntegrityError
+from app import db
+from app.models import TAG_MAX_LENGTH, Snippet, Tag, snippet_tags, split_tags
+
+
+def filter_by_tags(query, user_id, names, match_all=False):
+    """
+    按标签过滤片段
+    match_all=True 时片段必须包含全部标签（AND），否则包含任一标签即可（OR）
+    """
+    matched = db.select(snippet_tags.c.snippet_id).join(
+        Tag, Tag.id == snippet_tags.c.tag_id
+    ).where(Tag.user_id == user_id, Tag.name.in_(names))
+
+    if match_all and len(names) > 1:
+        matched = matched.group_by(snippet_tags.c.snippet_id).having(
+            db.func.count(snippet_tags.c.tag_id) == len(names)
+        )
+
+    return query.filter(Snippet.id.in_(matched))
+
+
+def tag_counts(user_id, prefix=None, limit=None):
+    """
+    在数据库中按标签分组统计使用次数，返回 [(name, count), ...]
+    prefix 用于自动补全，只返回以该前缀开头的标签
+    """
+    count = db.func.count(snippet_tags.c.snippet_id)
+    query = db.session.query(Tag.name, count).join(
+        snippet_tags, snippet_tags.c.tag_id == Tag.id
+    ).filter(Tag.user_id == user_id)
+
+    if prefix:
+        escaped = prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        query = query.filter(Tag.name.like(f'{escaped}%', escape='\\'))
+
+    query = query.group_by(Tag.id, Tag.name)
+    if limit is not None:
+        # 自动补全时优先返回常用标签
+        query = query.order_by(count.desc(), Tag.name).limit(limit)
+    else:
+        query = query.order_by(Tag.name)
+    return query.all()
+
+
+def backfill_tags(batch_size=500):
+    """
+    从旧的逗号分隔 tags 列回填 tags / snippet_tags 表
+    只处理还没有关联记录的片段，可重复执行，返回处理的片段数；过长的旧标签名截断到 TAG_MAX_LENGTH
+    """
+    linked = db.select(snippet_tags.c.snippet_id)
+    processed = 0
+    last_id = 0
+
+    while True:
+        snippets = Snippet.query.filter(
+            Snippet.id > last_id, Snippet.tags.isnot(None), Snippet.tags != '', Snippet.id.notin_(linked)
+        ).order_by(Snippet.id).limit(batch_size).all()
+        if not snippets:
+            break
+
+        for snippet in snippets:
+            snippet.set_tags([name[:TAG_MAX_LENGTH] for name in split_tags(snippet.tags)])
+        db.session.commit()
+        processed += len(snippets)
+        last_id = snippets[-1].id
+
+    return processed
+
+
+def migrate_legacy_tags(app):
+    """启动时回填旧数据的标签关联（幂等，没有待回填的片段时只执行一次查询）"""
+    try:
+        count = backfill_tags()
+    except IntegrityError:
+        # 多个进程同时启动时由其中一个完成回填
+        db.session.rollback()
+        app.logger.warning('标签回填与其他进程冲突，跳过')
+        return
+    if count:
+        app.logger.info('已回填 %s 个片段的标签', count)
@@ -0,0 +1,9 @@
+"""
+ASGI 入口
+启动: uvicorn asgi:app --host 0.0.0.0 --port 5000 --workers 4
+需要额外安装: pip install -r requirements-asgi.txt
+"""
+from app import create_app
+from app.asgi import create_asgi_app
+
+app = create_asgi_app(create_app())
@@ -0,0 +1 @@
+"""API 压测与基准测试"""
@@ -0,0 +1,305 @@
+"""
+片段 API 基准测试
+在 backend 目录下运行：
+
+    # 进程内（Flask test client），测量应用本身的开销
+    python -m benchmarks.bench_api --users 2 --snippets 5000
+
+    # 启动本地 gunicorn，通过 HTTP 并发请求
+    python -m benchmarks.bench_api --mode http --gunicorn --concurrency 8
+
+    # 对比两次结果
+    python -m benchmarks.bench_api --compare benchmarks/results/a.json benchmarks/results/b.json
+
+每个接口输出 p50/p95/p99 延迟和每秒请求数，结果以 JSON 保存在 benchmarks/results/ 下
+"""
+import argparse
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(BACKEND_DIR, 'benchmarks', 'results')
+
+# 接口名 -> (方法, 路径, 请求体)
+ENDPOINTS = {
+    'list_page': ('GET', '/api/snippets?limit=50&fields=id,title,tags,snippet_type,is_favorite,updated_at', None),
+    'list_full': ('GET', '/api/snippets', None),
+    'search': ('GET', '/api/snippets?search=abc&limit=50', None),
+    'tag_filter': ('GET', '/api/snippets?tag=tag1&limit=50', None),
+    'get_tags': ('GET', '/api/tags', None),
+    'get_stats': ('GET', '/api/stats', None),
+    'create': ('POST', '/api/snippets', {
+        'title': 'benchmark', 'content': 'x = 1\n' * 50, 'snippet_type': 'code', 'tags': ['bench']
+    }),
+    'login': ('POST', '/api/auth/login', None),
+}
+
+
+class InProcessClient:
+    """通过 Flask test client 发送请求，每个线程一个客户端"""
+
+    def __init__(self, app):
+        self.app = app
+        self._local = threading.local()
+
+    def request(self, method, path, body=None, headers=None):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        response = client.open(path, method=method, json=body, headers=headers)
+        return response.status_code, response.get_json(silent=True)
+
+
+class HttpClient:
+    """通过 HTTP 发送请求，每个线程一个连接会话"""
+
+    def __init__(self, base_url):
+        import requests
+        self._requests = requests
+        self.base_url = base_url.rstrip('/')
+        self._local = threading.local()
+
+    def request(self, method, path, body=None, headers=None):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = self._requests.Session()
+        response = session.request(method, self.base_url + path, json=body, headers=headers)
+        try:
+            data = response.json()
+        except ValueError:
+            data = None
+        return response.status_code, data
+
+
+def percentile(sorted_values, pct):
+    """最近秩法计算百分位数"""
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def run_endpoint(client, method, path, body, headers, requests_count, concurrency, warmup):
+    """对单个接口发起请求，返回统计结果"""
+    for _ in range(warmup):
+        client.request(method, path, body, headers)
+
+    latencies, errors = [], 0
+    lock = threading.Lock()
+
+    def one(_):
+        nonlocal errors
+        start = time.perf_counter()
+        status, _data = client.request(method, path, body, headers)
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies.append(elapsed)
+            if status >= 400:
+                errors += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        list(executor.map(one, range(requests_count)))
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        'requests': requests_count,
+        'errors': errors,
+        'rps': round(requests_count / wall, 2) if wall else 0.0,
+        'mean_ms': round(sum(latencies) / len(latencies) * 1000, 3),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+    }
+
+
+def _free_port():
+    """获取一个空闲端口"""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_gunicorn(env, workers, threads):
+    """启动本地 gunicorn 并等待 /api/health 就绪，返回 (进程, base_url)"""
+    import requests
+
+    port = _free_port()
+    env = dict(os.environ, **env, GUNICORN_BIND=f'127.0.0.1:{port}',
+               GUNICORN_WORKERS=str(workers), GUNICORN_THREADS=str(threads),
+               GUNICORN_ACCESS_LOG='/dev/null')
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'run:app'],
+        cwd=BACKEND_DIR, env=env
+    )
+    base_url = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(base_url + '/api/health', timeout=1).status_code == 200:
+                return process, base_url
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError('gunicorn 启动超时')
+
+
+def git_revision():
+    """当前提交的短哈希"""
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=BACKEND_DIR, text=True, stderr=subprocess.DEVNULL
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def make_app(database_url):
+    """创建压测用的应用（关闭登录限流）"""
+    from app import create_app
+    from config import Config
+
+    class BenchmarkConfig(Config):
+        SQLALCHEMY_DATABASE_URI = database_url
+        LOGIN_RATE_PER_IP = 0
+        LOGIN_RATE_PER_USER = 0
+
+    return create_app(BenchmarkConfig)
+
+
+def run(args):
+    """准备数据并依次压测各接口"""
+    from seed_data import BENCH_PASSWORD, seed_benchmark
+
+    tmpdir = None
+    database_url = args.database_url
+    if not database_url:
+        tmpdir = tempfile.mkdtemp(prefix='snippets-bench-')
+        database_url = 'sqlite:///' + os.path.join(tmpdir, 'bench.db')
+
+    app = make_app(database_url)
+    print(f'生成数据: {args.users} 个用户 x {args.snippets} 个片段 ...')
+    usernames = seed_benchmark(args.users, args.snippets, args.content_size, args.tags,
+                               args.tags_per_snippet, seed=args.seed, app=app)
+
+    process = None
+    if args.mode == 'http':
+        if args.gunicorn:
+            env = {'DATABASE_URL': database_url, 'LOGIN_RATE_PER_IP': '0', 'LOGIN_RATE_PER_USER': '0'}
+            process, base_url = start_gunicorn(env, args.workers, args.threads)
+        else:
+            base_url = args.url
+        client = HttpClient(base_url)
+    else:
+        client = InProcessClient(app)
+
+    try:
+        credentials = {'username': usernames[0], 'password': BENCH_PASSWORD}
+        status, data = client.request('POST', '/api/auth/login', credentials)
+        if status != 200:
+            raise RuntimeError(f'登录失败: {status} {data}')
+        headers = {'Authorization': f"Bearer {data['access_token']}"}
+
+        selected = args.endpoints.split(',') if args.endpoints else list(ENDPOINTS)
+        results = {}
+        for name in selected:
+            method, path, body = ENDPOINTS[name]
+            if name == 'login':
+                body, request_headers, count = credentials, None, min(args.requests, args.login_requests)
+            else:
+                request_headers, count = headers, args.requests
+            results[name] = run_endpoint(client, method, path, body, request_headers,
+                                         count, args.concurrency, args.warmup)
+            r = results[name]
+            print(f"{name:<12} p50 {r['p50_ms']:>9.2f}ms  p95 {r['p95_ms']:>9.2f}ms  "
+                  f"p99 {r['p99_ms']:>9.2f}ms  {r['rps']:>9.1f} req/s  errors {r['errors']}")
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    return {
+        'meta': {
+            'revision': git_revision(),
+            'timestamp': datetime.utcnow().isoformat(timespec='seconds'),
+            'mode': args.mode,
+            'database': database_url.split(':', 1)[0],
+            'python': platform.python_version(),
+            'params': {
+                'users': args.users, 'snippets': args.snippets, 'content_size': args.content_size,
+                'tags': args.tags, 'requests': args.requests, 'concurrency': args.concurrency,
+            },
+        },
+        'results': results,
+    }
+
+
+def compare(old_path, new_path):
+    """打印两次结果的差异（负数表示变快）"""
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+
+    print(f"{old['meta']['revision']} -> {new['meta']['revision']}")
+    for name, after in new['results'].items():
+        before = old['results'].get(name)
+        if not before:
+            continue
+        changes = []
+        for key in ('p50_ms', 'p95_ms', 'p99_ms', 'rps'):
+            delta = (after[key] - before[key]) / before[key] * 100 if before[key] else 0.0
+            changes.append(f'{key} {before[key]:.2f} -> {after[key]:.2f} ({delta:+.1f}%)')
+        print(f'{name:<12} ' + '  '.join(changes))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='片段 API 基准测试')
+    parser.add_argument('--mode', choices=('inprocess', 'http'), default='inprocess')
+    parser.add_argument('--gunicorn', action='store_true', help='http 模式下启动本地 gunicorn')
+    parser.add_argument('--url', default='http://127.0.0.1:5000', help='http 模式下的服务地址')
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn worker 数')
+    parser.add_argument('--threads', type=int, default=4, help='gunicorn 每个 worker 的线程数')
+    parser.add_argument('--database-url', help='数据库地址，默认使用临时 SQLite 文件')
+    parser.add_argument('--users', type=int, default=2)
+    parser.add_argument('--snippets', type=int, default=2000, help='每个用户的片段数')
+    parser.add_argument('--content-size', type=int, default=2000)
+    parser.add_argument('--tags', type=int, default=50)
+    parser.add_argument('--tags-per-snippet', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--requests', type=int, default=200, help='每个接口的请求数')
+    parser.add_argument('--login-requests', type=int, default=20, help='登录接口的请求数（bcrypt 较慢）')
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--warmup', type=int, default=5)
+    parser.add_argument('--endpoints', help=f'逗号分隔，可选: {",".join(ENDPOINTS)}')
+    parser.add_argument('--output', help='结果文件路径，默认 benchmarks/results/<revision>-<time>.json')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='对比两个结果文件')
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    result = run(args)
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"{result['meta']['revision']}-{datetime.utcnow():%Y%m%d%H%M%S}.json"
+    )
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(result, f, indent=2, ensure_ascii=False)
+    print(f'结果已保存: {output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""
+片段列表序列化基准测试
+对比三种生成列表响应体的方式（默认 1 个用户 x 10000 个片段）：
+
+- orm_to_dict: ORM 实例 + Snippet.to_dict() + Flask 内置 JSON provider（优化前）
+- rows_json:   Core 行元组 + snippet_rows() + Flask 内置 JSON provider
+- rows_orjson: Core 行元组 + snippet_rows() + OrjsonProvider（当前默认）
+
+在 backend 目录下运行：
+
+    python -m benchmarks.bench_serialization --snippets 10000
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+
+def measure(func, repeat):
+    """执行 repeat 次，返回每次耗时（毫秒）和最后一次的结果"""
+    timings, result = [], None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='片段列表序列化基准测试')
+    parser.add_argument('--snippets', type=int, default=10000)
+    parser.add_argument('--content-size', type=int, default=500)
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+
+    from flask.json.provider import DefaultJSONProvider
+    from app import db
+    from app.models import Snippet, User
+    from app.serialization import OrjsonProvider, orjson, snippet_columns, snippet_rows
+    from benchmarks.bench_api import make_app
+    from seed_data import seed_benchmark
+
+    tmpdir = tempfile.mkdtemp(prefix='snippets-bench-')
+    app = make_app('sqlite:///' + os.path.join(tmpdir, 'bench.db'))
+    seed_benchmark(1, args.snippets, args.content_size, app=app)
+
+    default_provider = DefaultJSONProvider(app)
+    fields = list(Snippet.FIELDS)
+
+    with app.app_context():
+        user_id = User.query.filter_by(username='bench0').one().id
+        query = Snippet.query.filter_by(user_id=user_id).order_by(Snippet.updated_at.desc(), Snippet.id.desc())
+
+        cases = {
+            'orm_to_dict': lambda: default_provider.response(
+                [snippet.to_dict() for snippet in query.all()]).get_data(),
+            'rows_json': lambda: default_provider.response(
+                snippet_rows(query.with_entities(*snippet_columns(fields)).all(), fields)).get_data(),
+        }
+        if orjson is not None:
+            orjson_provider = OrjsonProvider(app)
+            cases['rows_orjson'] = lambda: orjson_provider.response(
+                snippet_rows(query.with_entities(*snippet_columns(fields)).all(), fields, True)).get_data()
+        else:
+            print('未安装 orjson，跳过 rows_orjson')
+
+        baseline = None
+        print(f'{args.snippets} 个片段，每种方式执行 {args.repeat} 次')
+        for name, func in cases.items():
+            db.session.expunge_all()
+            timings, body = measure(func, args.repeat)
+            median = statistics.median(timings)
+            baseline = baseline or median
+            print(f'{name:<12} 中位数 {median:>8.1f}ms  最小 {min(timings):>8.1f}ms  '
+                  f'{baseline / median:>5.2f}x  响应 {len(body) / 1024:>8.0f}KB')
+
+
+if __name__ == '__main__':
+    main()
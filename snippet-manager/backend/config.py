@@ -11,7 +11,134 @@ class Config:
         'sqlite:///' + os.path.join(basedir, 'instance', 'snippets.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+    # 只读副本（逗号分隔），只读接口按 DATABASE_REPLICA_STRATEGY（round_robin / least_connections）选择副本；
+    # 用户写操作后 DATABASE_REPLICA_STICKY_SECONDS 秒内读主库，应大于副本的复制延迟
+    DATABASE_REPLICA_URLS = os.environ.get('DATABASE_REPLICA_URLS') or ''
+    DATABASE_REPLICA_STRATEGY = os.environ.get('DATABASE_REPLICA_STRATEGY') or 'round_robin'
+    DATABASE_REPLICA_STICKY_SECONDS = int(os.environ.get('DATABASE_REPLICA_STICKY_SECONDS') or 5)
+
+    # 数据库连接池配置（仅对 PostgreSQL 等服务端数据库生效）
+    # 默认每个 worker 的连接数与线程数一致，避免线程等待连接
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE') or os.environ.get('GUNICORN_THREADS') or 5)
+    DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW') or 2)
+    DB_POOL_TIMEOUT = int(os.environ.get('DB_POOL_TIMEOUT') or 10)
+    DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE') or 1800)
+    DB_POOL_PRE_PING = os.environ.get('DB_POOL_PRE_PING', 'true').lower() == 'true'
+    # 通过 PgBouncer（事务模式）连接时不在应用端保持连接
+    DB_PGBOUNCER = os.environ.get('DB_PGBOUNCER', 'false').lower() == 'true'
+    # 获取连接等待超过该毫秒数时记录警告日志
+    DB_POOL_SLOW_CHECKOUT_MS = int(os.environ.get('DB_POOL_SLOW_CHECKOUT_MS') or 100)
+    # 是否开放 /api/metrics/pool 连接池指标端点
+    POOL_METRICS_ENABLED = os.environ.get('POOL_METRICS_ENABLED', 'false').lower() == 'true'
+
+    # JSON provider：auto（安装了 orjson 时使用）/ orjson / default（Flask 内置）
+    JSON_PROVIDER = os.environ.get('JSON_PROVIDER') or 'auto'
+
+    # 响应压缩：按 Accept-Encoding 协商，COMPRESSION_ALGORITHMS 为服务端优先顺序
+    # br 需要 brotli 包，zstd 需要 zstandard 包，未安装时自动跳过
+    COMPRESSION_ENABLED = os.environ.get('COMPRESSION_ENABLED', 'true').lower() == 'true'
+    COMPRESSION_ALGORITHMS = os.environ.get('COMPRESSION_ALGORITHMS') or 'br,zstd,gzip'
+    COMPRESSION_MIN_SIZE = int(os.environ.get('COMPRESSION_MIN_SIZE') or 1024)
+    COMPRESSION_GZIP_LEVEL = int(os.environ.get('COMPRESSION_GZIP_LEVEL') or 6)
+    COMPRESSION_BR_LEVEL = int(os.environ.get('COMPRESSION_BR_LEVEL') or 4)
+    COMPRESSION_ZSTD_LEVEL = int(os.environ.get('COMPRESSION_ZSTD_LEVEL') or 3)
+
+    # 请求剖析：记录每个请求的耗时、SQL 语句数和序列化耗时，输出 Server-Timing 头和 /metrics
+    PROFILING_ENABLED = os.environ.get('PROFILING_ENABLED', 'false').lower() == 'true'
+    # 抓取 /metrics 需要的 Bearer 令牌，为空时不提供 /metrics
+    PROFILING_METRICS_TOKEN = os.environ.get('PROFILING_METRICS_TOKEN') or ''
+    # 单个请求 SQL 语句数超过该值时记录警告（0 表示不检查）
+    PROFILING_SQL_WARN_COUNT = int(os.environ.get('PROFILING_SQL_WARN_COUNT') or 20)
+    # 单条 SQL 超过该毫秒数时记录警告（0 表示不检查）
+    PROFILING_SLOW_QUERY_MS = int(os.environ.get('PROFILING_SLOW_QUERY_MS') or 200)
+    # 对 PROFILING_SAMPLE_RATE 比例的请求做剖析，耗时超过 PROFILING_SLOW_MS 的结果保存到 PROFILING_DIR
+    PROFILING_SLOW_MS = int(os.environ.get('PROFILING_SLOW_MS') or 0)
+    PROFILING_SAMPLE_RATE = float(os.environ.get('PROFILING_SAMPLE_RATE') or 0.1)
+    PROFILER = os.environ.get('PROFILER') or 'cprofile'  # cprofile / pyinstrument
+    PROFILING_DIR = os.environ.get('PROFILING_DIR') or os.path.join(basedir, 'instance', 'profiles')
+
+    # ASGI 模式（uvicorn asgi:app）：执行 Flask 请求的线程数、每个请求排队待发送的响应块数，
+    # 以及请求体在内存中缓冲的上限（超过后写入临时文件）
+    ASGI_THREADS = int(os.environ.get('ASGI_THREADS') or DB_POOL_SIZE)
+    ASGI_SEND_QUEUE_SIZE = int(os.environ.get('ASGI_SEND_QUEUE_SIZE') or 16)
+    ASGI_BODY_MEMORY_LIMIT = int(os.environ.get('ASGI_BODY_MEMORY_LIMIT') or 1024 * 1024)
+
+    # 片段正文压缩：none / zlib / zstd（需要 zstandard 包），超过 CONTENT_COMPRESSION_MIN_SIZE 字节的正文才压缩
+    CONTENT_COMPRESSION = os.environ.get('CONTENT_COMPRESSION') or 'zlib'
+    CONTENT_COMPRESSION_MIN_SIZE = int(os.environ.get('CONTENT_COMPRESSION_MIN_SIZE') or 4096)
+
+    # 片段历史版本：每 REVISION_KEYFRAME_INTERVAL 个版本保存一次完整正文，其余保存差异；
+    # 每个片段最多保留 REVISION_MAX_COUNT 个版本，flask compact-revisions 删除超过 REVISION_MAX_AGE_DAYS 天的版本（0 表示不限）
+    REVISIONS_ENABLED = os.environ.get('REVISIONS_ENABLED', 'true').lower() == 'true'
+    REVISION_KEYFRAME_INTERVAL = int(os.environ.get('REVISION_KEYFRAME_INTERVAL') or 10)
+    REVISION_MAX_COUNT = int(os.environ.get('REVISION_MAX_COUNT') or 50)
+    REVISION_MAX_AGE_DAYS = int(os.environ.get('REVISION_MAX_AGE_DAYS') or 0)
+
+    # 全文搜索配置（PostgreSQL 的 text search configuration，中文可用 zhparser 等扩展）
+    SEARCH_TS_CONFIG = os.environ.get('SEARCH_TS_CONFIG') or 'simple'
+
+    # 模糊搜索（match=fuzzy）：相似度阈值、最多返回的匹配数、单次搜索的时间预算，
+    # 以及进程内 trigram 索引最多缓存的用户数（PostgreSQL 使用 pg_trgm，不需要进程内索引）
+    FUZZY_SEARCH_THRESHOLD = float(os.environ.get('FUZZY_SEARCH_THRESHOLD') or 0.4)
+    FUZZY_SEARCH_LIMIT = int(os.environ.get('FUZZY_SEARCH_LIMIT') or 100)
+    FUZZY_SEARCH_BUDGET_MS = int(os.environ.get('FUZZY_SEARCH_BUDGET_MS') or 50)
+    FUZZY_INDEX_MAX_USERS = int(os.environ.get('FUZZY_INDEX_MAX_USERS') or 256)
+
+    # 相似片段搜索：片段向量由后台任务计算
+    # EMBEDDING_MODEL: hashed-tfidf（EMBEDDING_DIM 维）或 sentence-transformers:<模型名>
+    # PostgreSQL 上保存到 pgvector，否则保存到 EMBEDDING_DIR 下的 NumPy 文件
+    EMBEDDINGS_ENABLED = os.environ.get('EMBEDDINGS_ENABLED', 'false').lower() == 'true'
+    EMBEDDING_MODEL = os.environ.get('EMBEDDING_MODEL') or 'hashed-tfidf'
+    EMBEDDING_DIM = int(os.environ.get('EMBEDDING_DIM') or 512)
+    EMBEDDING_DIR = os.environ.get('EMBEDDING_DIR') or os.path.join(basedir, 'instance', 'embeddings')
+    # pgvector 上向量数不超过该值的用户精确排序，超过时使用 HNSW 索引（迭代扫描）
+    EMBEDDING_EXACT_SEARCH_MAX = int(os.environ.get('EMBEDDING_EXACT_SEARCH_MAX') or 10000)
+    SIMILAR_MAX_K = int(os.environ.get('SIMILAR_MAX_K') or 50)
+
+    # 后台任务：thread（每个进程一个后台线程）/ worker（只入队，由 flask run-jobs 进程执行）/ sync（请求结束前执行）
+    # 失败后按 JOB_RETRY_BASE_SECONDS * 2^(n-1) 退避重试（不超过 JOB_RETRY_MAX_SECONDS），最多 JOB_MAX_ATTEMPTS 次；
+    # 执行超过 JOB_LOCK_TIMEOUT 秒未结束的任务视为 worker 已崩溃，重新领取
+    JOBS_MODE = os.environ.get('JOBS_MODE') or 'thread'
+    JOB_POLL_INTERVAL = float(os.environ.get('JOB_POLL_INTERVAL') or 2)
+    JOB_BATCH_SIZE = int(os.environ.get('JOB_BATCH_SIZE') or 20)
+    JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS') or 5)
+    JOB_RETRY_BASE_SECONDS = float(os.environ.get('JOB_RETRY_BASE_SECONDS') or 5)
+    JOB_RETRY_MAX_SECONDS = float(os.environ.get('JOB_RETRY_MAX_SECONDS') or 3600)
+    JOB_LOCK_TIMEOUT = int(os.environ.get('JOB_LOCK_TIMEOUT') or 300)
+    # 是否开放 /api/metrics/jobs 任务队列指标端点
+    JOB_METRICS_ENABLED = os.environ.get('JOB_METRICS_ENABLED', 'false').lower() == 'true'
+
+    # 响应缓存：none / memory（进程内 LRU，仅限单进程，gunicorn 多 worker 时拒绝启动）/ redis
+    RESPONSE_CACHE = os.environ.get('RESPONSE_CACHE') or 'none'
+    RESPONSE_CACHE_TTL = int(os.environ.get('RESPONSE_CACHE_TTL') or 60)
+    RESPONSE_CACHE_MAX_ENTRIES = int(os.environ.get('RESPONSE_CACHE_MAX_ENTRIES') or 1024)
+    RESPONSE_CACHE_REDIS_URL = os.environ.get('RESPONSE_CACHE_REDIS_URL') or 'redis://localhost:6379/0'
+    # 是否开放 /api/metrics/cache 缓存命中统计端点
+    CACHE_METRICS_ENABLED = os.environ.get('CACHE_METRICS_ENABLED', 'false').lower() == 'true'
+
+    # 批量导入：每批插入的行数和单次请求的最大行数
+    BULK_BATCH_SIZE = int(os.environ.get('BULK_BATCH_SIZE') or 500)
+    BULK_IMPORT_MAX_ROWS = int(os.environ.get('BULK_IMPORT_MAX_ROWS') or 50000)
+
+    # 统计计数表：启用后 /api/stats 读取 user_stats，而不是每次聚合
+    STATS_COUNTERS_ENABLED = os.environ.get('STATS_COUNTERS_ENABLED', 'false').lower() == 'true'
+
+    # 密码哈希配置
+    BCRYPT_LOG_ROUNDS = int(os.environ.get('BCRYPT_LOG_ROUNDS') or 12)
+    # 同时计算 bcrypt 的线程数和允许排队的请求数，超出时返回 503
+    HASH_POOL_WORKERS = int(os.environ.get('HASH_POOL_WORKERS') or 2)
+    HASH_POOL_MAX_PENDING = int(os.environ.get('HASH_POOL_MAX_PENDING') or 4)
+    # 每分钟允许的登录/注册次数（0 表示不限制）
+    LOGIN_RATE_PER_IP = int(os.environ.get('LOGIN_RATE_PER_IP') or 20)
+    LOGIN_RATE_PER_USER = int(os.environ.get('LOGIN_RATE_PER_USER') or 10)
+    # 反向代理层数，大于 0 时信任 X-Forwarded-For 获取客户端 IP；只在后端不能被绕过代理直接访问时开启
+    PROXY_FIX_X_FOR = int(os.environ.get('PROXY_FIX_X_FOR') or 0)
+
     # JWT配置
     JWT_SECRET_KEY = os.environ.get('JWT_SECRET_KEY') or SECRET_KEY
     JWT_ACCESS_TOKEN_EXPIRES = timedelta(hours=1)
     JWT_REFRESH_TOKEN_EXPIRES = timedelta(days=30)
+
+    # JWT 用户身份缓存（进程内），用户修改或删除时只在执行修改的进程内失效，其他 worker 最多延迟 TTL 秒
+    IDENTITY_CACHE_TTL = int(os.environ.get('IDENTITY_CACHE_TTL') or 60)
+    IDENTITY_CACHE_SIZE = int(os.environ.get('IDENTITY_CACHE_SIZE') or 4096)
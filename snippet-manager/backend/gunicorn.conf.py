@@ -0,0 +1,79 @@
+"""
+Gunicorn 生产环境配置
+启动: gunicorn -c gunicorn.conf.py run:app
+所有参数都可以通过环境变量覆盖
+"""
+import multiprocessing
+import os
+
+
+def _env_int(name, default):
+    """读取整数环境变量"""
+    value = os.environ.get(name)
+    return int(value) if value else default
+
+
+def _env_bool(name, default):
+    """读取布尔环境变量"""
+    value = os.environ.get(name)
+    return value.lower() in ('1', 'true', 'yes') if value else default
+
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:5000')
+
+# 进程数默认按 CPU 核数计算；每个进程内用线程处理并发的 I/O 等待
+workers = _env_int('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1)
+threads = _env_int('GUNICORN_THREADS', 4)
+
+
+def _check_response_cache():
+    """进程内响应缓存的失效只在本进程生效，多个 worker 时其他 worker 会返回过期数据"""
+    from config import Config
+    if Config.RESPONSE_CACHE == 'memory' and workers > 1:
+        raise RuntimeError('RESPONSE_CACHE=memory 只能用于单个 worker，多 worker 请使用 RESPONSE_CACHE=redis')
+
+
+_check_response_cache()
+
+# gthread（默认）或 gevent（需要额外安装 gevent）
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+worker_connections = _env_int('GUNICORN_WORKER_CONNECTIONS', 1000)
+
+# 预加载应用：master 中完成建表和索引初始化，worker fork 后共享代码页
+preload_app = _env_bool('GUNICORN_PRELOAD', True)
+
+# 处理一定数量请求后回收 worker，防止内存缓慢增长；jitter 避免同时重启
+max_requests = _env_int('GUNICORN_MAX_REQUESTS', 1000)
+max_requests_jitter = _env_int('GUNICORN_MAX_REQUESTS_JITTER', 100)
+
+timeout = _env_int('GUNICORN_TIMEOUT', 30)
+graceful_timeout = _env_int('GUNICORN_GRACEFUL_TIMEOUT', 30)
+keepalive = _env_int('GUNICORN_KEEPALIVE', 5)
+
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG', '-')
+errorlog = os.environ.get('GUNICORN_ERROR_LOG', '-')
+loglevel = os.environ.get('GUNICORN_LOG_LEVEL', 'info')
+
+
+def post_fork(server, worker):
+    """预加载模式下丢弃从 master 继承的数据库连接，每个 worker 建立自己的连接池"""
+    if not preload_app:
+        return
+    from run import app
+    from app import db
+    with app.app_context():
+        db.engine.dispose(close=False)
+        replicas = app.extensions.get('db_replicas')
+        if replicas is not None:
+            replicas.dispose(close=False)
+
+
+def post_worker_init(worker):
+    """JOBS_MODE=thread 时 worker 启动即开始轮询任务队列，回收或崩溃的 worker 留下的任务不必等到新的写请求"""
+    from run import app
+    app.extensions['jobs'].start()
+
+
+def when_ready(server):
+    """所有 worker 启动后记录日志，实际就绪以 /api/health 为准"""
+    server.log.info('Gunicorn 就绪: %s workers x %s threads (%s)', workers, threads, worker_class)
@@ -1,3 +1,7 @@
+"""
+开发服务器入口
+生产环境使用: gunicorn -c gunicorn.conf.py run:app
+"""
 from app import create_app
 
 app = create_app()
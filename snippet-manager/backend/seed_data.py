@@ -1,10 +1,18 @@
 """
 示例数据种子脚本
 运行此脚本可以添加一些示例数据到数据库
+
+生成压测数据（N 个用户 x M 个片段）：
+    python seed_data.py --users 10 --snippets 2000 --content-size 2000 --tags 50
 """
+import argparse
+import random
+import string
 
 from app import create_app, db
-from app.models import Snippet
+from app.models import Snippet, User
+
+BENCH_PASSWORD = 'benchmark-password'
 
 def seed_data():
     app = create_app()
@@ -223,5 +231,80 @@ const { values, handleChange, resetForm } = useForm({ email: '', password: '' })
 
         print(f"\n数据种子完成！共有 {Snippet.query.count()} 个片段")
 
+def _random_text(rng, size):
+    """生成指定长度的伪随机文本，词长接近源代码"""
+    words = []
+    length = 0
+    while length < size:
+        word = ''.join(rng.choices(string.ascii_lowercase, k=rng.randint(2, 10)))
+        words.append(word)
+        length += len(word) + 1
+    return ' '.join(words)[:size]
+
+
+def seed_benchmark(users=10, snippets_per_user=1000, content_size=2000, tag_pool=50,
+                   tags_per_snippet=3, prompt_ratio=0.3, favorite_ratio=0.1, seed=42,
+                   app=None, prefix='bench'):
+    """
+    生成压测数据，返回创建的用户名列表
+    标签按 Zipf 分布抽取，少数标签被大量使用，接近真实账号的分布；
+    片段通过批量插入写入，不在内存中保留全部对象
+    """
+    from app.bulk import insert_batch
+
+    app = app or create_app()
+    rng = random.Random(seed)
+    tag_names = [f'tag{i}' for i in range(tag_pool)]
+    tag_weights = [1 / (i + 1) for i in range(tag_pool)]
+    usernames = []
+
+    with app.app_context():
+        for u in range(users):
+            username = f'{prefix}{u}'
+            user = User.query.filter_by(username=username).first()
+            if user is None:
+                user = User(username=username, email=f'{username}@example.com')
+                user.set_password(BENCH_PASSWORD)
+                db.session.add(user)
+                db.session.commit()
+            usernames.append(username)
+
+            batch = []
+            for i in range(snippets_per_user):
+                is_prompt = rng.random() < prompt_ratio
+                tags = list(dict.fromkeys(rng.choices(tag_names, tag_weights, k=tags_per_snippet)))
+                size = max(1, int(rng.gauss(content_size, content_size / 4)))
+                batch.append(({
+                    'title': f'{_random_text(rng, 30)} {i}',
+                    'content': _random_text(rng, size),
+                    'description': _random_text(rng, 80),
+                    'snippet_type': 'prompt' if is_prompt else 'code',
+                    'language': '' if is_prompt else rng.choice(['python', 'javascript', 'sql', 'go']),
+                    'tags': ','.join(tags),
+                    'is_favorite': rng.random() < favorite_ratio,
+                }, tags))
+                if len(batch) >= 500:
+                    insert_batch(user.id, batch)
+                    batch = []
+            insert_batch(user.id, batch)
+            db.session.commit()
+            print(f"✓ {username}: {snippets_per_user} 个片段")
+
+    return usernames
+
+
 if __name__ == '__main__':
-    seed_data()
+    parser = argparse.ArgumentParser(description='添加示例数据或生成压测数据')
+    parser.add_argument('--users', type=int, help='压测用户数（指定后生成压测数据）')
+    parser.add_argument('--snippets', type=int, default=1000, help='每个用户的片段数')
+    parser.add_argument('--content-size', type=int, default=2000, help='片段内容平均字符数')
+    parser.add_argument('--tags', type=int, default=50, help='标签池大小')
+    parser.add_argument('--tags-per-snippet', type=int, default=3, help='每个片段的标签数')
+    parser.add_argument('--seed', type=int, default=42, help='随机种子')
+    args = parser.parse_args()
+
+    if args.users:
+        seed_benchmark(args.users, args.snippets, args.content_size, args.tags,
+                       args.tags_per_snippet, seed=args.seed)
+    else:
+        seed_data()
@@ -9,21 +9,40 @@ from app.models import Snippet
 
 
 @pytest.fixture
-def app():
-    """创建测试应用"""
+def make_app():
+    """
+    按覆盖的配置项创建测试应用：make_app(PROFILING_ENABLED=True, ...)
+    返回的应用已进入应用上下文，测试结束后删除表、释放副本连接
+    """
     from config import Config
+    created = []
 
-    class TestConfig(Config):
-        TESTING = True
-        SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
-
-    app = create_app(TestConfig)
+    def factory(**overrides):
+        settings = {'TESTING': True, 'SQLALCHEMY_DATABASE_URI': 'sqlite:///:memory:',
+                    'BCRYPT_LOG_ROUNDS': 4, 'JOBS_MODE': 'sync'}
+        settings.update(overrides)
+        app = create_app(type('TestConfig', (Config,), settings))
+        context = app.app_context()
+        context.push()
+        created.append((app, context))
+        return app
 
-    with app.app_context():
-        db.create_all()
-        yield app
+    yield factory
+    for app, context in reversed(created):
         db.session.remove()
         db.drop_all()
+        replicas = app.extensions.get('db_replicas')
+        if replicas is not None:
+            replicas.dispose()
+        context.pop()
+
+
+@pytest.fixture
+def app(make_app):
+    """创建测试应用"""
+    app = make_app()
+    db.create_all()
+    return app
 
 
 @pytest.fixture
@@ -32,6 +51,26 @@ def client(app):
     return app.test_client()
 
 
+@pytest.fixture
+def auth_headers(client):
+    """注册测试用户并返回认证请求头"""
+    response = client.post('/api/auth/register', json={
+        'username': 'tester',
+        'email': 'tester@example.com',
+        'password': 'password123'
+    })
+    return {'Authorization': f"Bearer {response.json['access_token']}"}
+
+
+def create_snippet(client, headers, **fields):
+    """通过API创建片段并返回响应数据"""
+    data = {'title': '片段', 'content': 'content', 'snippet_type': 'code'}
+    data.update(fields)
+    response = client.post('/api/snippets', json=data, headers=headers)
+    assert response.status_code == 201
+    return response.json
+
+
 @pytest.fixture
 def sample_snippet(app):
     """创建示例片段"""
@@ -224,6 +263,199 @@ class TestFilterAndSearch:
         assert all(s['snippet_type'] == 'code' for s in response.json)
 
 
+class TestFullTextSearch:
+    """测试全文搜索"""
+
+    def test_search_ranked_by_relevance(self, client, auth_headers):
+        """测试标题命中排在内容命中之前"""
+        create_snippet(client, auth_headers, title='其他片段', content='uses a database connection')
+        create_snippet(client, auth_headers, title='Database helper', content='pass')
+
+        response = client.get('/api/snippets?search=database', headers=auth_headers)
+        assert response.status_code == 200
+        assert [s['title'] for s in response.json] == ['Database helper', '其他片段']
+
+    def test_search_short_chinese_term(self, client, auth_headers):
+        """测试短于trigram长度的中文词"""
+        create_snippet(client, auth_headers, title='排序算法', content='def sort(): pass')
+        create_snippet(client, auth_headers, title='提示词', content='请帮我写代码')
+
+        response = client.get('/api/snippets?search=排序', headers=auth_headers)
+        assert [s['title'] for s in response.json] == ['排序算法']
+
+    def test_search_index_follows_updates(self, client, auth_headers):
+        """测试更新和删除后索引保持同步"""
+        snippet = create_snippet(client, auth_headers, title='old title', content='alpha beta')
+        client.put(f"/api/snippets/{snippet['id']}", json={'content': 'gamma delta'}, headers=auth_headers)
+
+        assert client.get('/api/snippets?search=alpha', headers=auth_headers).json == []
+        assert len(client.get('/api/snippets?search=gamma', headers=auth_headers).json) == 1
+
+        client.delete(f"/api/snippets/{snippet['id']}", headers=auth_headers)
+        assert client.get('/api/snippets?search=gamma', headers=auth_headers).json == []
+
+    def test_search_is_scoped_to_user(self, client, auth_headers):
+        """测试搜索结果不包含其他用户的片段"""
+        create_snippet(client, auth_headers, title='shared keyword')
+        other = client.post('/api/auth/register', json={
+            'username': 'other', 'email': 'other@example.com', 'password': 'password123'
+        }).json
+        response = client.get('/api/snippets?search=keyword', headers={
+            'Authorization': f"Bearer {other['access_token']}"
+        })
+        assert response.json == []
+
+
+class TestPagination:
+    """测试游标分页和字段投影"""
+
+    def test_keyset_pagination(self, client, auth_headers):
+        """测试按游标逐页获取全部片段"""
+        created = [create_snippet(client, auth_headers, title=f'片段{i}')['id'] for i in range(5)]
+
+        seen, cursor = [], None
+        while True:
+            url = '/api/snippets?limit=2' + (f'&cursor={cursor}' if cursor else '')
+            page = client.get(url, headers=auth_headers).json
+            assert len(page['items']) <= 2
+            seen.extend(s['id'] for s in page['items'])
+            cursor = page['next_cursor']
+            if not cursor:
+                break
+
+        assert seen == sorted(created, reverse=True)
+
+    def test_fields_projection(self, client, auth_headers):
+        """测试只返回指定字段"""
+        create_snippet(client, auth_headers, title='投影', content='x' * 1000)
+        response = client.get('/api/snippets?fields=id,title&limit=10', headers=auth_headers)
+        assert response.status_code == 200
+        assert response.json['items'] == [{'id': response.json['items'][0]['id'], 'title': '投影'}]
+
+    def test_invalid_parameters(self, client, auth_headers):
+        """测试无效的字段和游标"""
+        assert client.get('/api/snippets?fields=secret', headers=auth_headers).status_code == 400
+        assert client.get('/api/snippets?cursor=not-a-cursor', headers=auth_headers).status_code == 400
+
+    def test_cursor_mode_mismatch_rejected(self, client, auth_headers):
+        """测试 keyset 游标用于搜索（偏移量分页）或反之时返回400，而不是回到第一页"""
+        from app.pagination import encode_cursor
+        for i in range(3):
+            create_snippet(client, auth_headers, title=f'hello {i}')
+        keyset = client.get('/api/snippets?limit=1', headers=auth_headers).json['next_cursor']
+        offset = client.get('/api/snippets?limit=1&search=hello', headers=auth_headers).json['next_cursor']
+        assert client.get(f'/api/snippets?limit=1&search=hello&cursor={offset}', headers=auth_headers).status_code == 200
+
+        assert client.get(f'/api/snippets?limit=1&search=hello&cursor={keyset}', headers=auth_headers).status_code == 400
+        assert client.get(f'/api/snippets?limit=1&cursor={offset}', headers=auth_headers).status_code == 400
+        legacy = encode_cursor({'o': 1})
+        assert client.get(f'/api/snippets?search=hello&cursor={legacy}', headers=auth_headers).status_code == 400
+
+
+class TestNormalizedTags:
+    """测试标签关联表"""
+
+    def test_tag_filter_exact_match(self, client, auth_headers):
+        """测试标签精确匹配，py 不会匹配 python"""
+        create_snippet(client, auth_headers, title='A', tags=['python'])
+        create_snippet(client, auth_headers, title='B', tags=['py'])
+
+        response = client.get('/api/snippets?tag=py', headers=auth_headers)
+        assert [s['title'] for s in response.json] == ['B']
+
+    def test_multi_tag_modes(self, client, auth_headers):
+        """测试多标签 AND / OR 过滤"""
+        create_snippet(client, auth_headers, title='both', tags=['a', 'b'])
+        create_snippet(client, auth_headers, title='only a', tags=['a'])
+
+        any_response = client.get('/api/snippets?tag=a,b', headers=auth_headers)
+        assert {s['title'] for s in any_response.json} == {'both', 'only a'}
+
+        all_response = client.get('/api/snippets?tag=a&tag=b&tag_mode=all', headers=auth_headers)
+        assert [s['title'] for s in all_response.json] == ['both']
+
+    def test_update_replaces_tags(self, client, auth_headers):
+        """测试更新标签后列表和过滤同步"""
+        snippet = create_snippet(client, auth_headers, tags=['old'])
+        response = client.put(f"/api/snippets/{snippet['id']}", json={'tags': ['new']}, headers=auth_headers)
+        assert response.json['tags'] == ['new']
+
+        assert client.get('/api/tags', headers=auth_headers).json == ['new']
+        assert client.get('/api/snippets?tag=old', headers=auth_headers).json == []
+
+    def test_backfill_from_legacy_column(self, app, client, auth_headers):
+        """测试从旧 tags 列回填关联表"""
+        from app.models import User
+        from app.tags import backfill_tags
+
+        user = User.query.filter_by(username='tester').first()
+        db.session.add(Snippet(user_id=user.id, title='legacy', content='x',
+                               snippet_type='code', tags='go, rust'))
+        db.session.commit()
+
+        assert backfill_tags() == 1
+        assert backfill_tags() == 0
+        assert client.get('/api/tags', headers=auth_headers).json == ['go', 'rust']
+
+    def test_backfill_runs_at_startup(self, make_app, tmp_path):
+        """测试升级后启动时自动回填，过长的旧标签名截断"""
+        from app.models import User
+        from app.tags import tag_counts
+        url = 'sqlite:///' + str(tmp_path / 'tags.db')
+
+        make_app(SQLALCHEMY_DATABASE_URI=url)
+        user = User(username='legacy', email='legacy@example.com')
+        user.password_hash = 'x'
+        db.session.add(user)
+        db.session.flush()
+        db.session.add(Snippet(user_id=user.id, title='legacy', content='x', snippet_type='code',
+                               tags='go,' + 'x' * 150))
+        db.session.commit()
+        db.session.remove()
+
+        make_app(SQLALCHEMY_DATABASE_URI=url)
+        assert tag_counts(1) == [('go', 1), ('x' * 100, 1)]
+
+    def test_tag_length_rejected(self, client, auth_headers):
+        """测试超过 100 个字符的标签返回400，批量导入报告该行"""
+        long_tag = 't' * 101
+        response = client.post('/api/snippets', json={'title': 'a', 'content': 'b', 'tags': [long_tag]},
+                               headers=auth_headers)
+        assert response.status_code == 400
+
+        snippet = create_snippet(client, auth_headers, tags=['ok'])
+        response = client.put(f"/api/snippets/{snippet['id']}", json={'title': 'changed', 'tags': [long_tag]},
+                              headers=auth_headers)
+        assert response.status_code == 400
+        assert client.get(f"/api/snippets/{snippet['id']}", headers=auth_headers).json['title'] == '片段'
+
+        response = client.post('/api/snippets/bulk', json=[
+            {'title': 'A', 'content': 'a', 'tags': ['fine']},
+            {'title': 'B', 'content': 'b', 'tags': [long_tag]},
+        ], headers=auth_headers)
+        assert response.json['inserted'] == 1
+        assert [e['line'] for e in response.json['errors']] == [2]
+        assert client.get(f'/api/snippets?tag={long_tag}', headers=auth_headers).status_code == 400
+
+    def test_tag_type_and_mode_validated(self, client, auth_headers):
+        """测试 tags 不是字符串或数组、tag_mode 无效时返回400，批量导入报告该行"""
+        response = client.post('/api/snippets', json={'title': 'a', 'content': 'b', 'tags': 5}, headers=auth_headers)
+        assert response.status_code == 400
+        snippet = create_snippet(client, auth_headers)
+        response = client.put(f"/api/snippets/{snippet['id']}", json={'tags': {'a': 1}}, headers=auth_headers)
+        assert response.status_code == 400
+
+        response = client.post('/api/snippets/bulk', json=[
+            {'title': 'A', 'content': 'a', 'tags': 'x,y'},
+            {'title': 'B', 'content': 'b', 'tags': 5},
+        ], headers=auth_headers)
+        assert response.json['inserted'] == 1
+        assert [e['line'] for e in response.json['errors']] == [2]
+
+        assert client.get('/api/snippets?tag=x&tag_mode=every', headers=auth_headers).status_code == 400
+        assert client.get('/api/snippets?tag=x&tag_mode=all', headers=auth_headers).status_code == 200
+
+
 class TestTagsAPI:
     """测试标签接口"""
 
@@ -283,6 +515,1135 @@ class TestStatsAPI:
         assert response.json['prompt'] == 1
 
 
+class TestTagAggregation:
+    """测试标签聚合和自动补全"""
+
+    def test_tag_counts(self, client, auth_headers):
+        """测试返回每个标签的使用次数"""
+        create_snippet(client, auth_headers, tags=['python', 'web'])
+        create_snippet(client, auth_headers, tags=['python'])
+
+        response = client.get('/api/tags?counts=true', headers=auth_headers)
+        assert response.json == [{'name': 'python', 'count': 2}, {'name': 'web', 'count': 1}]
+
+    def test_tag_prefix(self, client, auth_headers):
+        """测试按前缀过滤标签，通配符按字面匹配"""
+        create_snippet(client, auth_headers, tags=['python', 'pytest', 'go', 'py_lib'])
+
+        assert client.get('/api/tags?prefix=py', headers=auth_headers).json == ['py_lib', 'pytest', 'python']
+        assert client.get('/api/tags?prefix=py_', headers=auth_headers).json == ['py_lib']
+
+    def test_tag_limit(self, client, auth_headers):
+        """测试 limit 优先返回常用标签，不是正整数时返回400"""
+        create_snippet(client, auth_headers, tags=['python', 'web'])
+        create_snippet(client, auth_headers, tags=['python'])
+
+        assert client.get('/api/tags?limit=1', headers=auth_headers).json == ['python']
+        for value in ('-1', '0', 'abc'):
+            assert client.get(f'/api/tags?limit={value}', headers=auth_headers).status_code == 400
+
+
+class TestStatsCounters:
+    """测试统计聚合和计数表"""
+
+    def test_aggregate_stats(self, client, auth_headers):
+        """测试单次聚合查询结果"""
+        create_snippet(client, auth_headers, snippet_type='code', is_favorite=True)
+        create_snippet(client, auth_headers, snippet_type='prompt')
+
+        response = client.get('/api/stats', headers=auth_headers)
+        assert response.json == {'total': 2, 'code': 1, 'prompt': 1, 'favorite': 1}
+
+    def test_counters_follow_writes(self, app, client, auth_headers):
+        """测试计数表随增删改和收藏切换更新"""
+        app.config['STATS_COUNTERS_ENABLED'] = True
+        snippet = create_snippet(client, auth_headers, snippet_type='code')
+        assert client.get('/api/stats', headers=auth_headers).json['total'] == 1
+
+        create_snippet(client, auth_headers, snippet_type='prompt')
+        client.patch(f"/api/snippets/{snippet['id']}/favorite", headers=auth_headers)
+        client.put(f"/api/snippets/{snippet['id']}", json={'snippet_type': 'prompt'}, headers=auth_headers)
+        assert client.get('/api/stats', headers=auth_headers).json == {
+            'total': 2, 'code': 0, 'prompt': 2, 'favorite': 1
+        }
+
+        client.delete(f"/api/snippets/{snippet['id']}", headers=auth_headers)
+        assert client.get('/api/stats', headers=auth_headers).json == {
+            'total': 1, 'code': 0, 'prompt': 1, 'favorite': 0
+        }
+
+    def test_repair_counters(self, app, client, auth_headers):
+        """测试从源数据修复计数表"""
+        from app.models import UserStats
+        from app.stats import repair_counters
+
+        app.config['STATS_COUNTERS_ENABLED'] = True
+        create_snippet(client, auth_headers)
+        client.get('/api/stats', headers=auth_headers)
+        UserStats.query.update({'total': 42})
+        db.session.commit()
+
+        assert repair_counters() == 1
+        assert client.get('/api/stats', headers=auth_headers).json['total'] == 1
+
+
+class TestConditionalRequests:
+    """测试 ETag 和条件请求"""
+
+    def test_snippet_not_modified(self, client, auth_headers):
+        """测试单个片段未修改时返回304"""
+        snippet = create_snippet(client, auth_headers)
+        response = client.get(f"/api/snippets/{snippet['id']}", headers=auth_headers)
+        etag = response.headers['ETag']
+
+        cached = client.get(f"/api/snippets/{snippet['id']}",
+                            headers={**auth_headers, 'If-None-Match': etag})
+        assert cached.status_code == 304
+        assert cached.data == b''
+
+    def test_collection_etag_changes_on_write(self, client, auth_headers):
+        """测试集合 ETag 随写操作变化"""
+        create_snippet(client, auth_headers)
+        for url in ('/api/snippets', '/api/tags', '/api/stats'):
+            etag = client.get(url, headers=auth_headers).headers['ETag']
+            assert client.get(url, headers={**auth_headers, 'If-None-Match': etag}).status_code == 304
+
+        etag = client.get('/api/stats', headers=auth_headers).headers['ETag']
+        create_snippet(client, auth_headers)
+        response = client.get('/api/stats', headers={**auth_headers, 'If-None-Match': etag})
+        assert response.status_code == 200
+        assert response.json['total'] == 2
+
+    def test_collection_etag_changes_on_old_timestamp_import(self, client, auth_headers):
+        """测试导入旧时间的片段并删除一个（最大 updated_at 和片段数都不变）后 ETag 仍然变化"""
+        old = create_snippet(client, auth_headers, title='旧')
+        create_snippet(client, auth_headers, title='新')
+        etag = client.get('/api/snippets', headers=auth_headers).headers['ETag']
+
+        client.post('/api/snippets/bulk', json=[{
+            'title': '导入', 'content': 'x', 'created_at': '2001-01-01T00:00:00', 'updated_at': '2001-01-01T00:00:00'
+        }], headers=auth_headers)
+        client.delete(f"/api/snippets/{old['id']}", headers=auth_headers)
+        response = client.get('/api/snippets', headers={**auth_headers, 'If-None-Match': etag})
+        assert response.status_code == 200
+        assert sorted(s['title'] for s in response.json) == ['导入', '新']
+
+    def test_if_match_optimistic_concurrency(self, client, auth_headers):
+        """测试 If-Match 不匹配时拒绝修改"""
+        snippet = create_snippet(client, auth_headers)
+        url = f"/api/snippets/{snippet['id']}"
+        etag = client.get(url, headers=auth_headers).headers['ETag']
+
+        first = client.put(url, json={'title': '第一次'}, headers={**auth_headers, 'If-Match': etag})
+        assert first.status_code == 200
+
+        stale = client.put(url, json={'title': '第二次'}, headers={**auth_headers, 'If-Match': etag})
+        assert stale.status_code == 412
+        assert client.delete(url, headers={**auth_headers, 'If-Match': etag}).status_code == 412
+
+        fresh = first.headers['ETag']
+        assert client.delete(url, headers={**auth_headers, 'If-Match': fresh}).status_code == 204
+
+
+class TestResponseCache:
+    """测试响应缓存"""
+
+    @pytest.fixture
+    def cache(self, app):
+        """启用进程内缓存"""
+        from app.cache import LRUCache, ResponseCache
+        cache = ResponseCache(LRUCache(max_entries=16, ttl=60))
+        app.extensions['response_cache'] = cache
+        return cache
+
+    def test_hits_and_invalidation(self, client, auth_headers, cache):
+        """测试重复请求命中缓存，写操作后失效"""
+        snippet = create_snippet(client, auth_headers, title='v1')
+        assert client.get('/api/snippets', headers=auth_headers).json[0]['title'] == 'v1'
+        assert client.get('/api/snippets', headers=auth_headers).json[0]['title'] == 'v1'
+        assert (cache.hits, cache.misses) == (1, 1)
+
+        client.put(f"/api/snippets/{snippet['id']}", json={'title': 'v2'}, headers=auth_headers)
+        assert client.get('/api/snippets', headers=auth_headers).json[0]['title'] == 'v2'
+        assert cache.misses == 2
+
+    def test_query_args_are_normalized(self, client, auth_headers, cache):
+        """测试参数顺序不同的请求共用缓存"""
+        client.get('/api/snippets?type=code&favorite=true', headers=auth_headers)
+        client.get('/api/snippets?favorite=true&type=code', headers=auth_headers)
+        assert cache.hits == 1
+
+    def test_lru_eviction_and_ttl(self):
+        """测试条目数上限和过期"""
+        from app.cache import LRUCache
+        lru = LRUCache(max_entries=2, ttl=60)
+        lru.set('a', 1)
+        lru.set('b', 2)
+        lru.get('a')
+        lru.set('c', 3)
+        assert lru.get('b') is None
+        assert lru.get('a') == 1
+
+        lru.ttl = -1
+        lru.set('d', 4)
+        assert lru.get('d') is None
+
+    def test_counters_bounded_without_reuse(self):
+        """测试计数器按上限淘汰，淘汰后重新分配的值不会与旧值相同"""
+        from app.cache import LRUCache
+        lru = LRUCache(max_entries=2, ttl=60)
+        first = lru.counter('gen:1')
+        lru.incr('gen:2')
+        lru.incr('gen:3')
+        assert len(lru._counters) == 2
+        assert lru.counter('gen:1') not in (first, lru.counter('gen:2'), lru.counter('gen:3'))
+
+    def test_headers_cached_and_metrics_gated(self, app, client, auth_headers, cache):
+        """测试命中时保留 X-Search-Truncated 等响应头，指标端点需要开启"""
+        create_snippet(client, auth_headers, title='hello world')
+        app.config['FUZZY_SEARCH_BUDGET_MS'] = -1000
+        url = '/api/snippets?match=fuzzy&search=hello'
+        assert client.get(url, headers=auth_headers).headers['X-Search-Truncated'] == 'true'
+        response = client.get(url, headers=auth_headers)
+        assert cache.hits == 1
+        assert response.headers['X-Search-Truncated'] == 'true'
+        assert response.mimetype == 'application/json'
+
+        assert client.get('/api/metrics/cache').status_code == 404
+        app.config['CACHE_METRICS_ENABLED'] = True
+        assert client.get('/api/metrics/cache').json['hits'] == 1
+
+
+class TestBulkImportExport:
+    """测试批量导入和流式导出"""
+
+    def test_import_json_array_with_errors(self, client, auth_headers):
+        """测试 JSON 数组导入，无效记录单独报告"""
+        rows = [
+            {'title': 'A', 'content': 'a', 'tags': ['x', 'y']},
+            {'title': '', 'content': 'missing title'},
+            {'title': 'B', 'content': 'b', 'tags': 'y'},
+        ]
+        response = client.post('/api/snippets/bulk', json=rows, headers=auth_headers)
+        assert response.status_code == 200
+        assert response.json['inserted'] == 2
+        assert [e['line'] for e in response.json['errors']] == [2]
+
+        assert client.get('/api/tags?counts=true', headers=auth_headers).json == [
+            {'name': 'x', 'count': 1}, {'name': 'y', 'count': 2}
+        ]
+        assert client.get('/api/stats', headers=auth_headers).json['total'] == 2
+
+    def test_ndjson_round_trip(self, client, auth_headers):
+        """测试导出的 NDJSON 可以重新导入"""
+        create_snippet(client, auth_headers, title='导出', content='print(1)', tags=['py'])
+        exported = client.get('/api/snippets/export', headers=auth_headers)
+        assert exported.mimetype == 'application/x-ndjson'
+        lines = exported.data.decode('utf-8').splitlines()
+        assert len(lines) == 1
+        assert json.loads(lines[0])['title'] == '导出'
+
+        body = exported.data + b'not json\n'
+        response = client.post('/api/snippets/bulk', data=body, headers={
+            **auth_headers, 'Content-Type': 'application/x-ndjson'
+        })
+        assert response.json['inserted'] == 1
+        assert response.json['errors'] == [{'line': 2, 'error': '不是有效的 JSON'}]
+        assert len(client.get('/api/snippets?tag=py', headers=auth_headers).json) == 2
+
+    def test_import_rejects_non_array(self, client, auth_headers):
+        """测试请求体不是数组时返回400"""
+        response = client.post('/api/snippets/bulk', json={'title': 'x'}, headers=auth_headers)
+        assert response.status_code == 400
+
+
+class TestBatchOperations:
+    """测试批量修改接口"""
+
+    def test_batch_favorite_update_delete(self, client, auth_headers):
+        """测试多个操作在一个请求中执行"""
+        ids = [create_snippet(client, auth_headers, title=f'批量{i}', tags=['t'])['id'] for i in range(3)]
+        response = client.post('/api/snippets/batch', json={'operations': [
+            {'op': 'favorite', 'ids': ids[:2]},
+            {'op': 'update', 'ids': [ids[2]], 'fields': {'snippet_type': 'prompt'}},
+            {'op': 'delete', 'ids': [ids[0], 9999]},
+        ]}, headers=auth_headers)
+        assert response.status_code == 200
+        statuses = [(r['op'], r['id'], r['status']) for r in response.json['results']]
+        assert ('delete', 9999, 'not_found') in statuses
+        assert ('delete', ids[0], 'ok') in statuses
+
+        assert client.get('/api/stats', headers=auth_headers).json == {
+            'total': 2, 'code': 1, 'prompt': 1, 'favorite': 1
+        }
+        assert client.get('/api/tags?counts=true', headers=auth_headers).json == [{'name': 't', 'count': 2}]
+
+    def test_batch_is_scoped_to_user(self, client, auth_headers):
+        """测试不能修改其他用户的片段"""
+        snippet = create_snippet(client, auth_headers)
+        other = client.post('/api/auth/register', json={
+            'username': 'other', 'email': 'other@example.com', 'password': 'password123'
+        }).json
+        response = client.post('/api/snippets/batch', json={'operations': [
+            {'op': 'delete', 'ids': [snippet['id']]}
+        ]}, headers={'Authorization': f"Bearer {other['access_token']}"})
+        assert response.json['results'][0]['status'] == 'not_found'
+        assert client.get(f"/api/snippets/{snippet['id']}", headers=auth_headers).status_code == 200
+
+    def test_batch_validation(self, client, auth_headers):
+        """测试无效操作整体拒绝"""
+        for body in ({}, {'operations': [{'op': 'drop', 'ids': [1]}]},
+                     {'operations': [{'op': 'update', 'ids': [1], 'fields': {'user_id': 2}}]}):
+            assert client.post('/api/snippets/batch', json=body, headers=auth_headers).status_code == 400
+
+    def test_batch_field_types_validated(self, client, auth_headers):
+        """测试字段类型错误或不可为空的字段为 null 时返回400并指出操作，片段不变"""
+        snippet = create_snippet(client, auth_headers)
+        for fields, message in (({'title': ['a']}, 'title 必须是字符串'),
+                                ({'snippet_type': None}, 'snippet_type 不能为 null'),
+                                ({'is_favorite': 'yes'}, 'is_favorite 必须是布尔值')):
+            response = client.post('/api/snippets/batch', json={'operations': [
+                {'op': 'favorite', 'ids': [snippet['id']]},
+                {'op': 'update', 'ids': [snippet['id']], 'fields': fields},
+            ]}, headers=auth_headers)
+            assert response.status_code == 400
+            assert response.json['error'] == f'第 2 个操作的 {message}'
+        assert client.get(f"/api/snippets/{snippet['id']}", headers=auth_headers).json['is_favorite'] is False
+
+        response = client.post('/api/snippets/batch', json={'operations': [
+            {'op': 'update', 'ids': [snippet['id']], 'fields': {'description': None, 'language': None}}
+        ]}, headers=auth_headers)
+        assert response.status_code == 200
+
+
+class TestAuthHotPath:
+    """测试登录限流、哈希线程池和透明重新哈希"""
+
+    def test_login_rate_limited_per_username(self, app, client, auth_headers):
+        """测试同一用户名连续登录失败后返回429"""
+        from app.security import TokenBucketLimiter
+        app.extensions['login_limiters']['user'] = TokenBucketLimiter(per_minute=2)
+
+        credentials = {'username': 'tester', 'password': 'wrong-password'}
+        assert client.post('/api/auth/login', json=credentials).status_code == 401
+        assert client.post('/api/auth/login', json=credentials).status_code == 401
+        response = client.post('/api/auth/login', json=credentials)
+        assert response.status_code == 429
+        assert int(response.headers['Retry-After']) >= 1
+
+    def test_saturated_hash_pool_returns_503(self, app, client, auth_headers):
+        """测试哈希线程池没有空闲名额时快速返回503"""
+        from app.security import HashPool
+        pool = HashPool(workers=1, max_pending=0)
+        app.extensions['hash_pool'] = pool
+        pool._slots.acquire()
+
+        response = client.post('/api/auth/login', json={'username': 'tester', 'password': 'password123'})
+        assert response.status_code == 503
+
+        pool._slots.release()
+        response = client.post('/api/auth/login', json={'username': 'tester', 'password': 'password123'})
+        assert response.status_code == 200
+
+    def test_rehash_when_cost_changes(self, app, client, auth_headers):
+        """测试 cost 配置变化后登录时重新计算哈希"""
+        from app import bcrypt
+        from app.models import User
+
+        app.config['BCRYPT_LOG_ROUNDS'] = 5
+        bcrypt._log_rounds = 5
+        response = client.post('/api/auth/login', json={'username': 'tester', 'password': 'password123'})
+        assert response.status_code == 200
+
+        user = User.query.filter_by(username='tester').first()
+        assert user.password_hash.split('$')[2] == '05'
+        assert user.check_password('password123')
+
+
+class TestIdentityCache:
+    """测试 JWT 用户身份缓存"""
+
+    def test_me_answered_from_token_claims(self, app, client, auth_headers):
+        """测试 /me 不查询数据库"""
+        queries = []
+        from sqlalchemy import event
+        listener = lambda *args: queries.append(args[2])
+        event.listen(db.engine, 'before_cursor_execute', listener)
+        try:
+            client.get('/api/auth/me', headers=auth_headers)
+            response = client.get('/api/auth/me', headers=auth_headers)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', listener)
+
+        assert response.status_code == 200
+        assert response.json['username'] == 'tester'
+        assert queries == []
+
+    def test_user_loaded_lazily(self, app, client, auth_headers):
+        """测试普通接口不查询用户表"""
+        queries = []
+        from sqlalchemy import event
+        listener = lambda *args: queries.append(args[2])
+        event.listen(db.engine, 'before_cursor_execute', listener)
+        try:
+            assert client.get('/api/snippets', headers=auth_headers).status_code == 200
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', listener)
+        assert not [q for q in queries if 'FROM users' in q]
+
+    def test_deleted_user_rejected(self, app, client):
+        """测试删除用户后缓存失效，refresh token 被拒绝"""
+        from app.models import User
+        tokens = client.post('/api/auth/register', json={
+            'username': 'leaver', 'email': 'leaver@example.com', 'password': 'password123'
+        }).json
+        refresh_headers = {'Authorization': f"Bearer {tokens['refresh_token']}"}
+        assert client.post('/api/auth/refresh', headers=refresh_headers).status_code == 200
+
+        db.session.delete(User.query.filter_by(username='leaver').first())
+        db.session.commit()
+        assert client.post('/api/auth/refresh', headers=refresh_headers).status_code == 401
+
+    def test_refresh_keeps_claims(self, client):
+        """测试刷新后的 access token 仍包含用户信息"""
+        tokens = client.post('/api/auth/register', json={
+            'username': 'refresher', 'email': 'r@example.com', 'password': 'password123'
+        }).json
+        refreshed = client.post('/api/auth/refresh', headers={
+            'Authorization': f"Bearer {tokens['refresh_token']}"
+        }).json['access_token']
+        response = client.get('/api/auth/me', headers={'Authorization': f'Bearer {refreshed}'})
+        assert response.json['email'] == 'r@example.com'
+
+
+class TestCompression:
+    """测试响应压缩"""
+
+    def test_gzip_listing_and_conditional_requests(self, client, auth_headers):
+        """测试大响应按 gzip 压缩，弱 ETag 仍可用于 304 和 If-Match"""
+        import gzip
+        snippet = create_snippet(client, auth_headers, content='print("hello")\n' * 200)
+        headers = dict(auth_headers, **{'Accept-Encoding': 'gzip'})
+
+        response = client.get('/api/snippets', headers=headers)
+        assert response.headers['Content-Encoding'] == 'gzip'
+        assert 'Accept-Encoding' in response.headers['Vary']
+        assert json.loads(gzip.decompress(response.data))[0]['id'] == snippet['id']
+        etag = response.headers['ETag']
+        assert etag.startswith('W/')
+        assert client.get('/api/snippets', headers=dict(headers, **{'If-None-Match': etag})).status_code == 304
+
+        single = client.get(f"/api/snippets/{snippet['id']}", headers=headers)
+        updated = client.put(f"/api/snippets/{snippet['id']}", json={'title': 'new'},
+                             headers=dict(auth_headers, **{'If-Match': single.headers['ETag']}))
+        assert updated.status_code == 200
+
+    def test_small_and_unaccepted_responses_not_compressed(self, client, auth_headers):
+        """测试小响应和不接受压缩的请求不压缩"""
+        assert 'Content-Encoding' not in client.get('/api/health', headers={'Accept-Encoding': 'gzip'}).headers
+        create_snippet(client, auth_headers, content='x' * 5000)
+        assert 'Content-Encoding' not in client.get('/api/snippets', headers=auth_headers).headers
+
+    def test_streaming_export_compressed(self, client, auth_headers):
+        """测试流式导出逐块压缩"""
+        import zlib
+        for i in range(3):
+            create_snippet(client, auth_headers, title=f'片段{i}')
+        response = client.get('/api/snippets/export',
+                              headers=dict(auth_headers, **{'Accept-Encoding': 'gzip;q=1.0, br;q=0.5'}))
+        assert response.headers['Content-Encoding'] == 'gzip'
+        lines = zlib.decompress(response.data, 31).decode('utf-8').splitlines()
+        assert [json.loads(line)['title'] for line in lines] == ['片段0', '片段1', '片段2']
+
+    def test_brotli_preferred(self, client, auth_headers):
+        """测试客户端同时接受时优先使用 br"""
+        from app.compression import brotli
+        if brotli is None:
+            pytest.skip('未安装 brotli')
+        create_snippet(client, auth_headers, content='y' * 5000)
+        response = client.get('/api/snippets', headers=dict(auth_headers, **{'Accept-Encoding': 'gzip, br'}))
+        assert response.headers['Content-Encoding'] == 'br'
+        assert json.loads(brotli.decompress(response.data))[0]['content'] == 'y' * 5000
+
+
+class TestJsonSerialization:
+    """测试 JSON provider 和行序列化"""
+
+    def test_list_matches_to_dict(self, app, client, auth_headers):
+        """测试列表接口的行序列化结果与 to_dict() 一致"""
+        create_snippet(client, auth_headers, tags=['a', 'b'], language='python')
+        listed = client.get('/api/snippets', headers=auth_headers).json
+        assert listed == [Snippet.query.one().to_dict()]
+
+        page = client.get('/api/snippets?fields=title,tags,created_at&limit=5', headers=auth_headers).json
+        assert page['items'] == [Snippet.query.one().to_dict(['title', 'tags', 'created_at'])]
+
+    def test_provider_selection(self, app):
+        """测试按配置选择 JSON provider"""
+        from app.serialization import OrjsonProvider, init_json, orjson
+
+        if orjson is not None:
+            assert isinstance(app.json, OrjsonProvider)
+            assert app.json.loads(app.json.dumps({'a': [1, '中文']})) == {'a': [1, '中文']}
+
+        app.config['JSON_PROVIDER'] = 'unknown'
+        with pytest.raises(ValueError):
+            init_json(app)
+
+
+class TestProfiling:
+    """测试请求剖析和 SQL 统计"""
+
+    @pytest.fixture
+    def profiled_app(self, make_app, tmp_path):
+        """开启剖析的应用"""
+        from app.profiling import registry
+        registry.reset()
+        return make_app(PROFILING_ENABLED=True, PROFILING_SLOW_MS=1, PROFILING_SAMPLE_RATE=1.0,
+                        PROFILING_DIR=str(tmp_path), PROFILING_METRICS_TOKEN='scrape-token')
+
+    def test_server_timing_and_metrics(self, profiled_app, tmp_path):
+        """测试响应包含 Server-Timing，/metrics 按接口汇总"""
+        client = profiled_app.test_client()
+        headers = {'Authorization': 'Bearer ' + client.post('/api/auth/register', json={
+            'username': 'profiler', 'email': 'p@example.com', 'password': 'password123'
+        }).json['access_token']}
+        create_snippet(client, headers)
+
+        response = client.get('/api/snippets', headers=headers)
+        timing = response.headers['Server-Timing']
+        assert 'db;dur=' in timing and 'serialize;dur=' in timing and 'total;dur=' in timing
+
+        assert client.get('/metrics').status_code == 401
+        assert client.get('/metrics', headers=headers).status_code == 401
+        metrics = client.get('/metrics', headers={'Authorization': 'Bearer scrape-token'}).get_data(as_text=True)
+        assert 'http_request_duration_seconds_count{method="GET",endpoint="api.get_snippets",status="200"} 1' in metrics
+        assert 'http_request_sql_statements_total{method="GET",endpoint="api.get_snippets"' in metrics
+        assert list(tmp_path.glob('*.prof'))
+
+    def test_disabled_by_default(self, client):
+        """测试默认不输出 Server-Timing 和 /metrics"""
+        assert 'Server-Timing' not in client.get('/api/health').headers
+        assert client.get('/metrics').status_code == 404
+
+
+class TestAsgi:
+    """测试 ASGI 部署模式"""
+
+    @staticmethod
+    def call(asgi_app, method, path, body=b'', headers=()):
+        """发送一个 ASGI 请求，返回 (状态码, 响应体)"""
+        import asyncio
+        messages = [{'type': 'http.request', 'body': body[:10], 'more_body': True},
+                    {'type': 'http.request', 'body': body[10:], 'more_body': False}]
+        sent = []
+
+        async def receive():
+            if messages:
+                return messages.pop(0)
+            await asyncio.sleep(3600)
+
+        async def send(message):
+            sent.append(message)
+
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': method,
+            'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'query_string': b'',
+            'root_path': '', 'server': ('testserver', 80), 'client': ('127.0.0.1', 5000),
+            'headers': [(k.lower().encode(), v.encode()) for k, v in headers],
+        }
+        asyncio.run(asgi_app(scope, receive, send))
+        status = sent[0]['status']
+        return status, b''.join(m.get('body', b'') for m in sent[1:])
+
+    def test_routes_served_through_asgi(self, app):
+        """测试 Flask 路由经 ASGI 适配后行为不变（请求体分块到达）"""
+        pytest.importorskip('a2wsgi')
+        from app.asgi import create_asgi_app
+        asgi_app = create_asgi_app(app)
+
+        payload = json.dumps({'username': 'asgi', 'email': 'asgi@example.com', 'password': 'password123'})
+        status, body = self.call(asgi_app, 'POST', '/api/auth/register', payload.encode(),
+                                 [('Content-Type', 'application/json'), ('Content-Length', str(len(payload)))])
+        assert status == 201
+        token = json.loads(body)['access_token']
+
+        status, body = self.call(asgi_app, 'GET', '/api/stats', headers=[('Authorization', f'Bearer {token}')])
+        assert status == 200
+        assert json.loads(body)['total'] == 0
+
+    def test_chunked_body_size_limited(self, app):
+        """测试没有 Content-Length 的请求体按读到的字节数限制大小"""
+        pytest.importorskip('a2wsgi')
+        from app.asgi import create_asgi_app
+        app.config['MAX_CONTENT_LENGTH'] = 64
+        asgi_app = create_asgi_app(app)
+
+        status, body = self.call(asgi_app, 'POST', '/api/auth/login', b'x' * 65,
+                                 [('Content-Type', 'application/json'), ('Transfer-Encoding', 'chunked')])
+        assert status == 413
+        status, _ = self.call(asgi_app, 'POST', '/api/auth/login', b'{}',
+                              [('Content-Type', 'application/json'), ('Transfer-Encoding', 'chunked')])
+        assert status == 400
+
+
+class TestReadReplicas:
+    """测试只读副本路由"""
+
+    @pytest.fixture
+    def replica_app(self, make_app, tmp_path):
+        """主库和一个空的副本库（不复制数据，便于区分查询落在哪个库）"""
+        app = make_app(SQLALCHEMY_DATABASE_URI='sqlite:///' + str(tmp_path / 'primary.db'),
+                       DATABASE_REPLICA_URLS='sqlite:///' + str(tmp_path / 'replica.db'))
+        db.metadata.create_all(app.extensions['db_replicas'].engines[0])
+        return app
+
+    def test_reads_routed_with_read_your_writes(self, replica_app):
+        """测试写后固定窗口内读主库，窗口外读副本"""
+        client = replica_app.test_client()
+        headers = {'Authorization': 'Bearer ' + client.post('/api/auth/register', json={
+            'username': 'replica', 'email': 'replica@example.com', 'password': 'password123'
+        }).json['access_token']}
+        create_snippet(client, headers)
+
+        # 刚写入：cookie 和进程内记录都把读请求固定在主库
+        assert len(client.get('/api/snippets', headers=headers).json) == 1
+
+        client.delete_cookie('db_pin')
+        replica_app.extensions['db_replicas']._pinned.clear()
+        assert client.get('/api/snippets', headers=headers).json == []
+        assert client.get('/api/stats', headers=headers).json['total'] == 0
+
+    def test_strategies(self):
+        """测试轮询和最少连接选择"""
+        from sqlalchemy import create_engine
+        from app.replicas import ReplicaSet
+
+        engines = [create_engine('sqlite://'), create_engine('sqlite://')]
+        round_robin = ReplicaSet(engines)
+        assert [round_robin.choose() for _ in range(3)] == [engines[0], engines[1], engines[0]]
+
+        least = ReplicaSet(engines, strategy='least_connections')
+        with engines[0].connect():
+            assert least.choose() is engines[1]
+
+
+class TestQueryPlans:
+    """
+    测试列表类接口的查询计划：不能出现全表扫描或额外排序
+    SQLite 总是运行；设置 TEST_POSTGRES_URL 时同时在 PostgreSQL 上运行
+    （PostgreSQL 关闭 enable_seqscan / enable_sort，小表上仍出现这些节点说明没有可用的索引）
+    """
+
+    # 搜索按相关度排序、标签按使用次数排序，排序不可避免，不在检查范围内
+    ENDPOINTS = (
+        '/api/snippets',
+        '/api/snippets?type=code',
+        '/api/snippets?favorite=true',
+        '/api/snippets?type=prompt&favorite=true',
+        '/api/snippets?limit=2',
+        '/api/snippets?tag=python',
+        '/api/snippets?tag=python,sql&tag_mode=all',
+        '/api/snippets/export',
+        '/api/stats',
+    )
+
+    @pytest.fixture(params=['sqlite', 'postgresql'])
+    def plan_app(self, request, make_app):
+        """在 SQLite 或 PostgreSQL 上创建应用"""
+        import os
+
+        url = 'sqlite:///:memory:'
+        if request.param == 'postgresql':
+            url = os.environ.get('TEST_POSTGRES_URL')
+            if not url:
+                pytest.skip('未设置 TEST_POSTGRES_URL')
+        return make_app(SQLALCHEMY_DATABASE_URI=url)
+
+    @staticmethod
+    def explain(statement, parameters):
+        """返回查询计划中的问题节点"""
+        connection = db.session.connection()
+        if connection.dialect.name == 'sqlite':
+            rows = connection.exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, parameters).all()
+            details = [row[-1] for row in rows]
+            return [d for d in details if d.startswith('SCAN ') or 'TEMP B-TREE FOR ORDER BY' in d]
+
+        connection.exec_driver_sql('SET LOCAL enable_seqscan = off')
+        connection.exec_driver_sql('SET LOCAL enable_sort = off')
+        rows = connection.exec_driver_sql('EXPLAIN ' + statement, parameters).all()
+        details = [row[0] for row in rows]
+        return [d for d in details if 'Seq Scan' in d or d.strip().lstrip('-> ').startswith('Sort')]
+
+    def test_list_queries_use_indexes(self, plan_app):
+        """测试每个接口的查询都走索引且不需要排序"""
+        from sqlalchemy import event
+        client = plan_app.test_client()
+        headers = {'Authorization': 'Bearer ' + client.post('/api/auth/register', json={
+            'username': 'planner', 'email': 'plan@example.com', 'password': 'password123'
+        }).json['access_token']}
+        for i in range(6):
+            create_snippet(client, headers, snippet_type='code' if i % 2 else 'prompt',
+                           is_favorite=i % 3 == 0, tags=['python', 'sql'][:i % 3])
+
+        statements = []
+
+        def capture(conn, cursor, statement, parameters, context, executemany):
+            if statement.lstrip().upper().startswith('SELECT'):
+                statements.append((statement, parameters))
+
+        for path in self.ENDPOINTS:
+            statements.clear()
+            event.listen(db.engine, 'before_cursor_execute', capture)
+            try:
+                response = client.get(path, headers=headers)
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', capture)
+            assert response.status_code == 200, path
+            assert statements, path
+
+            for statement, parameters in statements:
+                problems = self.explain(statement, parameters)
+                assert not problems, f'{path}: {" ".join(statement.split())}\n{problems}'
+            db.session.rollback()
+
+    def test_search_matches_substrings(self, plan_app):
+        """测试全文索引下仍能匹配词的一部分、中文子串和短词（与 LIKE 的匹配结果一致）"""
+        client = plan_app.test_client()
+        headers = {'Authorization': 'Bearer ' + client.post('/api/auth/register', json={
+            'username': 'searcher', 'email': 'search@example.com', 'password': 'password123'
+        }).json['access_token']}
+        create_snippet(client, headers, title='Configuration parser', content='def parse(): pass')
+        create_snippet(client, headers, title='数据库连接池', content='pool = create_pool()')
+        create_snippet(client, headers, title='Other', content='nothing here')
+
+        for term, title in (('parse', 'Configuration parser'), ('figur', 'Configuration parser'),
+                            ('PARSER', 'Configuration parser'), ('连接', '数据库连接池'),
+                            ('库连接池', '数据库连接池'), ('ool', '数据库连接池')):
+            response = client.get(f'/api/snippets?search={term}', headers=headers)
+            assert [s['title'] for s in response.json] == [title], term
+
+
+class TestContentStorage:
+    """片段正文去重和压缩测试"""
+
+    def test_identical_content_stored_once(self, client, auth_headers):
+        """相同正文只保存一份"""
+        from app.models import SnippetContent
+        first = create_snippet(client, auth_headers, title='一', content='boilerplate')
+        second = create_snippet(client, auth_headers, title='二', content='boilerplate')
+        response = client.post('/api/snippets/bulk', json=[{'title': '三', 'content': 'boilerplate'}],
+                               headers=auth_headers)
+        assert response.json['inserted'] == 1
+
+        assert SnippetContent.query.count() == 1
+        hashes = {s.content_hash for s in Snippet.query.all()}
+        assert len(hashes) == 1
+        assert db.session.get(Snippet, first['id']).content == db.session.get(Snippet, second['id']).content
+
+    def test_large_content_compressed(self, client, auth_headers):
+        """超过阈值的正文压缩保存，读取时透明解压"""
+        from app.models import SnippetContent
+        body = 'print("hello")\n' * 1000
+        snippet = create_snippet(client, auth_headers, content=body)
+        stored = SnippetContent.query.one()
+        assert stored.compression == 'zlib'
+        assert len(stored.data) < len(body)
+        assert stored.size == len(body)
+
+        assert client.get(f"/api/snippets/{snippet['id']}", headers=auth_headers).json['content'] == body
+        assert client.get('/api/snippets', headers=auth_headers).json[0]['content'] == body
+        exported = client.get('/api/snippets/export', headers=auth_headers).get_data(as_text=True)
+        assert json.loads(exported.splitlines()[0])['content'] == body
+        assert client.get('/api/snippets?search=hello', headers=auth_headers).json[0]['id'] == snippet['id']
+
+    def test_listing_without_content_skips_join(self, app, client, auth_headers):
+        """列表不请求 content 时不读取正文表"""
+        from sqlalchemy import event
+        create_snippet(client, auth_headers)
+        statements = []
+        listener = lambda conn, cursor, statement, *args: statements.append(statement)
+        event.listen(db.engine, 'before_cursor_execute', listener)
+        try:
+            client.get('/api/snippets?fields=id,title', headers=auth_headers)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', listener)
+        assert not any('snippet_contents' in statement for statement in statements)
+
+    def test_update_content_and_gc(self, client, auth_headers):
+        """修改正文后搜索使用新正文，片段删除后正文可被清理"""
+        from app.content import gc_contents
+        from app.models import SnippetContent
+        snippet = create_snippet(client, auth_headers, content='alpha original')
+        kept = create_snippet(client, auth_headers, content='kept body')
+        response = client.put(f"/api/snippets/{snippet['id']}", json={'content': 'gamma replaced'},
+                              headers=auth_headers)
+        assert response.json['content'] == 'gamma replaced'
+        assert client.get('/api/snippets?search=original', headers=auth_headers).json == []
+        assert len(client.get('/api/snippets?search=replaced', headers=auth_headers).json) == 1
+
+        # 历史版本的关键帧仍引用旧正文
+        assert gc_contents(min_age_minutes=0) == 0
+        client.delete(f"/api/snippets/{snippet['id']}", headers=auth_headers)
+        assert gc_contents(min_age_minutes=0) == 2
+        assert SnippetContent.query.one().text == kept['content']
+
+    def test_reuse_refreshes_gc_grace_period(self, app):
+        """复用已有正文时刷新 created_at，GC 宽限期保护正在写入的引用"""
+        from datetime import datetime, timedelta
+        from app.content import content_hash, gc_contents, store_contents
+        from app.models import SnippetContent
+        store_contents(['orphan body'])
+        db.session.commit()
+        row = db.session.get(SnippetContent, content_hash('orphan body'))
+        row.created_at = datetime.utcnow() - timedelta(days=1)
+        db.session.commit()
+
+        store_contents(['orphan body'])
+        db.session.commit()
+        db.session.expire_all()
+        assert gc_contents(min_age_minutes=60) == 0
+        assert db.session.get(SnippetContent, content_hash('orphan body')).created_at > \
+            datetime.utcnow() - timedelta(minutes=1)
+
+
+class TestRevisions:
+    """片段历史版本测试"""
+
+    def test_delta_round_trip(self):
+        """差异编码可以还原新版本"""
+        from app.revisions import apply_delta, encode_delta
+        old = 'line 1\nline 2\nline 3\n'
+        new = 'line 1\nline 2 changed\nline 3\nline 4'
+        assert apply_delta(old, encode_delta(old, new)) == new
+        assert apply_delta('', encode_delta('', new)) == new
+        assert apply_delta(old, encode_delta(old, '')) == ''
+
+    def test_revisions_listed_and_reconstructed(self, app, client, auth_headers):
+        """每次修改记录一个版本，关键帧之间保存差异，任意版本可重建"""
+        from app.models import SnippetRevision
+        app.config['REVISION_KEYFRAME_INTERVAL'] = 3
+        lines = [f'step {i}: do something useful\n' for i in range(50)]
+        snippet = create_snippet(client, auth_headers, title='v1', content=''.join(lines))
+        versions = [''.join(lines)]
+        for i in range(2, 8):
+            lines[i] = f'step {i}: edited in version {i}\n'
+            versions.append(''.join(lines))
+            client.put(f"/api/snippets/{snippet['id']}", json={'title': f'v{i}', 'content': versions[-1]},
+                       headers=auth_headers)
+
+        listing = client.get(f"/api/snippets/{snippet['id']}/revisions", headers=auth_headers).json
+        assert [item['number'] for item in listing] == list(range(7, 0, -1))
+        assert [item['is_keyframe'] for item in reversed(listing)] == [True, False, False, True, False, False, True]
+        assert SnippetRevision.query.filter(SnippetRevision.delta.isnot(None)).count() == 4
+
+        for number, content in enumerate(versions, 1):
+            revision = client.get(f"/api/snippets/{snippet['id']}/revisions/{number}", headers=auth_headers).json
+            assert revision['content'] == content
+            assert revision['title'] == f'v{number}'
+
+        response = client.get(f"/api/snippets/{snippet['id']}/revisions/99", headers=auth_headers)
+        assert response.status_code == 404
+
+    def test_unchanged_update_not_recorded(self, client, auth_headers):
+        """只修改收藏等不记录版本的字段时不产生版本"""
+        snippet = create_snippet(client, auth_headers)
+        client.put(f"/api/snippets/{snippet['id']}", json={'is_favorite': True}, headers=auth_headers)
+        assert client.get(f"/api/snippets/{snippet['id']}/revisions", headers=auth_headers).json == []
+
+    def test_batch_update_recorded(self, client, auth_headers):
+        """批量修改版本字段时记录修改前后的版本，只修改收藏不记录"""
+        snippets = [create_snippet(client, auth_headers, title=f'旧{i}', content=f'body {i}') for i in range(2)]
+        ids = [snippet['id'] for snippet in snippets]
+        client.put(f"/api/snippets/{ids[0]}", json={'title': '改过'}, headers=auth_headers)
+        response = client.post('/api/snippets/batch', json={'operations': [
+            {'op': 'update', 'ids': ids, 'fields': {'title': '批量', 'language': 'go'}},
+            {'op': 'favorite', 'ids': ids},
+        ]}, headers=auth_headers)
+        assert response.status_code == 200
+
+        for snippet_id, titles in ((ids[0], ['旧0', '改过', '批量']), (ids[1], ['旧1', '批量'])):
+            listing = client.get(f"/api/snippets/{snippet_id}/revisions", headers=auth_headers).json
+            assert [item['number'] for item in listing] == list(range(len(titles), 0, -1))
+            for number, title in enumerate(titles, 1):
+                revision = client.get(f"/api/snippets/{snippet_id}/revisions/{number}", headers=auth_headers).json
+                assert revision['title'] == title
+                assert revision['content'] == f'body {ids.index(snippet_id)}'
+            assert revision['language'] == 'go'
+
+        # 值没有变化的批量修改不产生版本
+        client.post('/api/snippets/batch', json={'operations': [
+            {'op': 'update', 'ids': ids, 'fields': {'title': '批量'}}
+        ]}, headers=auth_headers)
+        assert len(client.get(f"/api/snippets/{ids[1]}/revisions", headers=auth_headers).json) == 2
+
+    def test_retention_keeps_chain_reconstructable(self, app, client, auth_headers):
+        """超过保留数量时删除旧版本，保留的最早版本转为关键帧"""
+        app.config['REVISION_KEYFRAME_INTERVAL'] = 10
+        app.config['REVISION_MAX_COUNT'] = 3
+        base = ''.join(f'line {i}\n' for i in range(40))
+        snippet = create_snippet(client, auth_headers, content=base)
+        for i in range(1, 6):
+            client.put(f"/api/snippets/{snippet['id']}", json={'content': base + f'tail {i}\n'},
+                       headers=auth_headers)
+
+        listing = client.get(f"/api/snippets/{snippet['id']}/revisions", headers=auth_headers).json
+        assert [item['number'] for item in listing] == [6, 5, 4]
+        assert listing[-1]['is_keyframe']
+        revision = client.get(f"/api/snippets/{snippet['id']}/revisions/5", headers=auth_headers).json
+        assert revision['content'] == base + 'tail 4\n'
+
+    def test_other_users_revisions_hidden(self, client, auth_headers):
+        """不能查看其他用户片段的版本"""
+        snippet = create_snippet(client, auth_headers)
+        client.put(f"/api/snippets/{snippet['id']}", json={'title': 'changed'}, headers=auth_headers)
+        other = client.post('/api/auth/register', json={
+            'username': 'other', 'email': 'other@example.com', 'password': 'password123'
+        }).json['access_token']
+        response = client.get(f"/api/snippets/{snippet['id']}/revisions",
+                              headers={'Authorization': f'Bearer {other}'})
+        assert response.status_code == 404
+
+
+class TestFuzzySearch:
+    """模糊搜索测试"""
+
+    @pytest.fixture
+    def snippets(self, client, auth_headers):
+        create_snippet(client, auth_headers, title='Quick sort algorithm', tags=['python', 'sorting'])
+        create_snippet(client, auth_headers, title='Binary search tree', tags=['python'])
+        create_snippet(client, auth_headers, title='React hooks example', tags=['javascript'])
+
+    def test_typo_ranked_by_similarity(self, client, auth_headers, snippets):
+        """拼写错误的查询按相似度返回"""
+        response = client.get('/api/snippets?match=fuzzy&search=quik sort', headers=auth_headers)
+        assert response.status_code == 200
+        assert [item['title'] for item in response.json] == ['Quick sort algorithm']
+
+        # 精确模式找不到
+        assert client.get('/api/snippets?search=quik sort', headers=auth_headers).json == []
+
+    def test_partial_prefix(self, client, auth_headers, snippets):
+        """输入中的前缀可以匹配（边输入边搜索）"""
+        response = client.get('/api/snippets?match=fuzzy&search=binar', headers=auth_headers)
+        assert response.json[0]['title'] == 'Binary search tree'
+
+    def test_fuzzy_tag(self, client, auth_headers, snippets):
+        """标签拼写错误时匹配最相似的已有标签"""
+        response = client.get('/api/snippets?match=fuzzy&tag=pyhton', headers=auth_headers)
+        assert len(response.json) == 2
+        assert client.get('/api/snippets?tag=pyhton', headers=auth_headers).json == []
+
+    def test_index_rebuilt_after_write(self, client, auth_headers, snippets):
+        """写操作之后索引包含新片段"""
+        client.get('/api/snippets?match=fuzzy&search=hooks', headers=auth_headers)
+        create_snippet(client, auth_headers, title='Custom hooks guide')
+        response = client.get('/api/snippets?match=fuzzy&search=hooks', headers=auth_headers)
+        assert {item['title'] for item in response.json} == {'React hooks example', 'Custom hooks guide'}
+
+    def test_budget_truncates(self, app, client, auth_headers, snippets):
+        """超出时间预算时返回截断标记"""
+        app.config['FUZZY_SEARCH_BUDGET_MS'] = -1
+        response = client.get('/api/snippets?match=fuzzy&search=quick', headers=auth_headers)
+        assert response.status_code == 200
+        assert response.headers['X-Search-Truncated'] == 'true'
+
+    def test_invalid_match(self, client, auth_headers):
+        """match 参数无效时返回 400"""
+        response = client.get('/api/snippets?match=regex&search=x', headers=auth_headers)
+        assert response.status_code == 400
+
+
+class TestEmbeddings:
+    """测试相似片段搜索"""
+
+    @pytest.fixture
+    def embedding_client(self, make_app, tmp_path):
+        """启用向量搜索、请求结束前执行后台任务的客户端和认证头"""
+        pytest.importorskip('numpy')
+        client = make_app(EMBEDDINGS_ENABLED=True, EMBEDDING_DIR=str(tmp_path / 'embeddings')).test_client()
+        token = client.post('/api/auth/register', json={
+            'username': 'vector', 'email': 'vector@example.com', 'password': 'password123'
+        }).json['access_token']
+        return client, {'Authorization': f'Bearer {token}'}
+
+    def test_similar_by_query_and_snippet(self, embedding_client):
+        """测试按查询文本和按片段查找，按片段查找时不含其本身"""
+        client, headers = embedding_client
+        sql = create_snippet(client, headers, title='查询订单', content='SELECT id, total FROM orders WHERE total > 100')
+        create_snippet(client, headers, title='订单汇总', content='SELECT customer, SUM(total) FROM orders GROUP BY customer')
+        create_snippet(client, headers, title='写作提示', content='Write a friendly birthday poem', snippet_type='prompt')
+
+        found = client.get('/api/snippets/similar?q=orders total&k=2', headers=headers).json
+        assert [s['title'] for s in found] == ['查询订单', '订单汇总']
+        assert found[0]['score'] >= found[1]['score']
+
+        found = client.get(f"/api/snippets/similar?id={sql['id']}&k=5", headers=headers).json
+        assert sql['id'] not in [s['id'] for s in found]
+        assert found[0]['title'] == '订单汇总'
+
+        found = client.get('/api/snippets/similar?q=orders&type=prompt', headers=headers).json
+        assert all(s['snippet_type'] == 'prompt' for s in found)
+
+    def test_vectors_follow_writes(self, embedding_client):
+        """测试修改、删除和批量导入后向量随之更新"""
+        client, headers = embedding_client
+        snippet = create_snippet(client, headers, title='排序', content='sorted(items, key=len)')
+        client.put(f"/api/snippets/{snippet['id']}", json={'content': 'docker compose up -d'}, headers=headers)
+        assert client.get('/api/snippets/similar?q=docker compose', headers=headers).json[0]['id'] == snippet['id']
+
+        client.post('/api/snippets/bulk', json=[{'title': '容器', 'content': 'docker ps -a'}], headers=headers)
+        assert len(client.get('/api/snippets/similar?q=docker', headers=headers).json) == 2
+
+        client.delete(f"/api/snippets/{snippet['id']}", headers=headers)
+        store = client.application.extensions['embeddings'].store
+        assert snippet['id'] not in store.ids(1)
+
+    def test_batch_reembeds_changed_text_only(self, embedding_client, monkeypatch):
+        """测试批量修改只为标题或描述实际改变的片段重新计算向量"""
+        import app.routes
+        client, headers = embedding_client
+        ids = [create_snippet(client, headers, title=title)['id'] for title in ('同名', '同名', '别名')]
+        scheduled = []
+        monkeypatch.setattr(app.routes, 'schedule_embedding', lambda snippet_ids: scheduled.extend(snippet_ids))
+
+        client.post('/api/snippets/batch', json={'operations': [
+            {'op': 'update', 'ids': ids, 'fields': {'title': '同名'}},
+            {'op': 'update', 'ids': ids, 'fields': {'language': 'go'}},
+            {'op': 'update', 'ids': [ids[0]], 'fields': {'description': '已删除'}},
+            {'op': 'delete', 'ids': [ids[0]]},
+        ]}, headers=headers)
+        assert scheduled == [ids[2]]
+
+    def test_validation_and_disabled(self, embedding_client, client, auth_headers):
+        """测试参数校验，未启用时返回404"""
+        embedding, headers = embedding_client
+        assert embedding.get('/api/snippets/similar', headers=headers).status_code == 400
+        assert embedding.get('/api/snippets/similar?q=x&k=0', headers=headers).status_code == 400
+        assert embedding.get('/api/snippets/similar?id=9999', headers=headers).status_code == 404
+        assert client.get('/api/snippets/similar?q=x', headers=auth_headers).status_code == 404
+
+
+class TestJobs:
+    """后台任务队列测试"""
+
+    @pytest.fixture
+    def flaky(self):
+        """注册一个前 fail_times 次失败的测试任务"""
+        from app.jobs import job
+        calls = []
+
+        @job('test.flaky')
+        def flaky_job(value, fail_times=0):
+            calls.append(value)
+            if len(calls) <= fail_times:
+                raise RuntimeError('boom')
+        return calls
+
+    def test_idempotency_key_dedupes_queued_jobs(self, app, flaky):
+        """相同 key 的任务排队期间只保留一个，执行成功后删除"""
+        from app.jobs import enqueue, run_pending
+        from app.models import Job
+        assert enqueue('test.flaky', {'value': 1}, key='k')
+        assert not enqueue('test.flaky', {'value': 2}, key='k')
+        enqueue('test.flaky', {'value': 3})
+        db.session.commit()
+
+        assert run_pending() == 2
+        assert flaky == [1, 3]
+        assert Job.query.count() == 0
+        with pytest.raises(ValueError):
+            enqueue('test.unknown')
+
+    def test_retry_backoff_then_failed(self, app, flaky):
+        """失败后按退避时间重试，超过最大次数后标记为失败，可重新排队"""
+        from datetime import datetime, timedelta
+        from app.jobs import enqueue, retry_failed, run_pending
+        from app.models import Job
+        app.config['JOB_MAX_ATTEMPTS'] = 2
+        enqueue('test.flaky', {'value': 1, 'fail_times': 5})
+        db.session.commit()
+
+        run_pending()
+        job = Job.query.one()
+        assert (job.status, job.attempts) == ('queued', 1)
+        assert job.run_at > datetime.utcnow() + timedelta(seconds=1)
+        assert 'boom' in job.last_error
+        assert run_pending() == 0
+
+        job.run_at = datetime.utcnow()
+        db.session.commit()
+        run_pending()
+        assert db.session.get(Job, job.id).status == 'failed'
+
+        assert retry_failed() == 1
+        db.session.commit()
+        assert db.session.get(Job, job.id).status == 'queued'
+
+    def test_stale_running_job_reclaimed(self, app, flaky):
+        """执行超时（worker 崩溃）的任务重新领取"""
+        from datetime import datetime, timedelta
+        from app.jobs import enqueue, run_pending
+        from app.models import Job
+        enqueue('test.flaky', {'value': 1})
+        db.session.commit()
+        job = Job.query.one()
+        job.status, job.locked_at = 'running', datetime.utcnow()
+        db.session.commit()
+        assert run_pending() == 0
+
+        job.locked_at = datetime.utcnow() - timedelta(seconds=app.config['JOB_LOCK_TIMEOUT'] + 1)
+        db.session.commit()
+        assert run_pending() == 1
+        assert flaky == [1]
+
+    def test_revision_deltas_computed_by_worker(self, app, client, auth_headers):
+        """worker 模式下写请求只入队，差异由任务计算"""
+        from app.jobs import run_pending
+        app.extensions['jobs'].mode = 'worker'
+        base = ''.join(f'line {i}\n' for i in range(40))
+        snippet = create_snippet(client, auth_headers, content=base)
+        client.put(f"/api/snippets/{snippet['id']}", json={'content': base + 'tail\n'}, headers=auth_headers)
+
+        url = f"/api/snippets/{snippet['id']}/revisions"
+        assert [r['is_keyframe'] for r in client.get(url, headers=auth_headers).json] == [True, True]
+        assert client.get('/api/metrics/jobs').status_code == 404
+        app.config['JOB_METRICS_ENABLED'] = True
+        assert client.get('/api/metrics/jobs').json['queued'] == 1
+
+        assert run_pending() == 1
+        assert [r['is_keyframe'] for r in client.get(url, headers=auth_headers).json] == [False, True]
+        assert client.get(f'{url}/2', headers=auth_headers).json['content'] == base + 'tail\n'
+
+
+class TestConnectionPool:
+    """测试连接池配置和指标"""
+
+    def test_engine_options_for_postgres(self, app):
+        """测试 PostgreSQL 使用可配置的连接池参数"""
+        from app.pool import InstrumentedQueuePool, engine_options
+
+        config = dict(app.config, SQLALCHEMY_DATABASE_URI='postgresql://u:p@db/snippets',
+                      SQLALCHEMY_ENGINE_OPTIONS={}, DB_POOL_SIZE=8, DB_PGBOUNCER=False)
+        options = engine_options(config)
+        assert options['poolclass'] is InstrumentedQueuePool
+        assert options['pool_size'] == 8
+        assert options['pool_pre_ping'] is True
+
+        config['DB_PGBOUNCER'] = True
+        assert 'pool_size' not in engine_options(config)
+
+    def test_pool_metrics_endpoint(self, app, client):
+        """测试连接池指标端点需要显式开启"""
+        assert client.get('/api/metrics/pool').status_code == 404
+
+        app.config['POOL_METRICS_ENABLED'] = True
+        client.get('/api/health')
+        response = client.get('/api/metrics/pool')
+        assert response.status_code == 200
+        assert response.json['checkouts'] >= 1
+
+
 class TestDataPersistence:
     """测试数据持久性"""
 